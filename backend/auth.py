@@ -2,7 +2,7 @@ from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import os
 
@@ -12,7 +12,17 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 jours
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-security = HTTPBearer()
+security = HTTPBearer(auto_error=False)
+
+# Clé de scope["state"] posée par /api/batch sur ses sous-requêtes : l'utilisateur
+# est authentifié une fois pour tout le lot. Objet propre au module : aucun
+# autre code (middleware, en-tête, client) ne peut produire cette clé.
+_BATCH_USER = object()
+
+
+def batch_state(user_id: str) -> dict:
+    """scope["state"] d'une sous-requête de lot, authentifiée pour user_id"""
+    return {_BATCH_USER: user_id}
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -46,7 +56,15 @@ def decode_token(token: str) -> dict:
         )
 
 
-async def get_current_user_id(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
+async def get_current_user_id(
+    request: Request,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)
+) -> str:
+    user_id = request.scope.get("state", {}).get(_BATCH_USER)
+    if user_id:
+        return user_id
+    if credentials is None:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authenticated")
     token = credentials.credentials
     payload = decode_token(token)
     user_id: str = payload.get("sub")
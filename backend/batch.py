@@ -0,0 +1,128 @@
+"""
+Exécution d'un lot de requêtes API en un seul aller-retour (/api/batch).
+
+Chaque opération est rejouée en interne sur l'application ASGI complète
+(mêmes routes, mêmes erreurs, mêmes en-têtes), sans passer par le réseau.
+L'utilisateur est authentifié une fois pour le lot et transmis aux
+sous-requêtes via scope["state"] (auth.batch_state). Les lectures consécutives (GET) sont
+exécutées en parallèle ; une écriture attend les opérations qui la
+précèdent et bloque celles qui la suivent, pour garder l'ordre du lot.
+"""
+import asyncio
+import os
+from typing import List
+
+import orjson
+
+from auth import batch_state
+from models import BatchOperation
+
+BATCH_MAX_OPERATIONS = int(os.environ.get("BATCH_MAX_OPERATIONS", 20))
+BATCH_TIMEOUT = float(os.environ.get("BATCH_TIMEOUT", 30))  # secondes par opération
+READ_METHODS = {"GET", "HEAD"}
+# En-têtes de la réponse repris dans le résultat
+RESULT_HEADERS = ("etag", "retry-after", "content-type")
+# En-têtes d'opération ignorés : le résultat est décodé en clair et la
+# longueur du corps est recalculée
+STRIPPED_HEADERS = {"accept-encoding", "content-length"}
+# Chemins refusés dans un lot : le lot lui-même et les flux sans fin
+EXCLUDED_PATHS = {"/api/batch", "/api/events"}
+
+
+def _error(status: int, detail: str) -> dict:
+    return {"status": status, "headers": {}, "body": {"detail": detail}}
+
+
+async def _dispatch(app, parent_scope: dict, operation: BatchOperation, user_id: str) -> dict:
+    path, _, query = operation.path.partition("?")
+    body = b"" if operation.body is None else orjson.dumps(operation.body)
+    headers = [
+        (name.lower().encode("latin-1"), value.encode("latin-1"))
+        for name, value in operation.headers.items()
+        if name.lower() not in STRIPPED_HEADERS
+    ]
+    if body:
+        headers += [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+
+    scope = {
+        "type": "http",
+        "asgi": parent_scope.get("asgi", {"version": "3.0"}),
+        "http_version": parent_scope.get("http_version", "1.1"),
+        "method": operation.method.upper(),
+        "scheme": parent_scope.get("scheme", "http"),
+        "server": parent_scope.get("server"),
+        "client": parent_scope.get("client"),
+        "root_path": parent_scope.get("root_path", ""),
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "headers": headers,
+        "state": batch_state(user_id),
+    }
+
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return {"type": "http.disconnect"}
+
+    status = 500
+    response_headers = {}
+    chunks = []
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            for name, value in message.get("headers", []):
+                name = name.decode("latin-1").lower()
+                if name in RESULT_HEADERS:
+                    response_headers[name] = value.decode("latin-1")
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    try:
+        await asyncio.wait_for(app(scope, receive, send), BATCH_TIMEOUT)
+        content = b"".join(chunks)
+        if not content:
+            result_body = None
+        elif response_headers.get("content-type", "").startswith("application/json"):
+            result_body = orjson.loads(content)
+        else:
+            result_body = content.decode("utf-8", errors="replace")
+    except asyncio.TimeoutError:
+        return _error(504, "Délai dépassé")
+    except Exception:
+        # Erreur de l'application (déjà journalisée) ou réponse illisible :
+        # seule cette opération échoue, le reste du lot continue
+        return _error(500, "Internal Server Error")
+    return {"status": status, "headers": response_headers, "body": result_body}
+
+
+async def run_batch(app, parent_scope: dict, operations: List[BatchOperation], user_id: str) -> List[dict]:
+    results = [None] * len(operations)
+    pending_reads = []
+
+    async def flush_reads():
+        if pending_reads:
+            outcomes = await asyncio.gather(
+                *(_dispatch(app, parent_scope, operations[i], user_id) for i in pending_reads)
+            )
+            for i, outcome in zip(pending_reads, outcomes):
+                results[i] = outcome
+            pending_reads.clear()
+
+    for i, operation in enumerate(operations):
+        path = operation.path.partition("?")[0]
+        if not path.startswith("/api/") or path.rstrip("/") in EXCLUDED_PATHS:
+            results[i] = _error(400, "Chemin non autorisé dans un lot")
+        elif operation.method.upper() in READ_METHODS:
+            pending_reads.append(i)
+        else:
+            await flush_reads()
+            results[i] = await _dispatch(app, parent_scope, operation, user_id)
+    await flush_reads()
+    return results
@@ -0,0 +1,74 @@
+"""
+Benchmark de propagation du bus d'invalidation (collection plafonnée +
+curseur tailable) : deux bus, chacun avec son propre client Mongo, jouent
+deux workers. Le premier publie, on mesure le délai jusqu'à l'appel du
+handler du second. Objectif : moins de 100 ms.
+
+Nécessite un MongoDB réel (les curseurs tailables ne sont pas simulés) ;
+utilise une base jetable supprimée à la fin.
+
+Usage (depuis backend/) : MONGO_URL=mongodb://localhost:27017 python benchmarks/bench_invalidation.py [messages] [intervalle_ms]
+"""
+import asyncio
+import os
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+
+from invalidation import InvalidationBus, MongoCappedBackend  # noqa: E402
+
+
+async def run(messages: int, interval: float):
+    mongo_url = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+    db_name = f"bench_invalidation_{uuid.uuid4().hex[:8]}"
+    publisher_client, subscriber_client = AsyncIOMotorClient(mongo_url), AsyncIOMotorClient(mongo_url)
+    publisher = InvalidationBus(MongoCappedBackend(publisher_client[db_name]))
+    subscriber = InvalidationBus(MongoCappedBackend(subscriber_client[db_name]))
+
+    sent = {}
+    latencies = []
+    done = asyncio.Event()
+
+    def on_message(key, payload):
+        latencies.append(time.perf_counter() - sent[key])
+        if len(latencies) == messages:
+            done.set()
+
+    subscriber.subscribe("bench", on_message)
+    try:
+        await publisher.start()
+        await subscriber.start()
+        await asyncio.sleep(0.5)  # curseur du second « worker » ouvert
+        for i in range(messages):
+            key = str(i)
+            sent[key] = time.perf_counter()
+            await publisher.publish("bench", key)
+            await asyncio.sleep(interval)
+        await asyncio.wait_for(done.wait(), 10)
+    finally:
+        await publisher.stop()
+        await subscriber.stop()
+        await publisher_client.drop_database(db_name)
+        publisher_client.close()
+        subscriber_client.close()
+
+    latencies_ms = sorted(latency * 1000 for latency in latencies)
+    p95 = latencies_ms[int(len(latencies_ms) * 0.95) - 1]
+    print(f"{'messages':<12}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    print(f"{messages:<12}{statistics.median(latencies_ms):>10.1f}{p95:>10.1f}{latencies_ms[-1]:>10.1f}")
+    print("objectif < 100 ms :", "atteint" if p95 < 100 else "NON atteint")
+
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    interval = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.01
+    asyncio.run(run(messages, interval))
+
+
+if __name__ == "__main__":
+    main()
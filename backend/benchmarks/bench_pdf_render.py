@@ -0,0 +1,84 @@
+"""
+Benchmark du rendu PDF : styles reconstruits à chaque rendu (ancien
+comportement des endpoints) contre styles partagés construits à l'import.
+
+Usage (depuis backend/) : python benchmarks/bench_pdf_render.py [iterations]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reportlab.platypus import TableStyle  # noqa: E402
+
+import pdf_templates  # noqa: E402
+from benchmarks.fixtures import ENTREPRISE, make_devis_doc, make_facture_doc  # noqa: E402
+
+
+def rebuild_styles():
+    """Travail refait à chaque requête avant la mutualisation des styles"""
+    pdf_templates._build_styles()
+    TableStyle(pdf_templates.HEADER_TABLE_STYLE.getCommands())
+    TableStyle(pdf_templates.CLIENT_BOX_STYLE.getCommands())
+    for style in pdf_templates.POSTES_CHUNK_STYLES.values():
+        TableStyle(style.getCommands())
+    TableStyle(pdf_templates.TOTALS_TABLE_STYLE.getCommands())
+    TableStyle(pdf_templates.SIGNATURE_TABLE_STYLE.getCommands())
+
+
+def measure(kind, doc, iterations, per_render_styles):
+    # Échauffement (polices, caches ReportLab)
+    pdf_templates.render_pdf(kind, doc, ENTREPRISE)
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        if per_render_styles:
+            rebuild_styles()
+        pdf_templates.render_pdf(kind, doc, ENTREPRISE)
+    elapsed = (time.perf_counter() - start) / iterations
+
+    tracemalloc.start()
+    if per_render_styles:
+        rebuild_styles()
+    pdf_templates.render_pdf(kind, doc, ENTREPRISE)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def measure_styles(iterations):
+    """Coût isolé de la construction des styles (économisé à chaque rendu)"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        rebuild_styles()
+    elapsed = (time.perf_counter() - start) / iterations
+
+    tracemalloc.start()
+    rebuild_styles()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    cases = [
+        ("devis", make_devis_doc(10)),
+        ("devis", make_devis_doc(60)),
+        ("facture", make_facture_doc(10)),
+    ]
+    print(f"{'document':<24}{'mode':<8}{'ms/rendu':>10}{'pic KiB':>10}")
+    for kind, doc in cases:
+        label = f"{kind} ({len(doc['postes'])} postes)"
+        for mode, per_render in (("avant", True), ("après", False)):
+            elapsed, peak = measure(kind, doc, iterations, per_render)
+            print(f"{label:<24}{mode:<8}{elapsed * 1000:>10.2f}{peak / 1024:>10.1f}")
+
+    elapsed, peak = measure_styles(iterations)
+    print(f"\nConstruction des styles seule : {elapsed * 1000:.2f} ms, {peak / 1024:.1f} KiB alloués par rendu")
+
+
+if __name__ == "__main__":
+    main()
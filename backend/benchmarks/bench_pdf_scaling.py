@@ -0,0 +1,32 @@
+"""
+Benchmark de montée en charge du rendu PDF : temps de rendu d'un devis
+à 100, 1 000 et 5 000 postes. Le temps par poste doit rester stable.
+
+Usage (depuis backend/) : python benchmarks/bench_pdf_scaling.py [tailles...]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pdf_templates  # noqa: E402
+from benchmarks.fixtures import ENTREPRISE, make_devis_doc  # noqa: E402
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [100, 1000, 5000]
+    pdf_templates.render_pdf("devis", make_devis_doc(10), ENTREPRISE)  # échauffement
+
+    print(f"{'postes':>8}{'secondes':>10}{'ms/poste':>10}{'Ko PDF':>10}")
+    for size in sizes:
+        doc = make_devis_doc(size)
+        start = time.perf_counter()
+        buffer = pdf_templates.render_pdf("devis", doc, ENTREPRISE)
+        elapsed = time.perf_counter() - start
+        size_kb = buffer.getbuffer().nbytes / 1024
+        print(f"{size:>8}{elapsed:>10.2f}{elapsed * 1000 / size:>10.3f}{size_kb:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
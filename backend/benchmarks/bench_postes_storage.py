@@ -0,0 +1,59 @@
+"""
+Benchmark du stockage compact des postes : taille BSON d'un devis et de sa
+facture (qui recopie les postes) en format complet et en format compact,
+taille de la collection de descripteurs et volume écrit par le $set des
+postes lors d'une mise à jour.
+
+Usage (depuis backend/) : python benchmarks/bench_postes_storage.py [nb_devis] [postes_par_devis]
+"""
+import os
+import sys
+
+import bson
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fixtures import make_devis_doc  # noqa: E402
+from postes_store import split_poste  # noqa: E402
+
+
+def compact_doc(doc: dict, descriptors: dict) -> dict:
+    postes = []
+    for poste in doc["postes"]:
+        stored, descriptor = split_poste(poste)
+        descriptors[stored["d"]] = descriptor
+        postes.append(stored)
+    return {**doc, "postes": postes}
+
+
+def main():
+    nb_devis = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    nb_postes = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+
+    full_bytes = compact_bytes = full_set = compact_set = 0
+    descriptors = {}
+    for seed in range(nb_devis):
+        doc = make_devis_doc(nb_postes, seed=seed)
+        compact = compact_doc(doc, descriptors)
+        # Devis + facture (mêmes postes)
+        full_bytes += 2 * len(bson.encode(doc))
+        compact_bytes += 2 * len(bson.encode(compact))
+        full_set += len(bson.encode({"$set": {"postes": doc["postes"]}}))
+        compact_set += len(bson.encode({"$set": {"postes": compact["postes"]}}))
+
+    descriptor_bytes = sum(len(bson.encode({"_id": key, **d})) for key, d in descriptors.items())
+    total_compact = compact_bytes + descriptor_bytes
+
+    print(f"{nb_devis} devis (+ factures) de {nb_postes} postes")
+    print(f"{'':<28}{'complet':>12}{'compact':>12}{'gain':>8}")
+    print(f"{'documents (Ko)':<28}{full_bytes / 1024:>12.0f}{total_compact / 1024:>12.0f}"
+          f"{1 - total_compact / full_bytes:>8.0%}")
+    print(f"{'octets par poste stocké':<28}{full_bytes / (2 * nb_devis * nb_postes):>12.0f}"
+          f"{compact_bytes / (2 * nb_devis * nb_postes):>12.0f}")
+    print(f"{'$set des postes (o/devis)':<28}{full_set / nb_devis:>12.0f}{compact_set / nb_devis:>12.0f}"
+          f"{1 - compact_set / full_set:>8.0%}")
+    print(f"descripteurs : {len(descriptors)} ({descriptor_bytes / 1024:.1f} Ko, gardés en mémoire)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark de sérialisation des réponses JSON : chemin standard de FastAPI
+(modèle Pydantic validé, revalidé contre response_model puis encodé par
+json) contre le chemin rapide (trusted() + FastJSONResponse / orjson).
+
+Cas mesurés : liste de devis, lecture et création d'un devis de taille
+croissante. Temps médian par réponse, en millisecondes.
+
+Usage (depuis backend/) : python benchmarks/bench_serialization.py [répétitions]
+"""
+import asyncio
+import os
+import statistics
+import sys
+import time
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_response_field  # noqa: E402
+
+from benchmarks.fixtures import make_devis_doc  # noqa: E402
+from models import Devis, DevisListItem  # noqa: E402
+from responses import FastJSONResponse, trusted  # noqa: E402
+
+
+def median_ms(func, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def standard(loop, field, build):
+    """Chemin par défaut : construction validée, revalidation, json.dumps"""
+    def run():
+        content = loop.run_until_complete(
+            serialize_response(field=field, response_content=build(), is_coroutine=True)
+        )
+        return JSONResponse(content).body
+    return run
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    devis_field = create_response_field(name="devis", type_=Devis)
+    list_field = create_response_field(name="devis_list", type_=List[DevisListItem])
+
+    list_docs = [make_devis_doc(5, seed=i) for i in range(100)]
+    list_items = [{
+        "id": d["id"], "numero_devis": d["numero_devis"], "client_nom": d["client"]["nom"],
+        "date_creation": d["date_creation"], "total_ttc": d["total_ttc"], "statut": d["statut"],
+    } for d in list_docs]
+
+    cases = [("liste (100 devis)", list_field, lambda: [DevisListItem(**item) for item in list_items],
+              lambda: FastJSONResponse(list_items).body)]
+    for size in (10, 100, 1000, 5000):
+        doc = make_devis_doc(size)
+        cases.append((f"lecture ({size} postes)", devis_field, lambda doc=doc: Devis(**doc),
+                      lambda doc=doc: FastJSONResponse(trusted(Devis, doc)).body))
+        model = Devis(**doc)
+        # Création : le modèle est déjà validé, seule la réponse diffère
+        cases.append((f"création ({size} postes)", devis_field, lambda model=model: model,
+                      lambda model=model: FastJSONResponse(model).body))
+
+    loop = asyncio.new_event_loop()
+    print(f"{'cas':<24}{'standard ms':>12}{'rapide ms':>12}{'gain':>8}")
+    for label, field, build, fast in cases:
+        slow_ms = median_ms(standard(loop, field, build), repeat)
+        fast_ms = median_ms(fast, repeat)
+        print(f"{label:<24}{slow_ms:>12.2f}{fast_ms:>12.2f}{slow_ms / fast_ms:>7.1f}x")
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Jeux de données réalistes pour les benchmarks (devis, factures, entreprise).
+"""
+import random
+import uuid
+from datetime import datetime, timedelta
+
+CATALOGUE = [
+    ("cuisine", "Équipée (Pose + Fourniture)", "forfait", 2900.0, 3800.0),
+    ("cuisine", "Plan de travail Granite (Pose + Fourniture)", "m²", 350.0, 600.0),
+    ("cuisine", "Crédence carrelage", "m²", 40.0, 90.0),
+    ("cloison", "Plaque de plâtre BA13 (Pose + Fourniture)", "m²", 35.0, 60.0),
+    ("cloison", "Isolation phonique", "m²", 8.0, 20.0),
+    ("peinture", "Peinture murs - 2 couches acrylique mate", "m²", 20.0, 35.0),
+    ("peinture", "Préparation des supports : rebouchage, ponçage et sous-couche d'impression", "m²", 8.0, 15.0),
+    ("parquet", "Stratifié AC4 (Fourniture)", "m²", 15.0, 40.0),
+    ("parquet", "Pose flottante avec sous-couche acoustique", "m²", 15.0, 30.0),
+    ("autre", "Dépose et évacuation de l'existant", "forfait", 150.0, 600.0),
+    ("service", "Déplacement (0,55 €/km)", "km", 0.55, 0.55),
+]
+
+ENTREPRISE = {
+    "nom": "Rénov'Pro SARL",
+    "adresse": "12 rue des Artisans",
+    "code_postal": "69003",
+    "ville": "Lyon",
+    "telephone": "04 78 00 00 00",
+    "email": "contact@renovpro.fr",
+    "siret": "123 456 789 00012",
+    "tva_intracom": "FR12345678901",
+    "conditions_paiement": {"type": "acomptes", "delai_jours": 30, "acomptes": [
+        {"pourcentage": 30, "delai_jours": 0, "description": "À la commande"},
+        {"pourcentage": 70, "delai_jours": 30, "description": "À la livraison"},
+    ]},
+}
+
+
+def make_postes(n: int, devis_id: str, seed: int = 42) -> list:
+    rng = random.Random(seed)
+    postes = []
+    for _ in range(n):
+        categorie, nom, unite, prix_min, prix_max = rng.choice(CATALOGUE)
+        prix_default = (prix_min + prix_max) / 2
+        quantite = round(rng.uniform(1, 40), 2)
+        offert = rng.random() < 0.05
+        postes.append({
+            "id": str(uuid.uuid4()),
+            "devis_id": devis_id,
+            "categorie": categorie,
+            "reference_id": str(uuid.uuid5(uuid.NAMESPACE_URL, f"{categorie}/{nom}")),
+            "reference_nom": nom,
+            "quantite": quantite,
+            "unite": unite,
+            "prix_min": prix_min,
+            "prix_max": prix_max,
+            "prix_default": prix_default,
+            "prix_ajuste": prix_default,
+            "sous_total": quantite * prix_default,
+            "options": None,
+            "offert": offert,
+        })
+    return postes
+
+
+def make_devis_doc(n_postes: int, seed: int = 42) -> dict:
+    devis_id = str(uuid.uuid4())
+    postes = make_postes(n_postes, devis_id, seed)
+    total_ttc = sum(p["sous_total"] for p in postes if not p["offert"])
+    total_ht = total_ttc / 1.2
+    date_creation = datetime(2025, 1, 15, 10, 30)
+    return {
+        "id": devis_id,
+        "numero_devis": "DEV-20250115103000",
+        "user_id": str(uuid.uuid4()),
+        "client": {
+            "nom": "Martin", "prenom": "Claire", "adresse": "5 avenue Foch",
+            "code_postal": "69006", "ville": "Lyon",
+            "telephone": "06 00 00 00 00", "email": "claire.martin@example.com",
+        },
+        "date_creation": date_creation,
+        "date_validite": date_creation + timedelta(days=30),
+        "tva_taux": 20.0,
+        "total_ht": round(total_ht, 2),
+        "total_tva": round(total_ttc - total_ht, 2),
+        "total_ttc": round(total_ttc, 2),
+        "statut": "valide",
+        "conditions_paiement": ENTREPRISE["conditions_paiement"],
+        "notes": "Accès au chantier par la cour intérieure.",
+        "postes": postes,
+    }
+
+
+def make_facture_doc(n_postes: int, seed: int = 42) -> dict:
+    devis = make_devis_doc(n_postes, seed)
+    return {
+        "id": str(uuid.uuid4()),
+        "numero_facture": "FAC-20250201090000",
+        "devis_id": devis["id"],
+        "devis_numero": devis["numero_devis"],
+        "user_id": devis["user_id"],
+        "client": devis["client"],
+        "date_creation": datetime(2025, 2, 1, 9, 0),
+        "date_paiement": None,
+        "tva_taux": devis["tva_taux"],
+        "total_ht": devis["total_ht"],
+        "total_tva": devis["total_tva"],
+        "total_ttc": devis["total_ttc"],
+        "statut": "en_attente",
+        "postes": devis["postes"],
+        "conditions_paiement": devis["conditions_paiement"],
+        "notes": devis["notes"],
+    }
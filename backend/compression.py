@@ -0,0 +1,226 @@
+"""
+Compression des réponses HTTP (gzip, et Brotli si le module `brotli` est
+installé), négociée selon Accept-Encoding.
+
+CompressionMiddleware ne compresse que les types texte / JSON au-delà d'une
+taille minimale : les PDF, archives ZIP/XLSX et images sont déjà
+compressés, et les flux SSE doivent partir sans mise en mémoire tampon.
+Les réponses qui portent déjà Content-Encoding sont transmises telles
+quelles, ce qui permet de servir des corps précompressés (PrecompressedBody)
+sans les recompresser à chaque requête.
+"""
+import os
+import zlib
+from typing import Awaitable, Callable, Dict, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from singleflight import SingleFlight
+
+try:
+    import brotli
+except ImportError:  # Brotli facultatif : gzip seul
+    brotli = None
+
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", 1024))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4  # à la volée : bon compromis taux / CPU
+# Corps précompressés une seule fois : niveau maximal
+PRECOMPRESSED_GZIP_LEVEL = 9
+PRECOMPRESSED_BROTLI_QUALITY = 11
+
+COMPRESSIBLE_TYPES = {"application/json", "application/javascript", "application/xml", "image/svg+xml"}
+STREAMING_TYPES = {"text/event-stream"}
+
+
+def is_compressible(content_type: str) -> bool:
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    if media_type in STREAMING_TYPES:
+        return False
+    return media_type.startswith("text/") or media_type in COMPRESSIBLE_TYPES or media_type.endswith("+json")
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """« br », « gzip » ou None d'après Accept-Encoding (avec facteurs q)"""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[coding.strip().lower()] = weight
+
+    default = weights.get("*", 0.0)
+    candidates = (["br"] if brotli is not None else []) + ["gzip"]
+    best = max(candidates, key=lambda coding: weights.get(coding, default))  # à égalité : br
+    return best if weights.get(best, default) > 0 else None
+
+
+class _Encoder:
+    def __init__(self, encoding: str, level: int = None):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=level or BROTLI_QUALITY)
+        else:
+            self._compressor = zlib.compressobj(level or GZIP_LEVEL, zlib.DEFLATED, 31)  # 31 : en-tête gzip
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.process(data)
+        return self._compressor.compress(data)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def compress(data: bytes, encoding: str, level: int = None) -> bytes:
+    encoder = _Encoder(encoding, level)
+    return encoder.compress(data) + encoder.finish()
+
+
+def _vary_accept_encoding(headers: MutableHeaders):
+    vary = headers.get("vary")
+    if not vary:
+        headers["Vary"] = "Accept-Encoding"
+    elif "accept-encoding" not in vary.lower():
+        headers["Vary"] = f"{vary}, Accept-Encoding"
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _CompressingSender(send, encoding, self.minimum_size))
+
+
+class _CompressingSender:
+    """Compresse le corps de la réponse à mesure qu'il est envoyé"""
+
+    def __init__(self, send: Send, encoding: str, minimum_size: int):
+        self.send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start: Optional[Message] = None
+        self.encoder: Optional[_Encoder] = None
+        self.passthrough = False
+
+    async def __call__(self, message: Message):
+        if message["type"] == "http.response.start":
+            # Retenu jusqu'au premier morceau du corps (taille et type connus)
+            self.start = message
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.start is not None:
+            start, self.start = self.start, None
+            headers = MutableHeaders(raw=start["headers"])
+            if (
+                "content-encoding" in headers
+                or not is_compressible(headers.get("content-type", ""))
+                or (not more_body and len(body) < self.minimum_size)
+            ):
+                self.passthrough = True
+                await self.send(start)
+                await self.send(message)
+                return
+
+            self.encoder = _Encoder(self.encoding)
+            headers["Content-Encoding"] = self.encoding
+            _vary_accept_encoding(headers)
+            if more_body:
+                del headers["content-length"]  # longueur finale inconnue
+                await self.send(start)
+            else:
+                body = self.encoder.compress(body) + self.encoder.finish()
+                headers["Content-Length"] = str(len(body))
+                await self.send(start)
+                await self.send({"type": "http.response.body", "body": body})
+                return
+
+        data = self.encoder.compress(body)
+        if not more_body:
+            data += self.encoder.finish()
+        if data or not more_body:
+            await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+
+class PrecompressedBody:
+    """
+    Corps de réponse figé, compressé une seule fois dans chaque encodage.
+    response() choisit la variante selon Accept-Encoding ; la réponse porte
+    Content-Encoding et n'est donc pas recompressée par le middleware.
+    """
+
+    def __init__(self, body: bytes, media_type: str = "application/json"):
+        self.media_type = media_type
+        self.variants = {None: body, "gzip": compress(body, "gzip", PRECOMPRESSED_GZIP_LEVEL)}
+        if brotli is not None:
+            self.variants["br"] = compress(body, "br", PRECOMPRESSED_BROTLI_QUALITY)
+
+    def response(self, accept_encoding: Optional[str]) -> Response:
+        encoding = choose_encoding(accept_encoding)
+        headers = {"Vary": "Accept-Encoding"}
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+        return Response(self.variants[encoding], media_type=self.media_type, headers=headers)
+
+
+class PrecompressedCache:
+    """
+    Corps précompressés par clé, construits à la première demande ; clear()
+    les invalide. Les demandes simultanées d'un corps absent partagent une
+    seule construction.
+    """
+
+    def __init__(self):
+        self._bodies: Dict[str, PrecompressedBody] = {}
+        self._generation = 0
+        self.flight = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str, build: Callable[[], Awaitable[bytes]]) -> PrecompressedBody:
+        body = self._bodies.get(key)
+        if body is not None:
+            self.hits += 1
+            return body
+        self.misses += 1
+        generation = self._generation
+
+        async def build_body():
+            body = PrecompressedBody(await build())
+            # Pas de mise en cache si clear() a eu lieu pendant la construction
+            if generation == self._generation:
+                self._bodies[key] = body
+            return body
+        return await self.flight.do((key, generation), build_body)
+
+    def clear(self):
+        self._bodies.clear()
+        self._generation += 1
+
+    def metrics(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, **self.flight.metrics()}
@@ -0,0 +1,127 @@
+"""
+Cache par processus des devis normalisés (migrés, postes complets).
+
+Une entrée correspond à (user_id, devis_id, version) : seule la version la
+plus récente connue de chaque devis est gardée. Une lecture vérifie d'abord
+la version stockée (requête projetée sur `version`, quelques octets) et ne
+relit le document complet que si le cache n'a pas cette version ; un devis
+modifié par un autre processus n'est donc jamais servi périmé.
+
+Les écritures de ce processus remplacent l'entrée par le document écrit
+(write-through) ou la retirent. Les notifications de changement
+(events.EventBroker, diffusées entre processus par son Fanout) retirent les
+versions dépassées dans les autres processus, pour ne pas y garder de
+mémoire inutile.
+
+La taille est bornée en octets (JSON sérialisé du document, estimation de
+son poids réel) et non en nombre d'entrées : un devis peut compter de
+quelques postes à plusieurs milliers. Un document plus gros que
+DEVIS_CACHE_MAX_ENTRY n'est pas mis en cache.
+
+Les documents rendus sont des copies superficielles : les champs
+imbriqués (postes, client...) sont partagés et ne doivent pas être modifiés.
+"""
+import os
+from collections import OrderedDict
+from typing import Optional
+
+import orjson
+
+DEVIS_CACHE_BYTES = int(os.environ.get("DEVIS_CACHE_BYTES", 64 * 1024 * 1024))
+DEVIS_CACHE_MAX_ENTRY = int(os.environ.get("DEVIS_CACHE_MAX_ENTRY", DEVIS_CACHE_BYTES // 8))
+
+
+def document_size(doc: dict) -> int:
+    return len(orjson.dumps(doc))
+
+
+def cache_version(doc: dict) -> int:
+    # Documents antérieurs au versionnement : version 0 (cf. versioning)
+    return doc.get("version") or 0
+
+
+class _Entry:
+    __slots__ = ("version", "doc", "size")
+
+    def __init__(self, version: int, doc: dict, size: int):
+        self.version = version
+        self.doc = doc
+        self.size = size
+
+
+class DevisCache:
+    def __init__(self, max_bytes: int = DEVIS_CACHE_BYTES, max_entry: int = DEVIS_CACHE_MAX_ENTRY):
+        self.max_bytes = max_bytes
+        self.max_entry = min(max_entry, max_bytes)
+        self._entries: "OrderedDict[tuple, _Entry]" = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, user_id: str, devis_id: str, version: int) -> Optional[dict]:
+        """Devis en cache s'il est à la version donnée"""
+        key = (user_id, devis_id)
+        entry = self._entries.get(key)
+        if entry is None or entry.version != version:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return dict(entry.doc)
+
+    def peek(self, user_id: str, devis_id: str) -> Optional[dict]:
+        """Dernière version connue, sans vérification ni statistiques"""
+        entry = self._entries.get((user_id, devis_id))
+        return dict(entry.doc) if entry is not None else None
+
+    def put(self, user_id: str, doc: dict):
+        """Enregistre un devis normalisé, sauf si une version plus récente est déjà connue"""
+        key = (user_id, doc["id"])
+        version = cache_version(doc)
+        current = self._entries.get(key)
+        if current is not None and current.version > version:
+            return
+        doc = {field: value for field, value in doc.items() if field != "_id"}
+        size = document_size(doc)
+        self._remove(key)
+        if size > self.max_entry:
+            return
+        self._entries[key] = _Entry(version, doc, size)
+        self.size += size
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= evicted.size
+            self.evictions += 1
+
+    def invalidate(self, user_id: str, devis_id: str, version: Optional[int] = None):
+        """Retire le devis ; avec `version`, seulement si l'entrée est plus ancienne"""
+        key = (user_id, devis_id)
+        entry = self._entries.get(key)
+        if entry is not None and (version is None or entry.version < version):
+            self._remove(key)
+            self.invalidations += 1
+
+    def on_change(self, user_id: str, event: dict):
+        """Écouteur des notifications de changement (events.EventBroker)"""
+        if event["type"] == "devis.deleted":
+            self.invalidate(user_id, event["id"])
+        elif event["type"].startswith("devis."):
+            self.invalidate(user_id, event["id"], event.get("version"))
+
+    def _remove(self, key: tuple):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
+
+    def metrics(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
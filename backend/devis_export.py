@@ -0,0 +1,128 @@
+"""
+Export tableur (CSV / XLSX) des postes de devis.
+
+Les lignes sont produites par un générateur, dans le même ordre que le PDF
+(catégories de CATEGORY_ORDER, sous-total par catégorie, postes offerts
+marqués), puis encodées au fil de l'eau par CSVStream ou XLSXStream.
+"""
+import csv
+import io
+import math
+from typing import Iterable, Iterator
+
+from pdf_templates import CATEGORY_LABELS, TEMPLATES, group_postes_by_category
+from xlsx_stream import MONEY, NUMBER, TEXT, XLSXStream
+
+ROWS_PER_CHUNK = 500
+
+# Début de cellule interprété comme une formule par les tableurs (injection CSV)
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+DEVIS_COLUMNS = [
+    ("Catégorie", TEXT, 14),
+    ("Description", TEXT, 50),
+    ("Quantité", NUMBER, 10),
+    ("Unité", TEXT, 8),
+    ("P.U. TTC", MONEY, 12),
+    ("Total TTC", MONEY, 14),
+    ("Offert", TEXT, 8),
+]
+# Export multi-devis : chaque ligne est préfixée par le devis et le client
+MULTI_DEVIS_COLUMNS = [("Devis", TEXT, 16), ("Client", TEXT, 24)] + DEVIS_COLUMNS
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+
+def devis_rows(doc: dict, with_devis: bool = False) -> Iterator[tuple]:
+    """
+    Lignes (valeurs, gras) d'un devis : postes groupés par catégorie,
+    sous-totaux, puis totaux HT / TVA / TTC calculés comme sur le PDF.
+    """
+    template = TEMPLATES["devis"]
+    prefix = []
+    if with_devis:
+        client = template.get_client(doc)
+        prefix = [doc["numero_devis"], f"{client.get('prenom', '')} {client.get('nom', '')}".strip()]
+
+    for cat, cat_postes in group_postes_by_category(doc.get("postes", [])):
+        cat_label = CATEGORY_LABELS.get(cat, cat.upper())
+        cat_subtotal = 0.0
+        for poste in cat_postes:
+            is_offert = poste.get("offert", False)
+            sous_total = poste.get("sous_total", 0)
+            if not is_offert:
+                cat_subtotal += sous_total
+            yield prefix + [
+                cat_label,
+                poste["reference_nom"],
+                poste["quantite"],
+                poste["unite"],
+                poste["prix_ajuste"],
+                0.0 if is_offert else sous_total,
+                "OFFERT" if is_offert else "",
+            ], False
+        yield prefix + [cat_label, f"Sous-total {cat_label}", None, None, None, cat_subtotal, None], True
+
+    total_ht, total_tva, total_ttc = template.get_totals(doc)
+    yield prefix + [None, "Total HT", None, None, None, total_ht, None], True
+    yield prefix + [None, f"TVA ({doc['tva_taux']}%)", None, None, None, total_tva, None], True
+    yield prefix + [None, "TOTAL TTC", None, None, None, total_ttc, None], True
+
+
+class CSVStream:
+    """
+    CSV pour Excel en français : séparateur « ; », décimales à virgule,
+    BOM UTF-8 pour que les accents soient reconnus. Même interface que
+    XLSXStream.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, delimiter=";", lineterminator="\r\n")
+
+    def _drain(self) -> bytes:
+        data = self._buffer.getvalue().encode("utf-8")
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return data
+
+    @staticmethod
+    def _format(value):
+        if value is None:
+            return ""
+        if isinstance(value, float):
+            if not math.isfinite(value):
+                return ""
+            return f"{value:.2f}".replace(".", ",")
+        if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+            # Apostrophe : le tableur affiche le texte au lieu d'évaluer une formule
+            return "'" + value
+        return value
+
+    def begin(self) -> bytes:
+        self._writer.writerow([title for title, _, _ in self.columns])
+        return b"\xef\xbb\xbf" + self._drain()
+
+    def write_rows(self, rows: Iterable) -> Iterator[bytes]:
+        count = 0
+        for values, _bold in rows:
+            self._writer.writerow([self._format(value) for value in values])
+            count += 1
+            if count % ROWS_PER_CHUNK == 0:
+                yield self._drain()
+        data = self._drain()
+        if data:
+            yield data
+
+    def finish(self) -> bytes:
+        return b""
+
+
+def make_writer(format: str, columns, sheet_name: str = "Devis"):
+    if format == "xlsx":
+        return XLSXStream(columns, sheet_name)
+    return CSVStream(columns)
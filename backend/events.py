@@ -0,0 +1,160 @@
+"""
+Notifications de changement poussées aux applications (Server-Sent Events).
+
+Chaque écriture d'un devis ou d'une facture publie un petit événement
+(type, id, statut, version, sync_seq) sur le canal de son utilisateur ;
+GET /api/events le transmet en flux SSE à tous les appareils connectés de
+cet utilisateur. L'événement ne porte pas le document : l'application relit
+ce qui l'intéresse, ou appelle /api/sync après une reconnexion.
+
+EventBroker distribue les événements aux abonnés du processus. La diffusion
+entre processus passe par un Fanout interchangeable : LocalFanout (un seul
+worker) remet directement au broker local ; une implémentation multi-worker
+(Redis, collection Mongo plafonnée...) publie sur son transport et appelle
+deliver() de chaque processus à la réception. Les écouteurs internes
+(add_listener, par exemple l'invalidation des caches) reçoivent aussi tous
+les événements remis au processus.
+
+Un abonné trop lent (file pleine) reçoit un événement « resync » puis le
+flux se termine : l'application se resynchronise au lieu de manquer des
+changements en silence.
+"""
+import asyncio
+import logging
+import os
+from typing import AsyncIterator, Callable, Dict, List, Optional, Set
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+EVENTS_HEARTBEAT = float(os.environ.get("EVENTS_HEARTBEAT", 15))  # secondes
+EVENTS_QUEUE_SIZE = int(os.environ.get("EVENTS_QUEUE_SIZE", 100))
+EVENTS_RETRY_MS = 5000  # délai de reconnexion conseillé au client
+
+RESYNC = {"type": "resync"}
+_CLOSED = object()
+
+
+def format_event(event: dict) -> bytes:
+    """Événement SSE : « id » = sync_seq (si connu), « event » = type, « data » = JSON"""
+    lines = []
+    if event.get("sync_seq") is not None:
+        lines.append(f"id: {event['sync_seq']}")
+    lines.append(f"event: {event['type']}")
+    lines.append(f"data: {orjson.dumps(event).decode()}")
+    return ("\n".join(lines) + "\n\n").encode()
+
+
+class Subscription:
+    def __init__(self, user_id: str, queue_size: int = EVENTS_QUEUE_SIZE):
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+    def push(self, event) -> bool:
+        """False si la file est pleine (abonné à resynchroniser)"""
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            self.overflowed = True
+            return False
+
+    def close(self):
+        # Place réservée : la fin du flux passe même si la file est pleine
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(_CLOSED)
+
+
+class LocalFanout:
+    """Diffusion dans le seul processus courant"""
+
+    def __init__(self):
+        self.deliver: Optional[Callable[[str, dict], None]] = None
+
+    async def start(self, deliver: Callable[[str, dict], None]):
+        self.deliver = deliver
+
+    async def publish(self, user_id: str, event: dict):
+        if self.deliver is not None:
+            self.deliver(user_id, event)
+
+    async def stop(self):
+        self.deliver = None
+
+
+class EventBroker:
+    def __init__(self, fanout=None):
+        self.fanout = fanout or LocalFanout()
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._listeners: List[Callable[[str, dict], None]] = []
+
+    def add_listener(self, listener: Callable[[str, dict], None]):
+        self._listeners.append(listener)
+
+    async def start(self):
+        await self.fanout.start(self.deliver)
+
+    async def stop(self):
+        await self.fanout.stop()
+        for subscriptions in self._subscribers.values():
+            for subscription in subscriptions:
+                subscription.close()
+        self._subscribers.clear()
+
+    async def publish(self, user_id: str, type: str, **fields):
+        """Publie après une écriture réussie ; une erreur de diffusion n'échoue pas la requête"""
+        event = {"type": type, **fields}
+        try:
+            await self.fanout.publish(user_id, event)
+        except Exception as e:
+            logger.error(f"Diffusion de l'événement {type} impossible : {e}")
+
+    def deliver(self, user_id: str, event: dict):
+        """Remet l'événement aux écouteurs et aux abonnés locaux de l'utilisateur"""
+        for listener in self._listeners:
+            try:
+                listener(user_id, event)
+            except Exception as e:
+                logger.error(f"Écouteur d'événements en échec ({event['type']}) : {e}")
+        for subscription in list(self._subscribers.get(user_id, ())):
+            if not subscription.push(event):
+                self._discard(subscription)
+                subscription.close()
+
+    def subscribe(self, user_id: str) -> Subscription:
+        subscription = Subscription(user_id)
+        self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def _discard(self, subscription: Subscription):
+        subscriptions = self._subscribers.get(subscription.user_id)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscribers[subscription.user_id]
+
+    def subscriber_count(self) -> int:
+        return sum(len(subscriptions) for subscriptions in self._subscribers.values())
+
+    async def stream(self, user_id: str, heartbeat: float = EVENTS_HEARTBEAT) -> AsyncIterator[bytes]:
+        """Flux SSE de l'utilisateur, avec un commentaire de maintien toutes les `heartbeat` secondes"""
+        subscription = self.subscribe(user_id)
+        try:
+            yield f"retry: {EVENTS_RETRY_MS}\n\n".encode()
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    # Garde la connexion ouverte à travers les proxys
+                    yield b": ping\n\n"
+                    continue
+                if event is _CLOSED:
+                    if subscription.overflowed:
+                        yield format_event(RESYNC)
+                    return
+                yield format_event(event)
+        finally:
+            self._discard(subscription)
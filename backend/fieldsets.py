@@ -0,0 +1,32 @@
+"""
+Champs partiels (« sparse fieldsets ») des GET de devis et de factures.
+
+?fields=statut,total_ttc limite la lecture en base aux champs demandés
+(projection Mongo) et renvoie un objet JSON partiel, sans construire le
+modèle Pydantic complet. L'id est toujours renvoyé.
+"""
+from typing import Iterable, Optional, Set, Type
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+
+def parse_fields(fields: Optional[str], model: Type[BaseModel]) -> Optional[Set[str]]:
+    """Liste « a,b,c » -> ensemble de champs du modèle ; None si absent"""
+    if fields is None:
+        return None
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    if not requested:
+        raise HTTPException(status_code=400, detail="Paramètre fields vide")
+    unknown = requested - model.model_fields.keys()
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Champs inconnus : {', '.join(sorted(unknown))}")
+    return requested | {"id"}
+
+
+def field_projection(fields: Iterable[str]) -> dict:
+    return {"_id": 0, **{field: 1 for field in fields}}
+
+
+def pick(doc: dict, fields: Set[str]) -> dict:
+    return {field: value for field, value in doc.items() if field in fields}
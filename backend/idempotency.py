@@ -0,0 +1,153 @@
+"""
+Clés d'idempotence (en-tête Idempotency-Key) des créations de devis et de
+factures.
+
+La première requête portant une clé la réserve dans la collection
+`idempotency_keys` (statut « pending »), exécute la création puis y
+enregistre la réponse obtenue. Une nouvelle tentative avec la même clé
+reçoit la réponse enregistrée, sans recalcul ni nouvelle insertion
+(en-tête Idempotent-Replayed: true). Une tentative qui arrive pendant que
+l'originale est en cours attend son résultat.
+
+Seules les réponses réussies sont conservées : si la création échoue, la
+réservation est libérée et la tentative suivante s'exécute normalement.
+Une réservation plus ancienne que IDEMPOTENCY_LOCK_TIMEOUT (processus mort
+en cours de route) est reprise. Les clés expirent après IDEMPOTENCY_TTL_HOURS.
+"""
+import asyncio
+import hashlib
+import os
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional
+
+import orjson
+from fastapi import HTTPException
+from pydantic import BaseModel
+from pymongo.errors import DuplicateKeyError
+from starlette.responses import Response
+
+IDEMPOTENCY_TTL_HOURS = int(os.environ.get("IDEMPOTENCY_TTL_HOURS", 24))
+IDEMPOTENCY_LOCK_TIMEOUT = timedelta(seconds=float(os.environ.get("IDEMPOTENCY_LOCK_TIMEOUT", 60)))
+IDEMPOTENCY_WAIT = float(os.environ.get("IDEMPOTENCY_WAIT", 30))  # secondes d'attente d'une requête en cours
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+# En-têtes de la réponse d'origine rejoués avec elle
+REPLAYED_HEADERS = ("etag",)
+
+PENDING = "pending"
+DONE = "done"
+
+
+def request_hash(payload: BaseModel) -> str:
+    """Empreinte du corps : une même clé ne doit pas servir à une autre requête"""
+    data = orjson.dumps(payload.model_dump(mode="json"), option=orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(data).hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(self, db):
+        self.collection = db.idempotency_keys
+        # Requêtes en cours dans ce processus : réveil immédiat des doublons
+        self._in_flight: Dict[str, asyncio.Event] = {}
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("created_at", expireAfterSeconds=IDEMPOTENCY_TTL_HOURS * 3600)
+
+    async def run(
+        self,
+        user_id: str,
+        endpoint: str,
+        key: Optional[str],
+        payload: BaseModel,
+        handler: Callable[[], Awaitable[Response]]
+    ) -> Response:
+        """Exécute handler() une seule fois par clé, ou rejoue la réponse enregistrée"""
+        if key is None:
+            return await handler()
+        if not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise HTTPException(status_code=400, detail="En-tête Idempotency-Key invalide")
+
+        record_id = f"{user_id}:{endpoint}:{key}"
+        fingerprint = request_hash(payload)
+        deadline = asyncio.get_running_loop().time() + IDEMPOTENCY_WAIT
+        delay = 0.05
+        while True:
+            if await self._reserve(record_id, user_id, fingerprint):
+                return await self._execute(record_id, handler)
+
+            record = await self.collection.find_one({"_id": record_id})
+            if record is None:
+                continue  # libérée entre-temps : nouvelle tentative de réservation
+            if record["request_hash"] != fingerprint:
+                raise HTTPException(
+                    status_code=422,
+                    detail="Clé d'idempotence déjà utilisée pour une autre requête"
+                )
+            if record["statut"] == DONE:
+                return self._replay(record["response"])
+            if datetime.utcnow() - record["locked_at"] > IDEMPOTENCY_LOCK_TIMEOUT:
+                await self.collection.delete_one({"_id": record_id, "locked_at": record["locked_at"]})
+                continue
+
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                raise HTTPException(
+                    status_code=409,
+                    detail="Une requête identique est en cours de traitement, veuillez réessayer"
+                )
+            await self._wait(record_id, min(delay, remaining))
+            delay = min(delay * 2, 1.0)
+
+    async def _reserve(self, record_id: str, user_id: str, fingerprint: str) -> bool:
+        now = datetime.utcnow()
+        try:
+            await self.collection.insert_one({
+                "_id": record_id, "user_id": user_id, "request_hash": fingerprint,
+                "statut": PENDING, "created_at": now, "locked_at": now,
+            })
+        except DuplicateKeyError:
+            return False
+        return True
+
+    async def _execute(self, record_id: str, handler: Callable[[], Awaitable[Response]]) -> Response:
+        finished = self._in_flight[record_id] = asyncio.Event()
+        try:
+            response = await handler()
+            if 200 <= response.status_code < 300:
+                await self.collection.update_one(
+                    {"_id": record_id},
+                    {"$set": {"statut": DONE, "response": {
+                        "status_code": response.status_code,
+                        "media_type": response.media_type,
+                        "headers": {name: response.headers[name] for name in REPLAYED_HEADERS if name in response.headers},
+                        "body": bytes(response.body),
+                    }}}
+                )
+            else:
+                await self.collection.delete_one({"_id": record_id})
+            return response
+        except BaseException:
+            # Échec (ou annulation) : la clé redevient utilisable
+            await self.collection.delete_one({"_id": record_id})
+            raise
+        finally:
+            del self._in_flight[record_id]
+            finished.set()
+
+    async def _wait(self, record_id: str, timeout: float):
+        finished = self._in_flight.get(record_id)
+        if finished is None:
+            await asyncio.sleep(timeout)  # requête d'origine dans un autre processus
+            return
+        try:
+            await asyncio.wait_for(finished.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    @staticmethod
+    def _replay(stored: dict) -> Response:
+        return Response(
+            content=stored["body"],
+            status_code=stored["status_code"],
+            media_type=stored["media_type"],
+            headers={**stored["headers"], "Idempotent-Replayed": "true"}
+        )
@@ -0,0 +1,229 @@
+"""
+Bus d'invalidation des caches entre processus (workers uvicorn, hôtes).
+
+Une écriture publie (namespace, clé) : le processus qui l'a servie applique
+l'invalidation immédiatement, les autres la reçoivent par le backend du bus
+et évincent la clé (ou tout le namespace si la clé est absente) de leurs
+caches en mémoire. Namespaces utilisés :
+
+- « catalog » : catalogue de référence (rechargement des tarifs) ;
+- « profile » : profil d'un utilisateur (clé = user_id) ;
+- « events » : notifications de changement de devis et de factures
+  (events.EventBroker via BusFanout), qui invalident aussi le cache de
+  devis et alimentent les flux SSE de tous les processus.
+
+Backend par défaut : collection Mongo plafonnée `invalidations`, lue par un
+curseur tailable (awaitData) — pas d'infrastructure en plus, propagation de
+l'ordre de quelques millisecondes. LocalBackend (un seul processus) ou tout
+objet offrant start(deliver) / publish(message) / stop() peut le remplacer
+(INVALIDATION_BACKEND=local, ou InvalidationBus(backend=...)).
+
+Les messages ne sont pas rejoués : un processus qui démarre lit à partir du
+dernier message existant, ses caches étant vides. Si des messages non lus
+ont été écrasés par la rotation de la collection, tous les namespaces sont
+invalidés.
+
+Chaque message reçoit à l'insertion un horodatage `ts` attribué par le
+serveur Mongo (Timestamp vide remplacé, croissant et unique) : c'est sur lui
+que reprend la lecture après la fin d'un curseur. Les ObjectId, générés par
+chaque client, ne sont pas ordonnés entre processus.
+"""
+import asyncio
+import logging
+import os
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from bson import Timestamp
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_BACKEND = os.environ.get("INVALIDATION_BACKEND", "mongo")
+INVALIDATION_COLLECTION = "invalidations"
+INVALIDATION_CAPPED_BYTES = int(os.environ.get("INVALIDATION_CAPPED_BYTES", 4 * 1024 * 1024))
+# Attente maximale d'un getMore sans nouveau message (ne retarde pas la réception)
+INVALIDATION_AWAIT_MS = 1000
+INVALIDATION_RETRY_DELAY = 1.0  # secondes, après une erreur du curseur
+
+Handler = Callable[[Optional[str], Optional[dict]], None]
+# Message signalant des invalidations perdues : tout est invalidé
+GAP = {"ns": "*"}
+
+
+class LocalBackend:
+    """Aucun transport : un seul processus"""
+
+    async def start(self, deliver: Callable[[dict], None]):
+        pass
+
+    async def publish(self, message: dict):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class MongoCappedBackend:
+    def __init__(self, db, collection: str = INVALIDATION_COLLECTION, size: int = INVALIDATION_CAPPED_BYTES):
+        self.db = db
+        self.name = collection
+        self.size = size
+        self.collection = db[collection]
+        self._task: Optional[asyncio.Task] = None
+
+    async def _ensure_collection(self):
+        try:
+            await self.db.create_collection(self.name, capped=True, size=self.size)
+        except CollectionInvalid:
+            return  # déjà créée (par un autre processus)
+        # Un curseur tailable sur une collection vide meurt aussitôt
+        await self._insert({"ns": None})
+
+    async def _insert(self, message: dict):
+        # Timestamp(0, 0) : remplacé par le serveur à l'insertion
+        await self.collection.insert_one({**message, "ts": Timestamp(0, 0)})
+
+    async def _newest_ts(self):
+        newest = await self.collection.find_one({}, {"ts": 1}, sort=[("$natural", -1)])
+        return newest.get("ts") if newest else None
+
+    async def start(self, deliver: Callable[[dict], None]):
+        await self._ensure_collection()
+        self._task = asyncio.create_task(self._tail(deliver, await self._newest_ts()))
+
+    async def _tail(self, deliver: Callable[[dict], None], last_ts):
+        while True:
+            try:
+                # Reprise au dernier message lu (inclus) : un curseur tailable
+                # dont la requête ne trouve rien meurt aussitôt
+                query = {"ts": {"$gte": last_ts}} if last_ts is not None else {}
+                cursor = self.collection.find(
+                    query, cursor_type=CursorType.TAILABLE_AWAIT
+                ).max_await_time_ms(INVALIDATION_AWAIT_MS)
+                resumed = last_ts is None
+                while cursor.alive:
+                    async for message in cursor:
+                        ts = message.get("ts")
+                        if ts is not None and ts == last_ts:
+                            resumed = True
+                            continue
+                        if not resumed:
+                            resumed = True
+                            deliver(GAP)  # dernier message lu écrasé par la rotation
+                        if ts is not None:
+                            last_ts = ts
+                        if message.get("ns") is not None:
+                            deliver(message)
+                if not resumed:
+                    deliver(GAP)
+                    last_ts = await self._newest_ts()
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Bus d'invalidation : lecture interrompue ({e}), reprise")
+            await asyncio.sleep(INVALIDATION_RETRY_DELAY)
+
+    async def publish(self, message: dict):
+        await self._insert(message)
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+
+class InvalidationBus:
+    def __init__(self, backend=None):
+        self.backend = backend or LocalBackend()
+        self.origin = uuid.uuid4().hex  # messages de ce processus, déjà appliqués
+        self._handlers: Dict[str, List[Handler]] = {}
+        self.published = 0
+        self.received = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def subscribe(self, namespace: str, handler: Handler):
+        """handler(key, payload) ; key None = tout le namespace"""
+        self._handlers.setdefault(namespace, []).append(handler)
+
+    async def start(self):
+        try:
+            await self.backend.start(self._receive)
+        except Exception as e:
+            # Sans bus, chaque processus reste cohérent avec ses propres écritures
+            logger.error(f"Bus d'invalidation indisponible, invalidations locales seulement : {e}")
+
+    async def stop(self):
+        await self.backend.stop()
+
+    async def publish(self, namespace: str, key: Optional[str] = None, payload: Optional[dict] = None):
+        """Invalide localement puis diffuse aux autres processus"""
+        message = {"ns": namespace, "key": key, "payload": payload, "origin": self.origin, "sent_at": time.time()}
+        self._apply(message)
+        self.published += 1
+        try:
+            await self.backend.publish(message)
+        except Exception as e:
+            logger.error(f"Bus d'invalidation : diffusion {namespace}/{key} impossible : {e}")
+
+    def _receive(self, message: dict):
+        if message is GAP:
+            for namespace in self._handlers:
+                self._apply({"ns": namespace, "key": None})
+            return
+        if message.get("origin") == self.origin:
+            return
+        latency = max(0.0, time.time() - message["sent_at"])
+        self.received += 1
+        self._latency_total += latency
+        self._latency_max = max(self._latency_max, latency)
+        self._apply(message)
+
+    def _apply(self, message: dict):
+        for handler in self._handlers.get(message["ns"], ()):
+            try:
+                handler(message.get("key"), message.get("payload"))
+            except Exception as e:
+                logger.error(f"Invalidation {message['ns']}/{message.get('key')} en échec : {e}")
+
+    def metrics(self) -> dict:
+        return {
+            "backend": type(self.backend).__name__,
+            "published": self.published,
+            "received": self.received,
+            "latency_avg_ms": round(self._latency_total / self.received * 1000, 1) if self.received else 0.0,
+            "latency_max_ms": round(self._latency_max * 1000, 1),
+        }
+
+
+class BusFanout:
+    """Fanout de events.EventBroker porté par le bus (namespace « events »)"""
+
+    def __init__(self, bus: InvalidationBus, namespace: str = "events"):
+        self.bus = bus
+        self.namespace = namespace
+        self.deliver = None
+        bus.subscribe(namespace, self._on_message)
+
+    def _on_message(self, user_id: Optional[str], event: Optional[dict]):
+        if self.deliver is not None and user_id is not None and event is not None:
+            self.deliver(user_id, event)
+
+    async def start(self, deliver: Callable[[str, dict], None]):
+        self.deliver = deliver
+
+    async def publish(self, user_id: str, event: dict):
+        await self.bus.publish(self.namespace, user_id, event)
+
+    async def stop(self):
+        self.deliver = None
+
+
+def make_backend(db, name: str = INVALIDATION_BACKEND):
+    if name == "local":
+        return LocalBackend()
+    return MongoCappedBackend(db)
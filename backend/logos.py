@@ -0,0 +1,94 @@
+"""
+Stockage des logos d'entreprise.
+
+Le logo est normalisé une seule fois à l'envoi : redimensionné à la taille du
+cadre de l'en-tête PDF, aplati sur fond blanc puis enregistré en PNG en
+palette (aplats de couleurs) ou en JPEG (photos). Les fichiers sont adressés
+par le hash de leur contenu : `<LOGO_DIR>/<hash>.png|jpg`, jamais modifiés
+une fois écrits.
+"""
+import hashlib
+import io
+import os
+from pathlib import Path
+from typing import Optional, Tuple
+
+from PIL import Image, ImageOps
+from reportlab.lib.units import cm
+
+LOGO_DIR = Path(os.environ.get("LOGO_DIR", Path(__file__).parent / "uploads" / "logos"))
+LOGO_MAX_UPLOAD = 5 * 1024 * 1024  # octets
+LOGO_MAX_PIXELS = 40_000_000  # protection contre les images "bombes"
+
+# Cadre du logo dans l'en-tête PDF (points) et résolution d'impression visée
+LOGO_BOX = (5 * cm, 2 * cm)
+LOGO_DPI = 200
+LOGO_FORMATS = {"png": "image/png", "jpg": "image/jpeg"}
+
+
+class LogoError(ValueError):
+    pass
+
+
+def _box_pixels() -> Tuple[int, int]:
+    return tuple(round(side / 72 * LOGO_DPI) for side in LOGO_BOX)
+
+
+def normalize_logo(data: bytes) -> Tuple[bytes, str]:
+    """Image envoyée -> (octets normalisés, extension)"""
+    try:
+        image = Image.open(io.BytesIO(data))
+        if image.width * image.height > LOGO_MAX_PIXELS:
+            raise LogoError("Image trop grande")
+        # Décodage JPEG directement à une résolution réduite quand c'est possible
+        image.draft("RGB", _box_pixels())
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    except LogoError:
+        raise
+    except Exception:
+        raise LogoError("Image illisible ou format non reconnu")
+
+    image.thumbnail(_box_pixels(), Image.LANCZOS)
+
+    # Aplatissement de la transparence sur fond blanc
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+
+    output = io.BytesIO()
+    if image.getcolors(256) is not None:
+        # Logo à aplats de couleurs : PNG en palette, très compact
+        image.quantize(256).save(output, "PNG", optimize=True)
+        return output.getvalue(), "png"
+    # Image photographique : JPEG, intégré tel quel dans le PDF (pas de recompression)
+    image.save(output, "JPEG", quality=90, optimize=True)
+    return output.getvalue(), "jpg"
+
+
+def save_logo(data: bytes) -> str:
+    """Normalise et enregistre le logo, retourne son hash"""
+    content, ext = normalize_logo(data)
+    logo_hash = hashlib.sha256(content).hexdigest()[:32]
+    LOGO_DIR.mkdir(parents=True, exist_ok=True)
+    path = LOGO_DIR / f"{logo_hash}.{ext}"
+    if not path.exists():
+        tmp = path.with_suffix(f".{ext}.tmp")
+        tmp.write_bytes(content)
+        os.replace(tmp, path)
+    return logo_hash
+
+
+def logo_path(logo_hash: str) -> Optional[Path]:
+    """Fichier d'un logo à partir de son hash, ou None"""
+    if not logo_hash or not all(c in "0123456789abcdef" for c in logo_hash):
+        return None
+    for ext in LOGO_FORMATS:
+        path = LOGO_DIR / f"{logo_hash}.{ext}"
+        if path.exists():
+            return path
+    return None
@@ -0,0 +1,178 @@
+"""
+Migration en arrière-plan des devis de l'ancien format.
+
+Les anciens devis n'ont pas tous les champs du modèle actuel (client_nom au
+lieu de client, date_validite, total_tva, conditions_paiement, notes). Plutôt
+que de compléter ces champs à chaque lecture, ils sont mis à niveau une fois
+en base et marqués `schema_version`.
+
+La migration tourne en ligne, par lots limités et espacés (bulk_write de
+mises à jour en pipeline). Chaque mise à jour ne fait que compléter les
+champs absents ($ifNull) sur le document courant : elle ne peut pas écraser
+une écriture concurrente de l'application et peut être rejouée sans risque.
+La progression (dernier _id traité) est enregistrée dans la collection
+`migrations`, ce qui permet de reprendre après un redémarrage ; un bail
+évite que plusieurs processus ne fassent le même travail. Les processus qui
+n'ont pas le bail retentent périodiquement de le prendre : si celui qui le
+tient meurt, un autre reprend la migration à l'expiration du bail.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+DEVIS_SCHEMA_VERSION = 1
+MIGRATION_NAME = f"devis_schema_v{DEVIS_SCHEMA_VERSION}"
+MIGRATION_BATCH_SIZE = int(os.environ.get("MIGRATION_BATCH_SIZE", 500))
+MIGRATION_PAUSE = float(os.environ.get("MIGRATION_PAUSE", 0.2))  # secondes entre deux lots
+MIGRATION_LEASE = timedelta(minutes=2)
+# Nouvelle tentative de prise du bail (tenu par un autre processus, ou erreur)
+MIGRATION_RETRY_INTERVAL = float(os.environ.get("MIGRATION_RETRY_INTERVAL", MIGRATION_LEASE.total_seconds()))
+
+DEFAULT_VALIDITE_JOURS = 30
+DEFAULT_CONDITIONS_PAIEMENT = {"type": "jours", "delai_jours": 30, "acomptes": []}
+EMPTY_CLIENT_FIELDS = {"prenom": "", "adresse": "", "code_postal": "", "ville": "", "telephone": "", "email": ""}
+
+# Documents pas encore migrés (champ absent ou version inférieure)
+LEGACY_DEVIS_FILTER = {"schema_version": {"$not": {"$gte": DEVIS_SCHEMA_VERSION}}}
+
+# Mise à niveau côté serveur ; équivalent de upgrade_devis() ci-dessous
+DEVIS_UPGRADE_PIPELINE = [{"$set": {
+    "client": {"$cond": [
+        {"$eq": [{"$type": "$client"}, "object"]},
+        "$client",
+        {"$mergeObjects": [
+            {"$literal": EMPTY_CLIENT_FIELDS},
+            {"nom": {"$ifNull": ["$client_nom", "Client"]}},
+        ]},
+    ]},
+    "date_validite": {"$ifNull": [
+        "$date_validite",
+        {"$add": ["$date_creation", DEFAULT_VALIDITE_JOURS * 24 * 3600 * 1000]},
+    ]},
+    "total_tva": {"$ifNull": ["$total_tva", {"$subtract": ["$total_ttc", "$total_ht"]}]},
+    "conditions_paiement": {"$ifNull": ["$conditions_paiement", {"$literal": DEFAULT_CONDITIONS_PAIEMENT}]},
+    "notes": {"$ifNull": ["$notes", ""]},
+    "schema_version": DEVIS_SCHEMA_VERSION,
+}}]
+
+
+def upgrade_devis(devis_doc: dict) -> dict:
+    """
+    Complète en mémoire un devis pas encore migré (même résultat que
+    DEVIS_UPGRADE_PIPELINE). Sans effet, et quasi gratuit, sur un devis à jour.
+    """
+    if devis_doc.get("schema_version", 0) >= DEVIS_SCHEMA_VERSION:
+        return devis_doc
+
+    if not isinstance(devis_doc.get("client"), dict):
+        devis_doc["client"] = {**EMPTY_CLIENT_FIELDS, "nom": devis_doc.get("client_nom") or "Client"}
+    if devis_doc.get("date_validite") is None:
+        devis_doc["date_validite"] = devis_doc["date_creation"] + timedelta(days=DEFAULT_VALIDITE_JOURS)
+    if devis_doc.get("total_tva") is None:
+        devis_doc["total_tva"] = devis_doc["total_ttc"] - devis_doc["total_ht"]
+    if devis_doc.get("conditions_paiement") is None:
+        devis_doc["conditions_paiement"] = dict(DEFAULT_CONDITIONS_PAIEMENT, acomptes=[])
+    if devis_doc.get("notes") is None:
+        devis_doc["notes"] = ""
+    return devis_doc
+
+
+class DevisMigration:
+    def __init__(self, db, batch_size: int = MIGRATION_BATCH_SIZE, pause: float = MIGRATION_PAUSE):
+        self.devis = db.devis
+        self.checkpoints = db.migrations
+        self.batch_size = batch_size
+        self.pause = pause
+        self.owner = str(uuid.uuid4())
+
+    async def _acquire(self):
+        """Prend le bail de la migration ; None si terminée ou tenue par un autre processus"""
+        now = datetime.utcnow()
+        try:
+            return await self.checkpoints.find_one_and_update(
+                {
+                    "_id": MIGRATION_NAME,
+                    "done": {"$ne": True},
+                    "$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}, {"lease_owner": self.owner}],
+                },
+                {
+                    "$set": {"lease_owner": self.owner, "lease_until": now + MIGRATION_LEASE},
+                    "$setOnInsert": {"last_id": None, "migrated": 0, "started_at": now},
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            return None
+
+    async def _checkpoint(self, last_id, migrated: int, done: bool = False):
+        now = datetime.utcnow()
+        update = {"last_id": last_id, "migrated": migrated, "updated_at": now}
+        if done:
+            update.update({"done": True, "finished_at": now, "lease_until": None})
+        else:
+            update["lease_until"] = now + MIGRATION_LEASE
+        result = await self.checkpoints.update_one(
+            {"_id": MIGRATION_NAME, "lease_owner": self.owner},
+            {"$set": update}
+        )
+        return result.matched_count == 1
+
+    async def _is_done(self) -> bool:
+        checkpoint = await self.checkpoints.find_one({"_id": MIGRATION_NAME}, {"done": 1})
+        return bool(checkpoint and checkpoint.get("done"))
+
+    async def run(self) -> bool:
+        """Migre tant que le bail est tenu ; True si la migration est terminée"""
+        checkpoint = await self._acquire()
+        if checkpoint is None:
+            return await self._is_done()
+        last_id = checkpoint.get("last_id")
+        migrated = checkpoint.get("migrated", 0)
+        logger.info(f"Migration {MIGRATION_NAME}: reprise après {migrated} devis")
+
+        while True:
+            query = dict(LEGACY_DEVIS_FILTER)
+            if last_id is not None:
+                query["_id"] = {"$gt": last_id}
+            batch = await self.devis.find(query, {"_id": 1}).sort("_id", 1).limit(self.batch_size).to_list(self.batch_size)
+            if not batch:
+                await self._checkpoint(last_id, migrated, done=True)
+                logger.info(f"Migration {MIGRATION_NAME} terminée: {migrated} devis mis à niveau")
+                return True
+
+            result = await self.devis.bulk_write(
+                [UpdateOne({"_id": doc["_id"], **LEGACY_DEVIS_FILTER}, DEVIS_UPGRADE_PIPELINE) for doc in batch],
+                ordered=False
+            )
+            last_id = batch[-1]["_id"]
+            migrated += result.modified_count
+            if not await self._checkpoint(last_id, migrated):
+                logger.warning(f"Migration {MIGRATION_NAME}: bail perdu, arrêt")
+                return False
+            # Limitation du débit : laisser la base servir le trafic normal
+            await asyncio.sleep(self.pause)
+
+    async def run_safely(self, retry_interval: float = MIGRATION_RETRY_INTERVAL):
+        """Relance run() jusqu'à ce que la migration soit terminée (par ce processus ou un autre)"""
+        while True:
+            try:
+                if await self.run():
+                    return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Migration {MIGRATION_NAME} interrompue: {e}")
+            await asyncio.sleep(retry_interval)
+
+    async def status(self) -> dict:
+        checkpoint = await self.checkpoints.find_one({"_id": MIGRATION_NAME}, {"_id": 0, "lease_owner": 0}) or {}
+        remaining = await self.devis.count_documents(LEGACY_DEVIS_FILTER)
+        return {"name": MIGRATION_NAME, **checkpoint, "remaining": remaining}
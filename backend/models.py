@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field, EmailStr
+from pydantic import BaseModel, EmailStr
 from typing import Optional, List, Dict, Any
 from datetime import datetime
 from enum import Enum
@@ -43,6 +43,7 @@ class EntrepriseInfo(BaseModel):
     siret: str = ""
     tva_intracom: str = ""
     logo_url: Optional[str] = None
+    logo_hash: Optional[str] = None
     conditions_paiement: ConditionsPaiement = ConditionsPaiement()
     mentions_legales: str = """Les travaux seront réalisés selon les règles de l'art et conformément aux normes en vigueur.
 Le présent devis est valable 30 jours à compter de sa date d'émission.
@@ -256,6 +257,41 @@ class Devis(BaseModel):
     conditions_paiement: DevisConditionsPaiement
     notes: Optional[str] = ""
     postes: List[PosteDevis]
+    snapshot_id: Optional[str] = None  # hash de l'instantané du contenu validé
+    version: int = 0
+
+
+class SousTotalCategorie(BaseModel):
+    categorie: str
+    nb_postes: int
+    sous_total: float  # hors postes offerts
+
+
+class DevisSummary(BaseModel):
+    """En-tête et totaux d'un devis, sans les postes (?include=summary)"""
+    id: str
+    numero_devis: str
+    user_id: str
+    client: ClientInfo
+    date_creation: datetime
+    date_validite: datetime
+    tva_taux: float
+    total_ht: float
+    total_tva: float
+    total_ttc: float
+    statut: StatutDevis
+    conditions_paiement: DevisConditionsPaiement
+    notes: Optional[str] = ""
+    nb_postes: int
+    sous_totaux: List[SousTotalCategorie]
+    snapshot_id: Optional[str] = None
+    version: int = 0
+
+
+class PostesPage(BaseModel):
+    postes: List[PosteDevis]
+    next_cursor: Optional[str] = None  # None : dernière page
+    version: int = 0
 
 
 class DevisListItem(BaseModel):
@@ -294,6 +330,8 @@ class Facture(BaseModel):
     postes: List[PosteDevis]
     conditions_paiement: Optional[DevisConditionsPaiement] = None
     notes: Optional[str] = ""
+    snapshot_id: Optional[str] = None  # instantané partagé avec le devis
+    version: int = 0
 
 
 class FactureListItem(BaseModel):
@@ -305,3 +343,63 @@ class FactureListItem(BaseModel):
     date_paiement: Optional[datetime] = None
     total_ttc: float
     statut: StatutFacture
+
+
+# ==================== EXPORT ====================
+class PDFExportRequest(BaseModel):
+    # Sélection explicite...
+    devis_ids: List[str] = []
+    facture_ids: List[str] = []
+    # ...ou filtre (utilisé si aucun id n'est fourni)
+    types: List[str] = ["devis", "facture"]
+    date_debut: Optional[datetime] = None
+    date_fin: Optional[datetime] = None
+    statut: Optional[str] = None
+
+
+class FormatExport(str, Enum):
+    CSV = "csv"
+    XLSX = "xlsx"
+
+
+class DevisExportRequest(BaseModel):
+    # Sélection explicite ou filtre, comme PDFExportRequest
+    devis_ids: List[str] = []
+    date_debut: Optional[datetime] = None
+    date_fin: Optional[datetime] = None
+    statut: Optional[str] = None
+    format: FormatExport = FormatExport.XLSX
+
+
+# ==================== PDF JOBS ====================
+class StatutPDFJob(str, Enum):
+    EN_ATTENTE = "en_attente"
+    EN_COURS = "en_cours"
+    TERMINE = "termine"
+    ECHEC = "echec"
+
+
+class PDFJob(BaseModel):
+    id: str
+    kind: str  # "devis" ou "facture"
+    document_id: str
+    statut: StatutPDFJob
+    attempts: int = 0
+    error: Optional[str] = None
+    filename: Optional[str] = None
+    size: Optional[int] = None
+    created_at: datetime
+    updated_at: datetime
+    download_url: Optional[str] = None
+
+
+# ==================== BATCH ====================
+class BatchOperation(BaseModel):
+    method: str = "GET"
+    path: str  # chemin complet avec la requête, ex. "/api/devis/123?fields=statut"
+    headers: Dict[str, str] = {}  # If-Match, If-None-Match...
+    body: Optional[Any] = None  # envoyé en JSON
+
+
+class BatchRequest(BaseModel):
+    operations: List[BatchOperation]
@@ -0,0 +1,184 @@
+"""
+Cloisonnement (bulkhead) des endpoints PDF.
+
+Le rendu PDF est coûteux : sans limite, un utilisateur qui télécharge en masse
+monopolise les processus de rendu et dégrade le reste de l'API. Chaque
+processus admet donc au plus `capacity` rendus simultanés, avec un quota par
+utilisateur et une file d'attente bornée. Au-delà, la requête est refusée
+immédiatement (503 + Retry-After) plutôt que de laisser la file grossir.
+
+Les rendus d'arrière-plan (jobs PDF, pré-rendus) partagent les mêmes
+emplacements, avec leur propre limite plus basse : ils attendent sans être
+refusés et laissent toujours `capacity - background` emplacements aux
+requêtes interactives.
+"""
+import asyncio
+import os
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+from pdf_workers import PDF_WORKERS
+
+PDF_CONCURRENCY = int(os.environ.get("PDF_CONCURRENCY", PDF_WORKERS))
+PDF_USER_QUOTA = int(os.environ.get("PDF_USER_QUOTA", max(1, PDF_CONCURRENCY // 2)))
+PDF_MAX_QUEUE = int(os.environ.get("PDF_MAX_QUEUE", PDF_CONCURRENCY * 2))
+PDF_MAX_WAIT = float(os.environ.get("PDF_MAX_WAIT", 10))  # secondes
+PDF_BACKGROUND_CONCURRENCY = int(os.environ.get("PDF_BACKGROUND_CONCURRENCY", max(1, PDF_CONCURRENCY // 2)))
+
+# Lissage de la durée moyenne d'un rendu (pour estimer Retry-After)
+SERVICE_TIME_SMOOTHING = 0.2
+
+
+class BulkheadFull(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """Emplacement obtenu ; release() peut être appelé plusieurs fois"""
+
+    def __init__(self, bulkhead: "Bulkhead", user_id: str):
+        self._bulkhead = bulkhead
+        self.user_id = user_id
+        self.started = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self._bulkhead._release(self)
+
+
+class Bulkhead:
+    def __init__(
+        self,
+        capacity: int = PDF_CONCURRENCY,
+        per_user: int = PDF_USER_QUOTA,
+        max_queue: int = PDF_MAX_QUEUE,
+        max_wait: float = PDF_MAX_WAIT,
+        background: int = PDF_BACKGROUND_CONCURRENCY,
+    ):
+        self.capacity = capacity
+        self.per_user = per_user
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.background = min(background, capacity)
+        self._semaphore = asyncio.Semaphore(capacity)
+        self._background = asyncio.Semaphore(self.background)
+        self.background_in_flight = 0
+        self._users = defaultdict(int)  # requêtes admises (en attente + en cours) par utilisateur
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = {"quota": 0, "file": 0, "delai": 0}
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._service_time = 1.0
+
+    def retry_after(self) -> int:
+        """Estimation du temps avant qu'un emplacement se libère"""
+        backlog = (self.waiting + self.in_flight) / self.capacity
+        return max(1, round(self._service_time * backlog))
+
+    def _reject(self, reason: str):
+        self.rejected[reason] += 1
+        raise BulkheadFull(reason, self.retry_after())
+
+    def check(self, user_id: str):
+        """Lève BulkheadFull si une demande de l'utilisateur serait refusée d'emblée"""
+        if self._users[user_id] >= self.per_user:
+            self._reject("quota")
+        if self.in_flight >= self.capacity and self.waiting >= self.max_queue:
+            self._reject("file")
+
+    async def acquire(self, user_id: str) -> Ticket:
+        """Réserve un emplacement ou lève BulkheadFull"""
+        self.check(user_id)
+
+        self._users[user_id] += 1
+        self.waiting += 1
+        start = time.monotonic()
+        try:
+            async with asyncio.timeout(self.max_wait):
+                await self._semaphore.acquire()
+        except TimeoutError:
+            self._release_user(user_id)
+            self._reject("delai")
+        except BaseException:
+            self._release_user(user_id)
+            raise
+        finally:
+            self.waiting -= 1
+
+        wait = time.monotonic() - start
+        self.admitted += 1
+        self._wait_total += wait
+        self._wait_max = max(self._wait_max, wait)
+        self.in_flight += 1
+        return Ticket(self, user_id)
+
+    def _release_user(self, user_id: str):
+        self._users[user_id] -= 1
+        if self._users[user_id] <= 0:
+            del self._users[user_id]
+
+    def _release(self, ticket: Ticket):
+        duration = time.monotonic() - ticket.started
+        self._service_time += SERVICE_TIME_SMOOTHING * (duration - self._service_time)
+        self.in_flight -= 1
+        self._semaphore.release()
+        self._release_user(ticket.user_id)
+
+    @asynccontextmanager
+    async def slot(self, user_id: str, retries: int = 0):
+        """Emplacement pour un rendu ; refusé, réessaie jusqu'à `retries` fois après Retry-After"""
+        while True:
+            try:
+                ticket = await self.acquire(user_id)
+                break
+            except BulkheadFull as e:
+                if retries <= 0:
+                    raise
+                retries -= 1
+                await asyncio.sleep(e.retry_after)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    @asynccontextmanager
+    async def background_slot(self):
+        """Emplacement pour un rendu d'arrière-plan : attend sans limite de délai"""
+        async with self._background:
+            await self._semaphore.acquire()
+            self.in_flight += 1
+            self.background_in_flight += 1
+            try:
+                yield
+            finally:
+                self.background_in_flight -= 1
+                self.in_flight -= 1
+                self._semaphore.release()
+
+    def metrics(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "per_user": self.per_user,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "background": self.background,
+            "background_in_flight": self.background_in_flight,
+            "queue_depth": self.waiting,
+            "active_users": len(self._users),
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "wait_avg_ms": round(self._wait_total / self.admitted * 1000, 1) if self.admitted else 0.0,
+            "wait_max_ms": round(self._wait_max * 1000, 1),
+            "service_time_ms": round(self._service_time * 1000, 1),
+        }
+
+
+pdf_bulkhead = Bulkhead()
@@ -0,0 +1,71 @@
+"""
+Export groupé de PDF (devis et factures) sous forme d'archive ZIP en flux.
+
+Les documents sont lus au fil du curseur, rendus en parallèle dans le pool
+de processus et ajoutés à l'archive dans l'ordre où les rendus se terminent.
+La mémoire utilisée est bornée par le nombre de rendus en cours. Chaque
+rendu occupe son propre emplacement (`slot`, par exemple celui du bulkhead
+PDF) le temps de son exécution.
+"""
+import asyncio
+import logging
+from typing import AsyncContextManager, AsyncIterator, Callable, Tuple
+
+from pdf_templates import pdf_filename
+from pdf_workers import PDF_WORKERS, render_in_pool
+from zip_stream import ZipStream
+
+logger = logging.getLogger(__name__)
+
+
+async def _render_entry(kind: str, doc: dict, entreprise: dict, slot: Callable[[], AsyncContextManager]):
+    try:
+        async with slot():
+            data = await render_in_pool(kind, doc, entreprise)
+        return pdf_filename(kind, doc), data, None
+    except Exception as e:
+        logger.error(f"Erreur rendu PDF {kind} {doc.get('id')}: {e}")
+        return pdf_filename(kind, doc), None, str(e)
+
+
+async def stream_pdf_archive(
+    documents: AsyncIterator[Tuple[str, dict]],
+    entreprise: dict,
+    slot: Callable[[], AsyncContextManager],
+    concurrency: int = PDF_WORKERS
+) -> AsyncIterator[bytes]:
+    """Génère les octets d'une archive ZIP contenant le PDF de chaque document"""
+    archive = ZipStream()
+    pending = set()
+    errors = []
+
+    def collect(done):
+        chunks = []
+        for task in done:
+            filename, data, error = task.result()
+            if error is not None:
+                errors.append(f"{filename}: {error}")
+            else:
+                chunks.append(archive.add(filename, data))
+        return chunks
+
+    try:
+        async for kind, doc in documents:
+            if len(pending) >= concurrency:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for chunk in collect(done):
+                    yield chunk
+            pending.add(asyncio.create_task(_render_entry(kind, doc, entreprise, slot)))
+
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for chunk in collect(done):
+                yield chunk
+    finally:
+        # Client déconnecté : abandonner les rendus restants
+        for task in pending:
+            task.cancel()
+
+    if errors:
+        yield archive.add("ERREURS.txt", "\n".join(errors).encode("utf-8"))
+    yield archive.close()
@@ -0,0 +1,370 @@
+"""
+File de rendus PDF en arrière-plan.
+
+Les jobs sont stockés dans la collection `pdf_jobs` et les PDF produits dans
+GridFS (bucket `pdf_files`). Chaque job embarque les données à rendre
+(document + entreprise) et est identifié par le hash de ce contenu (champs
+rendus du document + version du profil) : deux demandes pour le même contenu
+partagent le même job.
+
+Des workers asyncio réclament les jobs avec un bail (lease), chacun après
+avoir obtenu un emplacement d'arrière-plan du bulkhead PDF (les rendus
+interactifs restent prioritaires sur le pool) : si le processus meurt pendant un rendu, le bail expire
+et le job est repris par un autre worker, dans la limite de MAX_ATTEMPTS.
+
+Les pré-rendus sont des demandes différées stockées dans `pdf_prerenders`
+(document et version seulement) : elles survivent à un redémarrage et sont
+abandonnées si le document a changé de version avant leur traitement.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import uuid
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from typing import Optional
+
+from gridfs.errors import NoFile
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from models import StatutPDFJob
+from pdf_bulkhead import pdf_bulkhead
+from pdf_templates import pdf_filename
+from pdf_workers import PDF_WORKERS, render_in_pool
+
+logger = logging.getLogger(__name__)
+
+PDF_JOB_CONCURRENCY = int(os.environ.get("PDF_JOB_CONCURRENCY", PDF_WORKERS))
+MAX_ATTEMPTS = 3
+LEASE_DURATION = timedelta(minutes=5)
+POLL_INTERVAL = 2  # secondes, pour les jobs soumis par d'autres processus
+JOB_TTL = timedelta(days=1)
+PURGE_INTERVAL = 3600
+# Délai de regroupement des pré-rendus : une rafale d'éditions => un seul rendu
+PRERENDER_DELAY = float(os.environ.get("PDF_PRERENDER_DELAY", 10))
+
+# Priorités : les demandes utilisateur passent avant les pré-rendus
+PRIORITY_HIGH = 10
+PRIORITY_LOW = 0
+
+JOB_PROJECTION = {"_id": 0, "payload": 0}
+
+# Champs du document lus par pdf_templates (les métadonnées de synchronisation
+# — updated_at, sync_seq, version, snapshot_id... — ne changent pas le PDF)
+RENDERED_FIELDS = (
+    "id", "numero_devis", "numero_facture", "devis_numero", "client", "client_nom",
+    "postes", "tva_taux", "total_ht", "total_tva", "total_ttc", "conditions_paiement",
+    "date_creation", "date_validite", "date_paiement", "notes", "statut",
+)
+
+
+def profile_entreprise(profile: Optional[dict]) -> dict:
+    return profile.get("entreprise", {}) if profile else {}
+
+
+def compute_content_hash(kind: str, doc: dict, profile: Optional[dict]) -> str:
+    """Hash du contenu rendu : mêmes champs rendus + même version du profil = même PDF"""
+    rendered = {field: doc[field] for field in RENDERED_FIELDS if field in doc}
+    # Le profil est versionné par son sync_seq ; avant sa première
+    # modification il n'en a pas, son contenu sert alors de version
+    profile_version = profile.get("sync_seq") if profile else None
+    if profile_version is None:
+        profile_version = profile_entreprise(profile)
+    content = json.dumps(
+        {"kind": kind, "doc": rendered, "profile": profile_version},
+        sort_keys=True, default=str, ensure_ascii=False
+    )
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class PDFJobQueue:
+    def __init__(self, db, concurrency: int = PDF_JOB_CONCURRENCY):
+        self.collection = db.pdf_jobs
+        self.fs = AsyncIOMotorGridFSBucket(db, bucket_name="pdf_files")
+        self.concurrency = concurrency
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+        self.prerenders = db.pdf_prerenders
+        # Coroutine (user_id, kind, document_id) -> (doc, profile), ou None
+        # si le pré-rendu n'a plus lieu d'être ; fournie par l'application
+        self.prerender_loader = None
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("content_hash", unique=True)
+        await self.collection.create_index("id", unique=True)
+        await self.collection.create_index([("statut", 1), ("priority", -1), ("created_at", 1)])
+        await self.collection.create_index("updated_at")
+        await self.prerenders.create_index([("user_id", 1), ("kind", 1), ("document_id", 1)], unique=True)
+        await self.prerenders.create_index("not_before")
+
+    def start(self):
+        for i in range(self.concurrency):
+            self._tasks.append(asyncio.create_task(self._worker(i)))
+        self._tasks.append(asyncio.create_task(self._prerender_loop()))
+        self._tasks.append(asyncio.create_task(self._purge_loop()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # ---- Soumission ----
+    async def submit(self, user_id: str, kind: str, doc: dict, profile: Optional[dict], priority: int = PRIORITY_HIGH) -> dict:
+        """Crée le job (ou retourne le job existant pour le même contenu)"""
+        doc = {k: v for k, v in doc.items() if k != "_id"}
+        content_hash = compute_content_hash(kind, doc, profile)
+        payload = {"doc": doc, "entreprise": profile_entreprise(profile)}
+        now = datetime.utcnow()
+
+        try:
+            job = await self.collection.find_one_and_update(
+                {"content_hash": content_hash},
+                {
+                    "$setOnInsert": {
+                        "id": str(uuid.uuid4()),
+                        "user_id": user_id,
+                        "kind": kind,
+                        "document_id": doc["id"],
+                        "content_hash": content_hash,
+                        "statut": StatutPDFJob.EN_ATTENTE,
+                        "attempts": 0,
+                        "payload": payload,
+                        "created_at": now,
+                        "updated_at": now,
+                    },
+                    "$max": {"priority": priority},
+                },
+                upsert=True,
+                projection=JOB_PROJECTION,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Soumission concurrente du même contenu
+            job = await self.collection.find_one_and_update(
+                {"content_hash": content_hash},
+                {"$max": {"priority": priority}},
+                projection=JOB_PROJECTION,
+                return_document=ReturnDocument.AFTER
+            )
+
+        if job["statut"] == StatutPDFJob.ECHEC:
+            # Nouvelle demande après un échec : on retente
+            job = await self.collection.find_one_and_update(
+                {"id": job["id"], "statut": StatutPDFJob.ECHEC},
+                {"$set": {
+                    "statut": StatutPDFJob.EN_ATTENTE,
+                    "attempts": 0,
+                    "error": None,
+                    "payload": payload,
+                    "updated_at": now,
+                }},
+                projection=JOB_PROJECTION,
+                return_document=ReturnDocument.AFTER
+            ) or job
+
+        self._wakeup.set()
+        return job
+
+    async def find_cached(self, kind: str, doc: dict, profile: Optional[dict]):
+        """Job terminé pour exactement ce contenu (PDF déjà rendu), ou None"""
+        return await self.collection.find_one(
+            {"content_hash": compute_content_hash(kind, doc, profile), "statut": StatutPDFJob.TERMINE},
+            JOB_PROJECTION
+        )
+
+    # ---- Pré-rendu ----
+    async def schedule_prerender(self, user_id: str, kind: str, document_id: str, version: int):
+        """
+        Programme un pré-rendu basse priorité après PRERENDER_DELAY secondes.
+        Seule la référence (document, version) est enregistrée ; chaque
+        nouvel appel pour le même document repousse l'échéance.
+        """
+        now = datetime.utcnow()
+        try:
+            await self.prerenders.update_one(
+                {"user_id": user_id, "kind": kind, "document_id": document_id},
+                {
+                    "$set": {"not_before": now + timedelta(seconds=PRERENDER_DELAY), "updated_at": now},
+                    "$max": {"version": version},
+                },
+                upsert=True
+            )
+        except Exception as e:
+            # Le pré-rendu est une optimisation : l'écriture du document n'échoue pas
+            logger.error(f"Pré-rendu PDF {kind} {document_id} non programmé: {e}")
+
+    async def _claim_prerender(self):
+        now = datetime.utcnow()
+        # Bail : la demande reste en base jusqu'à sa soumission
+        return await self.prerenders.find_one_and_update(
+            {"not_before": {"$lte": now}},
+            {"$set": {"not_before": now + LEASE_DURATION}},
+            sort=[("not_before", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _prerender_loop(self):
+        while True:
+            try:
+                request = await self._claim_prerender()
+                if request is None:
+                    await asyncio.sleep(POLL_INTERVAL)
+                    continue
+                await self._prerender(request)
+                # Sauf si elle a été reprogrammée entre-temps (nouvelle édition)
+                await self.prerenders.delete_one({"_id": request["_id"], "not_before": request["not_before"]})
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Pré-rendu PDF: {e}")
+                await asyncio.sleep(POLL_INTERVAL)
+
+    async def _prerender(self, request: dict):
+        """Soumet le rendu si le document est toujours à la version demandée"""
+        if self.prerender_loader is None:
+            return
+        item = await self.prerender_loader(request["user_id"], request["kind"], request["document_id"])
+        if item is None:
+            return
+        doc, profile = item
+        if (doc.get("version") or 0) != request["version"]:
+            return  # modifié depuis : la nouvelle version a sa propre demande
+        await self.submit(request["user_id"], request["kind"], doc, profile, priority=PRIORITY_LOW)
+
+    async def get(self, job_id: str, user_id: str):
+        return await self.collection.find_one({"id": job_id, "user_id": user_id}, JOB_PROJECTION)
+
+    async def open_file(self, job: dict):
+        """Flux GridFS du PDF, ou None si le fichier a disparu (purge concurrente)"""
+        try:
+            return await self.fs.open_download_stream(job["file_id"])
+        except NoFile:
+            # Job sans fichier : supprimé pour qu'une nouvelle demande le recrée
+            await self.collection.delete_one({"id": job["id"], "file_id": job["file_id"]})
+            return None
+
+    # ---- Workers ----
+    async def _claim(self):
+        now = datetime.utcnow()
+        return await self.collection.find_one_and_update(
+            {"$or": [
+                {"statut": StatutPDFJob.EN_ATTENTE},
+                {"statut": StatutPDFJob.EN_COURS, "lease_until": {"$lt": now}},
+            ]},
+            {
+                "$set": {"statut": StatutPDFJob.EN_COURS, "lease_until": now + LEASE_DURATION, "updated_at": now},
+                "$inc": {"attempts": 1},
+            },
+            sort=[("priority", -1), ("created_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _worker(self, index: int):
+        while True:
+            try:
+                # Emplacement d'arrière-plan réservé avant le bail : un job
+                # réclamé ne reste pas en attente de rendu jusqu'à expiration
+                async with pdf_bulkhead.background_slot():
+                    job = await self._claim()
+                    if job is not None:
+                        await self._process(job)
+                if job is None:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=POLL_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Worker PDF {index}: {e}")
+                await asyncio.sleep(POLL_INTERVAL)
+
+    async def _process(self, job: dict):
+        if job["attempts"] > MAX_ATTEMPTS:
+            await self._fail(job, f"Abandon après {MAX_ATTEMPTS} tentatives")
+            return
+
+        kind = job["kind"]
+        doc = job["payload"]["doc"]
+        try:
+            data = await render_in_pool(kind, doc, job["payload"]["entreprise"])
+        except BrokenProcessPool:
+            # Crash d'un processus de rendu : le job est remis en file
+            if job["attempts"] < MAX_ATTEMPTS:
+                await self.collection.update_one(
+                    {"id": job["id"]},
+                    {"$set": {
+                        "statut": StatutPDFJob.EN_ATTENTE,
+                        "error": "Processus de rendu interrompu",
+                        "updated_at": datetime.utcnow(),
+                    }}
+                )
+                self._wakeup.set()
+            else:
+                await self._fail(job, "Processus de rendu interrompu")
+            return
+        except Exception as e:
+            await self._fail(job, str(e))
+            return
+
+        filename = pdf_filename(kind, doc)
+        file_id = await self.fs.upload_from_stream(
+            filename, data, metadata={"job_id": job["id"], "content_type": "application/pdf"}
+        )
+        await self.collection.update_one(
+            {"id": job["id"]},
+            {
+                "$set": {
+                    "statut": StatutPDFJob.TERMINE,
+                    "file_id": file_id,
+                    "filename": filename,
+                    "size": len(data),
+                    "error": None,
+                    "updated_at": datetime.utcnow(),
+                },
+                "$unset": {"payload": "", "lease_until": ""},
+            }
+        )
+
+    async def _fail(self, job: dict, error: str):
+        logger.error(f"Job PDF {job['id']} en échec: {error}")
+        await self.collection.update_one(
+            {"id": job["id"]},
+            {
+                "$set": {"statut": StatutPDFJob.ECHEC, "error": error, "updated_at": datetime.utcnow()},
+                "$unset": {"payload": "", "lease_until": ""},
+            }
+        )
+
+    # ---- Purge ----
+    async def purge_expired(self):
+        """Supprime les jobs terminés/en échec anciens et leurs fichiers"""
+        limit = datetime.utcnow() - JOB_TTL
+        cursor = self.collection.find(
+            {"statut": {"$in": [StatutPDFJob.TERMINE, StatutPDFJob.ECHEC]}, "updated_at": {"$lt": limit}},
+            {"id": 1, "file_id": 1}
+        )
+        async for job in cursor:
+            # Job d'abord : plus aucune nouvelle lecture ne trouve le fichier supprimé
+            await self.collection.delete_one({"id": job["id"]})
+            if job.get("file_id") is not None:
+                try:
+                    await self.fs.delete(job["file_id"])
+                except Exception as e:
+                    logger.warning(f"Fichier PDF {job['file_id']} introuvable: {e}")
+
+    async def _purge_loop(self):
+        while True:
+            try:
+                await self.purge_expired()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Purge des jobs PDF: {e}")
+            await asyncio.sleep(PURGE_INTERVAL)
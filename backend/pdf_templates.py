@@ -0,0 +1,568 @@
+"""
+Moteur de rendu PDF partagé pour les devis et les factures.
+
+Les styles (ParagraphStyle, TableStyle) sont construits une seule fois à
+l'import du module et réutilisés : chaque rendu n'assemble que les éléments
+qui dépendent des données du document.
+Pour ajouter un type de document (avoir, facture d'acompte...), dériver de
+DocumentTemplate et l'enregistrer dans TEMPLATES.
+"""
+import io
+from abc import ABC, abstractmethod
+from datetime import timedelta
+
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import cm
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.platypus import (
+    SimpleDocTemplate, Table, LongTable, TableStyle, Paragraph, Spacer,
+    KeepTogether, PageBreak, Flowable
+)
+
+from logos import LOGO_BOX, logo_path
+from models import StatutFacture
+
+
+# ==================== STYLES (construits une seule fois) ====================
+COLOR_PRIMARY = colors.HexColor('#1a5276')
+COLOR_TEXT = colors.HexColor('#2c3e50')
+COLOR_MUTED = colors.HexColor('#7f8c8d')
+COLOR_BORDER = colors.HexColor('#bdc3c7')
+COLOR_CATEGORY_BG = colors.HexColor('#e8f4f8')
+COLOR_SUBTOTAL_BG = colors.HexColor('#f5f5f5')
+COLOR_BOX_BG = colors.HexColor('#f8f9fa')
+
+CATEGORY_ORDER = ['cuisine', 'cloison', 'peinture', 'parquet', 'autre', 'service']
+CATEGORY_LABELS = {
+    'cuisine': 'CUISINE',
+    'cloison': 'CLOISON',
+    'peinture': 'PEINTURE',
+    'parquet': 'PARQUET',
+    'autre': 'AUTRE',
+    'service': 'SERVICES'
+}
+
+DEFAULT_MENTIONS_DEVIS = """Les travaux seront réalisés selon les règles de l'art et conformément aux normes en vigueur.
+Le présent devis est valable 30 jours à compter de sa date d'émission.
+Tout retard de paiement entraînera l'application de pénalités de retard au taux légal en vigueur."""
+DEFAULT_GARANTIE = "Garantie décennale et responsabilité civile professionnelle."
+
+
+def _build_styles():
+    """Construit le jeu de styles de paragraphe utilisé par tous les templates"""
+    sample = getSampleStyleSheet()
+    return {
+        'title': ParagraphStyle(
+            'CustomTitle',
+            parent=sample['Heading1'],
+            fontSize=20,
+            textColor=COLOR_PRIMARY,
+            alignment=TA_CENTER,
+            spaceAfter=10
+        ),
+        'header': ParagraphStyle('Header', fontSize=10, textColor=COLOR_TEXT, leading=14),
+        'small': ParagraphStyle('Small', fontSize=8, textColor=COLOR_MUTED, leading=10),
+        'section_title': ParagraphStyle(
+            'SectionTitle',
+            fontSize=11,
+            fontName='Helvetica-Bold',
+            textColor=COLOR_PRIMARY,
+            spaceBefore=10,
+            spaceAfter=5
+        ),
+        # Descriptions dans le tableau (retour à la ligne sans coupure de mot)
+        'desc': ParagraphStyle(
+            'Description',
+            fontSize=9,
+            textColor=COLOR_TEXT,
+            leading=11,
+            wordWrap='CJK'
+        ),
+        'category_header': ParagraphStyle(
+            'CategoryHeader',
+            fontSize=10,
+            fontName='Helvetica-Bold',
+            textColor=COLOR_PRIMARY,
+            leading=12
+        ),
+    }
+
+
+STYLES = _build_styles()
+
+HEADER_TABLE_STYLE = TableStyle([
+    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ('ALIGN', (1, 0), (1, 0), 'RIGHT'),
+])
+
+CLIENT_BOX_STYLE = TableStyle([
+    ('BOX', (0, 0), (-1, -1), 0.5, COLOR_BORDER),
+    ('BACKGROUND', (0, 0), (-1, -1), COLOR_BOX_BG),
+    ('PADDING', (0, 0), (-1, -1), 10),
+])
+
+POSTES_COL_WIDTHS = [8*cm, 1.8*cm, 2.2*cm, 2.5*cm, 3*cm]
+POSTES_HEADER = ["Description", "Qté", "Unité", "P.U. TTC", "Total TTC"]
+# Largeur utile de la colonne description (padding gauche/droite par défaut : 6pt)
+DESC_TEXT_WIDTH = POSTES_COL_WIDTHS[0] - 12
+DESC_FONT = ('Helvetica', 9)
+# Nombre maximal de postes par tableau : borne le coût de mise en page par page
+POSTES_CHUNK_ROWS = 100
+
+
+def _postes_chunk_style(header: bool, category_row: bool, subtotal_row: bool) -> TableStyle:
+    """Style d'une tranche du tableau des postes (indices relatifs à la tranche)"""
+    body = 1 if header else 0
+    commands = [
+        ('ALIGN', (1, 0), (-1, -1), 'CENTER'),
+        ('ALIGN', (3, body), (-1, -1), 'RIGHT'),
+        ('ALIGN', (0, 0), (0, -1), 'LEFT'),
+        ('FONTSIZE', (0, 0), (-1, -1), 9),
+        ('TEXTCOLOR', (0, body), (0, -1), COLOR_TEXT),
+        ('BOTTOMPADDING', (0, body), (-1, -1), 6),
+        ('TOPPADDING', (0, body), (-1, -1), 6),
+        ('GRID', (0, 0), (-1, -1), 0.5, COLOR_BORDER),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ]
+    if header:
+        commands += [
+            ('BACKGROUND', (0, 0), (-1, 0), COLOR_PRIMARY),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 10),
+            ('TOPPADDING', (0, 0), (-1, 0), 10),
+        ]
+    if category_row:
+        commands += [
+            ('BACKGROUND', (0, body), (-1, body), COLOR_CATEGORY_BG),
+            ('SPAN', (0, body), (-1, body)),
+        ]
+    if subtotal_row:
+        commands += [
+            ('BACKGROUND', (0, -1), (-1, -1), COLOR_SUBTOTAL_BG),
+            ('FONTNAME', (4, -1), (4, -1), 'Helvetica-Bold'),
+        ]
+    return TableStyle(commands)
+
+
+POSTES_CHUNK_STYLES = {
+    (header, category_row, subtotal_row): _postes_chunk_style(header, category_row, subtotal_row)
+    for header in (False, True)
+    for category_row in (False, True)
+    for subtotal_row in (False, True)
+}
+
+
+class PostesChunk(LongTable):
+    """
+    Tranche du tableau des postes.
+
+    Les tranches s'enchaînent comme un seul tableau ; seule la première porte
+    l'en-tête de colonnes, qui est répété sur la suite de toute tranche
+    coupée par un saut de page.
+    """
+    _subtotal_row = False
+
+    @classmethod
+    def build(cls, rows: list, header=False, category_row=False, subtotal_row=False):
+        data = [POSTES_HEADER] + rows if header else rows
+        chunk = cls(data, colWidths=POSTES_COL_WIDTHS, repeatRows=1 if header else 0)
+        chunk._subtotal_row = subtotal_row
+        chunk.setStyle(POSTES_CHUNK_STYLES[(header, category_row, subtotal_row)])
+        return chunk
+
+    def split(self, availWidth, availHeight):
+        parts = super().split(availWidth, availHeight)
+        if self.repeatRows:
+            return parts
+        if not parts:
+            # Rien ne tient sur cette page : la tranche repart en haut de la suivante, avec l'en-tête
+            return [PageBreak(), PostesChunk.build(self._cellvalues, header=True, subtotal_row=self._subtotal_row)]
+        if len(parts) == 2:
+            head, tail = parts
+            return [head, PostesChunk.build(tail._cellvalues, header=True, subtotal_row=self._subtotal_row)]
+        return parts
+
+
+TOTALS_TABLE_STYLE = TableStyle([
+    ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
+    ('ALIGN', (2, 0), (2, -1), 'RIGHT'),
+    ('FONTNAME', (1, -1), (-1, -1), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('FONTSIZE', (1, -1), (-1, -1), 12),
+    ('TEXTCOLOR', (1, -1), (-1, -1), COLOR_PRIMARY),
+    ('LINEABOVE', (1, -1), (-1, -1), 1.5, COLOR_PRIMARY),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+    ('TOPPADDING', (0, 0), (-1, -1), 6),
+])
+
+SIGNATURE_TABLE_STYLE = TableStyle([
+    ('BOX', (0, 0), (0, -1), 0.5, COLOR_BORDER),
+    ('BOX', (1, 0), (1, -1), 0.5, COLOR_BORDER),
+    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ('PADDING', (0, 0), (-1, -1), 8),
+])
+
+EMPTY_CLIENT = {"nom": "", "prenom": "", "adresse": "", "code_postal": "", "ville": "", "telephone": "", "email": ""}
+
+
+def _draw_page_number(canvas, doc):
+    """Numéro de page en pied de page"""
+    canvas.saveState()
+    canvas.setFont('Helvetica', 8)
+    canvas.setFillColor(COLOR_MUTED)
+    canvas.drawCentredString(A4[0]/2, 1*cm, f"Page {canvas.getPageNumber()}")
+    canvas.restoreState()
+
+
+# ==================== LOGO (cache par processus) ====================
+LOGO_CACHE_SIZE = 32
+_logo_cache = {}
+
+
+class LogoFlowable(Flowable):
+    """Logo déjà décodé, dessiné dans son cadre sans retraitement"""
+
+    def __init__(self, reader: ImageReader, width: float, height: float):
+        super().__init__()
+        self.reader = reader
+        self.width = width
+        self.height = height
+        self.hAlign = 'LEFT'
+
+    def wrap(self, availWidth, availHeight):
+        return self.width, self.height
+
+    def draw(self):
+        self.canv.drawImage(self.reader, 0, 0, self.width, self.height)
+
+
+def get_logo(logo_hash: str):
+    """
+    (ImageReader, largeur, hauteur) du logo, ou None.
+    Le fichier est lu et décodé une seule fois par processus de rendu ;
+    les JPEG sont ensuite intégrés au PDF tels quels.
+    """
+    if not logo_hash:
+        return None
+    cached = _logo_cache.get(logo_hash)
+    if cached is None:
+        path = logo_path(logo_hash)
+        if path is None:
+            return None
+        reader = ImageReader(io.BytesIO(path.read_bytes()))
+        image_width, image_height = reader.getSize()
+        scale = min(LOGO_BOX[0] / image_width, LOGO_BOX[1] / image_height)
+        cached = (reader, image_width * scale, image_height * scale)
+        if len(_logo_cache) >= LOGO_CACHE_SIZE:
+            _logo_cache.pop(next(iter(_logo_cache)))
+        _logo_cache[logo_hash] = cached
+    return cached
+
+
+def group_postes_by_category(postes: list) -> list:
+    """Retourne [(categorie, postes)] dans l'ordre d'affichage du PDF"""
+    postes_by_category = {}
+    for poste in postes:
+        cat = poste.get("categorie", "autre").lower()
+        postes_by_category.setdefault(cat, []).append(poste)
+    return [(cat, postes_by_category[cat]) for cat in CATEGORY_ORDER if cat in postes_by_category]
+
+
+# ==================== TEMPLATES ====================
+class DocumentTemplate(ABC):
+    """
+    Squelette commun : en-tête entreprise, client, postes groupés par
+    catégorie, totaux, conditions de paiement puis pied de page.
+    Les sous-classes fournissent le bloc d'identification et le pied.
+    """
+    filename_prefix = "Document"
+    numero_field = "numero"
+
+    def get_client(self, doc: dict) -> dict:
+        client = doc.get("client", {})
+        if not isinstance(client, dict):
+            client = {**EMPTY_CLIENT, "nom": str(client)}
+        return client
+
+    def get_totals(self, doc: dict):
+        """Retourne (total_ht, total_tva, total_ttc)"""
+        return doc["total_ht"], doc["total_tva"], doc["total_ttc"]
+
+    @abstractmethod
+    def info_text(self, doc: dict) -> str:
+        """Bloc d'identification (numéro, dates) affiché dans l'en-tête"""
+
+    def closing_elements(self, doc: dict, entreprise: dict) -> list:
+        """Éléments après les conditions de paiement (notes, mentions, signature)"""
+        return []
+
+    def filename(self, doc: dict) -> str:
+        return f"{self.filename_prefix}_{doc[self.numero_field]}.pdf"
+
+    def render(self, doc: dict, entreprise: dict) -> io.BytesIO:
+        """Rend le document et retourne le buffer PDF"""
+        buffer = io.BytesIO()
+        pdf = SimpleDocTemplate(
+            buffer,
+            pagesize=A4,
+            leftMargin=1.5*cm,
+            rightMargin=1.5*cm,
+            topMargin=1.5*cm,
+            bottomMargin=2*cm
+        )
+        total_ht, total_tva, total_ttc = self.get_totals(doc)
+
+        elements = []
+        elements += self.header_elements(doc, entreprise)
+        elements += self.client_elements(self.get_client(doc))
+        elements += self.postes_elements(doc["postes"])
+        elements += self.totals_elements(doc["tva_taux"], total_ht, total_tva, total_ttc)
+        elements += self.conditions_elements(doc.get("conditions_paiement", {}), total_ttc)
+        elements += self.closing_elements(doc, entreprise)
+
+        pdf.build(elements, onFirstPage=_draw_page_number, onLaterPages=_draw_page_number)
+        return buffer
+
+    # ---- Blocs communs ----
+    def header_elements(self, doc: dict, entreprise: dict) -> list:
+        entreprise_nom = entreprise.get("nom", "Votre Entreprise")
+        entreprise_tel = entreprise.get("telephone", "")
+        entreprise_email = entreprise.get("email", "")
+        entreprise_siret = entreprise.get("siret", "")
+        entreprise_tva = entreprise.get("tva_intracom", "")
+        entreprise_text = f"""<b>{entreprise_nom}</b><br/>
+{entreprise.get("adresse", "")}<br/>
+{entreprise.get("code_postal", "")} {entreprise.get("ville", "")}<br/>
+{f'Tél: {entreprise_tel}' if entreprise_tel else ''}<br/>
+{f'Email: {entreprise_email}' if entreprise_email else ''}<br/>
+{f'SIRET: {entreprise_siret}' if entreprise_siret else ''}<br/>
+{f'TVA: {entreprise_tva}' if entreprise_tva else ''}"""
+
+        entreprise_cell = Paragraph(entreprise_text, STYLES['header'])
+        logo = get_logo(entreprise.get("logo_hash"))
+        if logo:
+            entreprise_cell = [LogoFlowable(*logo), Spacer(1, 0.3*cm), entreprise_cell]
+
+        header_table = Table([[
+            entreprise_cell,
+            Paragraph(self.info_text(doc), STYLES['header'])
+        ]], colWidths=[10*cm, 7*cm])
+        header_table.setStyle(HEADER_TABLE_STYLE)
+        return [header_table, Spacer(1, 1*cm)]
+
+    def client_elements(self, client: dict) -> list:
+        client_nom_complet = f"{client.get('prenom', '')} {client.get('nom', '')}".strip()
+        client_tel = client.get('telephone', '')
+        client_email = client.get('email', '')
+        client_text = f"""<b>{client_nom_complet}</b><br/>
+{client.get('adresse', '')}<br/>
+{client.get('code_postal', '')} {client.get('ville', '')}<br/>
+{f'Tél: {client_tel}' if client_tel else ''}<br/>
+{f'Email: {client_email}' if client_email else ''}"""
+
+        client_box = Table([[Paragraph(client_text, STYLES['header'])]], colWidths=[9*cm])
+        client_box.setStyle(CLIENT_BOX_STYLE)
+        return [
+            Paragraph("CLIENT", STYLES['section_title']),
+            client_box,
+            Spacer(1, 0.8*cm)
+        ]
+
+    def postes_elements(self, postes: list) -> list:
+        """
+        Tableau des postes groupés par catégorie avec sous-totaux.
+
+        Chaque catégorie est découpée en tranches de POSTES_CHUNK_ROWS postes
+        (styles précalculés, cellules texte simples quand la description tient
+        sur une ligne sans balisage) : le temps de rendu reste linéaire en
+        nombre de postes.
+        """
+        elements = [Paragraph("DÉTAIL DES PRESTATIONS", STYLES['section_title'])]
+        header = True
+
+        for cat, cat_postes in group_postes_by_category(postes):
+            cat_label = CATEGORY_LABELS.get(cat, cat.upper())
+            rows = [[Paragraph(f"<b>{cat_label}</b>", STYLES['category_header']), "", "", "", ""]]
+            category_row = True
+
+            cat_subtotal = 0
+            for poste in cat_postes:
+                is_offert = poste.get("offert", False)
+                sous_total = poste.get('sous_total', 0)
+                if not is_offert:
+                    cat_subtotal += sous_total
+
+                rows.append([
+                    self.description_cell(poste['reference_nom']),
+                    f"{poste['quantite']:.2f}",
+                    poste['unite'],
+                    f"{poste['prix_ajuste']:.2f} €",
+                    "OFFERT" if is_offert else f"{sous_total:.2f} €"
+                ])
+                if len(rows) >= POSTES_CHUNK_ROWS:
+                    elements.append(PostesChunk.build(rows, header=header, category_row=category_row))
+                    rows, header, category_row = [], False, False
+
+            # Sous-total de la catégorie
+            rows.append([
+                Paragraph(f"<i>Sous-total {cat_label}</i>", STYLES['desc']),
+                "", "", "",
+                f"{cat_subtotal:.2f} €"
+            ])
+            elements.append(PostesChunk.build(rows, header=header, category_row=category_row, subtotal_row=True))
+            header = False
+
+        if header:
+            # Aucun poste : tableau réduit à l'en-tête
+            postes_table = Table([POSTES_HEADER], colWidths=POSTES_COL_WIDTHS)
+            postes_table.setStyle(POSTES_CHUNK_STYLES[(True, False, False)])
+            elements.append(postes_table)
+
+        elements.append(Spacer(1, 0.5*cm))
+        return elements
+
+    def description_cell(self, description: str):
+        """Texte simple si la description tient sur une ligne sans balisage, Paragraph sinon"""
+        if (
+            '\n' not in description
+            and '<' not in description
+            and '&' not in description
+            and stringWidth(description, *DESC_FONT) <= DESC_TEXT_WIDTH
+        ):
+            return description
+        return Paragraph(description, STYLES['desc'])
+
+    def totals_elements(self, tva_taux, total_ht, total_tva, total_ttc) -> list:
+        totals_table = Table([
+            ["", "Total HT:", f"{total_ht:.2f} €"],
+            ["", f"TVA ({tva_taux}%):", f"{total_tva:.2f} €"],
+            ["", "TOTAL TTC:", f"{total_ttc:.2f} €"]
+        ], colWidths=[11*cm, 3.5*cm, 3*cm])
+        totals_table.setStyle(TOTALS_TABLE_STYLE)
+        return [totals_table, Spacer(1, 0.8*cm)]
+
+    def conditions_elements(self, conditions: dict, total_ttc: float) -> list:
+        """Conditions de paiement (bloc non coupé)"""
+        if not conditions:
+            return []
+        conditions_elements = [Paragraph("CONDITIONS DE PAIEMENT", STYLES['section_title'])]
+
+        if conditions.get("type") == "acomptes" and conditions.get("acomptes"):
+            acomptes_text = "Règlement en plusieurs versements :<br/>"
+            for i, acompte in enumerate(conditions["acomptes"]):
+                desc = acompte.get("description", f"Versement {i+1}")
+                pourcentage = acompte.get("pourcentage", 0)
+                montant = total_ttc * (pourcentage / 100)
+                acomptes_text += f"• {desc}: {pourcentage}% soit {montant:.2f} € TTC<br/>"
+            conditions_elements.append(Paragraph(acomptes_text, STYLES['header']))
+        else:
+            delai = conditions.get("delai_jours", 30)
+            conditions_elements.append(Paragraph(f"Paiement à {delai} jours à réception de facture.", STYLES['header']))
+
+        conditions_elements.append(Spacer(1, 0.5*cm))
+        return [KeepTogether(conditions_elements)]
+
+    def mentions_elements(self, mentions: str) -> list:
+        return [
+            Spacer(1, 0.3*cm),
+            Paragraph("MENTIONS LÉGALES", STYLES['section_title']),
+            Paragraph(mentions.replace("\n", "<br/>"), STYLES['small'])
+        ]
+
+
+class DevisTemplate(DocumentTemplate):
+    filename_prefix = "Devis"
+    numero_field = "numero_devis"
+
+    def get_client(self, doc: dict) -> dict:
+        # Compatibilité ancien format (client_nom)
+        if isinstance(doc.get("client"), dict):
+            return doc["client"]
+        return {**EMPTY_CLIENT, "nom": doc.get("client_nom", "Client")}
+
+    def get_totals(self, doc: dict):
+        # Les prix sont en TTC : recalcul du HT en excluant les postes offerts
+        total_ttc = sum(
+            poste.get("sous_total", 0)
+            for poste in doc["postes"]
+            if not poste.get("offert", False)
+        )
+        total_ht = total_ttc / (1 + doc["tva_taux"] / 100)
+        return total_ht, total_ttc - total_ht, total_ttc
+
+    def info_text(self, doc: dict) -> str:
+        date_validite = doc.get("date_validite", doc["date_creation"] + timedelta(days=30))
+        return f"""<b>DEVIS N° {doc['numero_devis']}</b><br/>
+Date: {doc['date_creation'].strftime('%d/%m/%Y')}<br/>
+Validité: {date_validite.strftime('%d/%m/%Y')}"""
+
+    def closing_elements(self, doc: dict, entreprise: dict) -> list:
+        elements = []
+
+        notes = doc.get("notes", "")
+        if notes:
+            elements.append(Paragraph("REMARQUES", STYLES['section_title']))
+            elements.append(Paragraph(notes, STYLES['header']))
+            elements.append(Spacer(1, 0.5*cm))
+
+        # Mentions légales + garantie + signature (bloc non coupé)
+        footer_elements = self.mentions_elements(entreprise.get("mentions_legales", DEFAULT_MENTIONS_DEVIS))
+
+        garantie = entreprise.get("garantie", DEFAULT_GARANTIE)
+        if entreprise.get("afficher_garantie", True) and garantie:
+            footer_elements.append(Spacer(1, 0.3*cm))
+            footer_elements.append(Paragraph(f"<b>Garantie:</b> {garantie}", STYLES['small']))
+
+        footer_elements.append(Spacer(1, 0.8*cm))
+        entreprise_nom = entreprise.get("nom", "Votre Entreprise")
+        signature_table = Table([
+            [
+                Paragraph("<b>Bon pour accord</b><br/>Date et signature du client:", STYLES['header']),
+                Paragraph(f"<b>{entreprise_nom}</b><br/>Signature:", STYLES['header'])
+            ],
+            ["", ""]
+        ], colWidths=[8.5*cm, 8.5*cm], rowHeights=[1*cm, 2.5*cm])
+        signature_table.setStyle(SIGNATURE_TABLE_STYLE)
+        footer_elements.append(signature_table)
+
+        elements.append(KeepTogether(footer_elements))
+        return elements
+
+
+class FactureTemplate(DocumentTemplate):
+    filename_prefix = "Facture"
+    numero_field = "numero_facture"
+
+    def info_text(self, doc: dict) -> str:
+        text = f"""<b>FACTURE N° {doc['numero_facture']}</b><br/>
+Date: {doc['date_creation'].strftime('%d/%m/%Y')}<br/>
+Devis associé: {doc.get('devis_numero', 'N/A')}"""
+        if doc.get("statut") == StatutFacture.PAYEE and doc.get("date_paiement"):
+            text += f"<br/>Payée le: {doc['date_paiement'].strftime('%d/%m/%Y')}"
+        return text
+
+    def closing_elements(self, doc: dict, entreprise: dict) -> list:
+        mentions = entreprise.get("mentions_legales", "")
+        if not mentions:
+            return []
+        return [KeepTogether(self.mentions_elements(mentions))]
+
+
+TEMPLATES = {
+    "devis": DevisTemplate(),
+    "facture": FactureTemplate(),
+}
+
+
+def render_pdf(kind: str, doc: dict, entreprise: dict) -> io.BytesIO:
+    """Rend un document ('devis', 'facture') avec le template correspondant"""
+    return TEMPLATES[kind].render(doc, entreprise)
+
+
+def pdf_filename(kind: str, doc: dict) -> str:
+    return TEMPLATES[kind].filename(doc)
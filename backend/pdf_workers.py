@@ -0,0 +1,66 @@
+"""
+Pool de processus pour le rendu PDF.
+
+Le rendu ReportLab est purement CPU : il est exécuté dans des processus
+séparés pour utiliser tous les cœurs sans bloquer la boucle asyncio.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", os.cpu_count() or 2))
+
+_executor = None
+
+
+def _warm_up():
+    """Import de ReportLab et construction des styles au démarrage du processus"""
+    import pdf_templates  # noqa: F401
+
+
+def _render(kind: str, doc: dict, entreprise: dict) -> bytes:
+    from pdf_templates import render_pdf
+    return render_pdf(kind, doc, entreprise).getvalue()
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=PDF_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_warm_up,
+        )
+    return _executor
+
+
+def _discard_executor(broken: ProcessPoolExecutor):
+    global _executor
+    if _executor is broken:
+        _executor = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+async def render_in_pool(kind: str, doc: dict, entreprise: dict) -> bytes:
+    """Rend un document dans le pool et retourne le PDF"""
+    executor = get_executor()
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(executor, _render, kind, doc, entreprise)
+    except BrokenProcessPool:
+        # Un processus est mort (OOM, crash) : le pool sera recréé au prochain appel
+        logger.error("Pool de rendu PDF cassé, recréation")
+        _discard_executor(executor)
+        raise
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,191 @@
+"""
+Stockage compact des postes de devis et de factures.
+
+Un poste stocké ne garde que ce qui lui est propre : son id, la quantité,
+le prix ajusté, le flag offert et les options. Le reste (catégorie,
+référence, libellé, unité, fourchette de prix) est décrit par un
+« descripteur » partagé par tous les postes identiques, stocké une seule
+fois dans `poste_descriptors` sous le hash de son contenu. Ce hash fait
+office de version du catalogue : un rechargement des tarifs produit de
+nouveaux descripteurs sans modifier les devis existants.
+
+    {"id": ..., "d": <hash descripteur>, "q": quantite, "p": prix_ajuste,
+     "o": true (si offert), "x": {options} (si présentes)}
+
+devis_id (l'id du document parent) et sous_total (q × p) sont recalculés à
+la lecture. Les postes de l'ancien format complet sont acceptés tels quels.
+"""
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Tuple
+
+from pymongo.errors import BulkWriteError
+
+from pdf_templates import CATEGORY_ORDER
+
+logger = logging.getLogger(__name__)
+
+DESCRIPTOR_FIELDS = ("categorie", "reference_id", "reference_nom", "unite", "prix_min", "prix_max", "prix_default")
+DUPLICATE_KEY = 11000
+# Descripteurs gardés en mémoire (LRU) ; quelques centaines d'octets chacun
+DESCRIPTOR_CACHE_SIZE = int(os.environ.get("DESCRIPTOR_CACHE_SIZE", 20000))
+
+# Sous-totaux par descripteur (ou par catégorie pour l'ancien format), calculés
+# par Mongo sans renvoyer les postes ; voir PosteStore.category_subtotals()
+SUBTOTAL_STAGES = [
+    {"$unwind": "$postes"},
+    {"$group": {
+        "_id": {"d": "$postes.d", "categorie": "$postes.categorie"},
+        "sous_total": {"$sum": {"$cond": [
+            {"$ifNull": ["$postes.o", {"$ifNull": ["$postes.offert", False]}]},
+            0,
+            {"$ifNull": [{"$multiply": ["$postes.q", "$postes.p"]}, "$postes.sous_total"]},
+        ]}},
+        "nb_postes": {"$sum": 1},
+    }},
+]
+
+
+def descriptor_id(descriptor: dict) -> str:
+    content = json.dumps(descriptor, sort_keys=True, ensure_ascii=False)
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=10).hexdigest()
+
+
+def is_compact(poste: dict) -> bool:
+    return "d" in poste
+
+
+def split_poste(poste: dict) -> Tuple[dict, dict]:
+    """Poste complet -> (forme stockée, descripteur)"""
+    descriptor = {field: poste[field] for field in DESCRIPTOR_FIELDS}
+    stored = {"id": poste["id"], "d": descriptor_id(descriptor), "q": poste["quantite"], "p": poste["prix_ajuste"]}
+    if poste.get("offert"):
+        stored["o"] = True
+    if poste.get("options") is not None:
+        stored["x"] = poste["options"]
+    return stored, descriptor
+
+
+class PosteStore:
+    def __init__(self, db, cache_size: int = DESCRIPTOR_CACHE_SIZE):
+        self.collection = db.poste_descriptors
+        # Index en mémoire hash -> descripteur (les descripteurs sont immuables), LRU
+        self.cache_size = cache_size
+        self._index: "OrderedDict[str, dict]" = OrderedDict()
+
+    async def ensure_indexes(self):
+        # Couvre descriptor_keys() : hash des descripteurs d'une catégorie
+        await self.collection.create_index([("categorie", 1), ("_id", 1)])
+
+    def _remember(self, key: str, descriptor: dict):
+        self._index[key] = descriptor
+        self._index.move_to_end(key)
+        while len(self._index) > self.cache_size:
+            self._index.popitem(last=False)
+
+    async def compact(self, postes: List[dict]) -> List[dict]:
+        """Postes complets -> forme stockée ; enregistre les descripteurs nouveaux"""
+        compacted = []
+        new_descriptors = {}
+        for poste in postes:
+            if is_compact(poste):
+                compacted.append(poste)
+                continue
+            stored, descriptor = split_poste(poste)
+            if stored["d"] not in self._index:
+                new_descriptors[stored["d"]] = descriptor
+            compacted.append(stored)
+
+        if new_descriptors:
+            await self._save(new_descriptors)
+        return compacted
+
+    async def _save(self, descriptors: dict):
+        try:
+            await self.collection.insert_many(
+                [{"_id": key, **descriptor} for key, descriptor in descriptors.items()],
+                ordered=False
+            )
+        except BulkWriteError as e:
+            # Descripteurs déjà enregistrés (par un autre processus) : contenu identique
+            if any(error["code"] != DUPLICATE_KEY for error in e.details.get("writeErrors", [])):
+                raise
+        for key, descriptor in descriptors.items():
+            self._remember(key, descriptor)
+
+    async def _descriptors(self, keys: Iterable[str]) -> Dict[str, dict]:
+        """Descripteurs demandés, depuis l'index puis en une seule requête"""
+        found = {}
+        missing = []
+        for key in set(keys):
+            descriptor = self._index.get(key)
+            if descriptor is None:
+                missing.append(key)
+            else:
+                self._index.move_to_end(key)
+                found[key] = descriptor
+        if missing:
+            async for descriptor in self.collection.find({"_id": {"$in": missing}}):
+                key = descriptor.pop("_id")
+                self._remember(key, descriptor)
+                found[key] = descriptor
+            unknown = set(missing) - found.keys()
+            if unknown:
+                logger.error(f"Descripteurs de postes introuvables: {', '.join(sorted(unknown))}")
+        return found
+
+    async def expand(self, doc: dict) -> dict:
+        """Remplace en place les postes stockés d'un devis/facture par les postes complets"""
+        postes = doc.get("postes")
+        if not postes:
+            return doc
+        descriptors = await self._descriptors(poste["d"] for poste in postes if is_compact(poste))
+
+        parent_id = doc.get("devis_id") or doc["id"]
+        doc["postes"] = [
+            self._expand_one(poste, parent_id, descriptors) if is_compact(poste) else poste
+            for poste in postes
+        ]
+        return doc
+
+    async def descriptor_keys(self, categorie: str) -> List[str]:
+        """Hash des descripteurs d'une catégorie (pour filtrer les postes stockés)"""
+        cursor = self.collection.find({"categorie": categorie}, {"_id": 1})
+        return [descriptor["_id"] async for descriptor in cursor]
+
+    async def category_subtotals(self, groups: List[dict]) -> List[dict]:
+        """Résultats de SUBTOTAL_STAGES -> sous-totaux par catégorie, dans l'ordre du PDF"""
+        descriptors = await self._descriptors(g["_id"]["d"] for g in groups if g["_id"].get("d"))
+
+        by_category = {}
+        for group in groups:
+            key = group["_id"].get("d")
+            categorie = descriptors[key]["categorie"] if key in descriptors else group["_id"].get("categorie") or "autre"
+            entry = by_category.setdefault(categorie.lower(), {"sous_total": 0.0, "nb_postes": 0})
+            entry["sous_total"] += group["sous_total"] or 0
+            entry["nb_postes"] += group["nb_postes"]
+
+        order = {categorie: i for i, categorie in enumerate(CATEGORY_ORDER)}
+        return [
+            {"categorie": categorie, "nb_postes": entry["nb_postes"], "sous_total": round(entry["sous_total"], 2)}
+            for categorie, entry in sorted(by_category.items(), key=lambda item: order.get(item[0], len(order)))
+        ]
+
+    def _expand_one(self, stored: dict, parent_id: str, descriptors: Dict[str, dict]) -> dict:
+        descriptor = descriptors.get(stored["d"]) or {
+            "categorie": "autre", "reference_id": "", "reference_nom": "Poste inconnu",
+            "unite": "", "prix_min": 0.0, "prix_max": 0.0, "prix_default": 0.0,
+        }
+        return {
+            "id": stored["id"],
+            "devis_id": parent_id,
+            **descriptor,
+            "quantite": stored["q"],
+            "prix_ajuste": stored["p"],
+            "sous_total": stored["q"] * stored["p"],
+            "options": stored.get("x"),
+            "offert": stored.get("o", False),
+        }
@@ -0,0 +1,76 @@
+"""
+Classes de réponse HTTP spécifiques à l'API.
+"""
+import io
+from typing import Any, Type, TypeVar, Union
+from urllib.parse import quote
+
+import orjson
+from pydantic import BaseModel
+from starlette.responses import JSONResponse, Response
+
+M = TypeVar("M", bound=BaseModel)
+
+
+class PDFResponse(Response):
+    """
+    Réponse PDF servie directement depuis le buffer de rendu.
+
+    Le contenu d'un BytesIO est exposé via getbuffer() (memoryview, sans copie)
+    et envoyé tel quel : ni fichier temporaire, ni relecture disque. Les octets
+    renvoyés par le pool de rendu sont acceptés directement.
+    Content-Length est calculé sur la taille réelle du buffer.
+    """
+    media_type = "application/pdf"
+
+    def __init__(self, content: Union[io.BytesIO, bytes], filename: str, headers: dict = None):
+        headers = dict(headers or {})
+        headers.setdefault("content-disposition", content_disposition(filename))
+        if isinstance(content, io.BytesIO):
+            content = content.getbuffer()
+        super().__init__(content=content, headers=headers)
+
+    def render(self, content) -> memoryview:
+        return memoryview(content)
+
+
+def _encode_default(obj):
+    # orjson gère nativement dict, list, datetime, Enum. Les modèles de l'API
+    # n'ont ni alias ni sérialiseur : leurs champs (__dict__) sont encodés
+    # tels quels, sous-modèles compris, sans passer par model_dump()
+    if isinstance(obj, BaseModel):
+        return obj.__dict__
+    raise TypeError(f"Type non sérialisable : {type(obj).__name__}")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    Réponse JSON encodée par orjson.
+
+    À retourner directement depuis une route (chemin rapide, sur option) :
+    FastAPI ne revalide alors pas le contenu contre response_model, qui ne
+    sert plus qu'à la documentation OpenAPI. Les en-têtes posés sur le
+    paramètre `response` de la route ne sont pas repris : les passer à
+    `headers`.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=_encode_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def trusted(model: Type[M], doc: dict) -> M:
+    """
+    Modèle construit sans validation à partir d'un document écrit par
+    l'application (déjà validé à l'écriture) : seuls les champs du modèle
+    sont repris, les valeurs par défaut complètent les champs absents.
+    Les sous-objets restent des dict.
+    """
+    return model.model_construct(**{field: doc[field] for field in model.model_fields if field in doc})
+
+
+def content_disposition(filename: str) -> str:
+    """En-tête Content-Disposition (même format que FileResponse)"""
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
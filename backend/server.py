@@ -1,23 +1,29 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, File, Header, Query, Request, Response, UploadFile, status
+from fastapi.responses import FileResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+import asyncio
+import orjson
 import os
 import logging
 from pathlib import Path
-from typing import List, Optional
+from typing import List, Literal, Optional, Union
 from datetime import datetime
+from contextlib import asynccontextmanager
 import uuid
 
 from models import (
     UserCreate, UserLogin, User, TokenResponse,
     RefCuisineType, RefCuisineElement, RefCuisineMateriau,
     RefCloison, RefPeinture, RefParquet, RefExtra,
-    DevisCreate, Devis, DevisListItem, DevisUpdate, PosteDevis,
+    DevisCreate, Devis, DevisListItem, DevisUpdate, PosteDevis, DevisSummary, PostesPage,
     CategoriePoste, StatutDevis, EntrepriseInfo, EntrepriseUpdate,
     ClientInfo, DevisConditionsPaiement, Acompte,
-    FactureCreate, Facture, FactureListItem, StatutFacture
+    FactureCreate, Facture, FactureListItem, StatutFacture,
+    PDFExportRequest, PDFJob, StatutPDFJob,
+    DevisExportRequest, FormatExport, BatchRequest
 )
 from auth import (
     verify_password, get_password_hash, create_access_token,
@@ -29,6 +35,27 @@ from seed_data import (
     REF_PARQUETS, REF_PARQUET_POSES, REF_EXTRAS, REF_PROFESSIONNELS
 )
 from config_loader import get_reference_data, load_tarifs
+from compression import CompressionMiddleware, PrecompressedCache
+from responses import FastJSONResponse, PDFResponse, content_disposition, trusted
+from pdf_templates import pdf_filename
+from pdf_export import stream_pdf_archive
+from pdf_jobs import PDFJobQueue
+from pdf_bulkhead import BulkheadFull, pdf_bulkhead
+from devis_export import DEVIS_COLUMNS, MULTI_DEVIS_COLUMNS, EXPORT_MEDIA_TYPES, devis_rows, make_writer
+from fieldsets import field_projection, parse_fields, pick
+from versioning import INC_VERSION, NEXT_VERSION, etag, etag_matches, parse_if_match, version_filter
+from migrations import DEVIS_SCHEMA_VERSION, DevisMigration, upgrade_devis
+from postes_store import SUBTOTAL_STAGES, PosteStore
+from batch import BATCH_MAX_OPERATIONS, run_batch
+from sync import SyncLog, make_token, parse_token
+from events import EventBroker
+from invalidation import BusFanout, InvalidationBus, make_backend
+from idempotency import IdempotencyStore
+from singleflight import SingleFlight
+from devis_cache import DevisCache, cache_version
+from snapshots import SNAPSHOT_FIELDS, SnapshotStore, snapshot_content
+from logos import LOGO_FORMATS, LOGO_MAX_UPLOAD, LogoError, logo_path, save_logo
+import pdf_workers
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -38,6 +65,20 @@ mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
+# Rendus PDF en arrière-plan
+pdf_job_queue = PDFJobQueue(db)
+poste_store = PosteStore(db)
+snapshot_store = SnapshotStore(db)
+sync_log = SyncLog(db)
+# Invalidations et notifications de changement partagées entre processus
+invalidation_bus = InvalidationBus(make_backend(db))
+event_broker = EventBroker(BusFanout(invalidation_bus))
+devis_cache = DevisCache()
+event_broker.add_listener(devis_cache.on_change)
+idempotency_store = IdempotencyStore(db)
+devis_migration = DevisMigration(db)
+migration_task = None
+
 # Create the main app
 app = FastAPI(title="API Devis Rénovation")
 api_router = APIRouter(prefix="/api")
@@ -79,12 +120,28 @@ async def seed_database():
 
 @app.on_event("startup")
 async def startup_event():
+    global migration_task
     await seed_database()
+    await pdf_job_queue.ensure_indexes()
+    await poste_store.ensure_indexes()
+    await sync_log.ensure_indexes()
+    await idempotency_store.ensure_indexes()
+    await invalidation_bus.start()
+    await event_broker.start()
+    pdf_job_queue.start()
+    # Mise à niveau des anciens devis, en tâche de fond
+    migration_task = asyncio.create_task(devis_migration.run_safely())
 
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    if migration_task:
+        migration_task.cancel()
+    await event_broker.stop()
+    await invalidation_bus.stop()
+    await pdf_job_queue.stop()
     client.close()
+    pdf_workers.shutdown()
 
 
 # ==================== AUTH ROUTES ====================
@@ -166,10 +223,30 @@ async def get_current_user(user_id: str = Depends(get_current_user_id)):
 
 
 # ==================== ENTREPRISE (PROFIL) ROUTES ====================
+# Lectures simultanées du profil regroupées ; une écriture du profil
+# détache les lectures suivantes de celle en cours
+profile_flight = SingleFlight()
+PROFILE_PROJECTION = {"_id": 0, "entreprise": 1, "sync_seq": 1}
+
+
+def forget_profile(user_id: Optional[str], payload: Optional[dict] = None):
+    if user_id is not None:
+        profile_flight.forget(user_id)
+
+
+invalidation_bus.subscribe("profile", forget_profile)
+
+
+async def load_profile(user_id: str) -> Optional[dict]:
+    """Entreprise et sync_seq de l'utilisateur (None s'il n'existe pas) ; résultat partagé, à ne pas modifier"""
+    return await profile_flight.do(user_id, lambda: db.users.find_one({"id": user_id}, PROFILE_PROJECTION))
+
+
 @api_router.get("/entreprise")
 async def get_entreprise(user_id: str = Depends(get_current_user_id)):
-    user_doc = await db.users.find_one({"id": user_id})
-    if not user_doc:
+    user_doc = await load_profile(user_id)
+    # {} pour un utilisateur sans profil ni sync_seq (projection vide)
+    if user_doc is None:
         raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
     
     entreprise = user_doc.get("entreprise", {})
@@ -201,60 +278,154 @@ async def update_entreprise(
     # Save to database
     await db.users.update_one(
         {"id": user_id},
-        {"$set": {"entreprise": current_entreprise}}
+        {"$set": {"entreprise": current_entreprise, **await sync_log.stamp(user_id)}}
     )
+    await invalidation_bus.publish("profile", user_id)
     
     return EntrepriseInfo(**current_entreprise)
 
 
+@api_router.post("/entreprise/logo")
+async def upload_logo(
+    file: UploadFile = File(...),
+    user_id: str = Depends(get_current_user_id)
+):
+    """
+    Envoi du logo de l'entreprise.
+    L'image est normalisée une fois ici (taille du cadre PDF, fond blanc,
+    PNG/JPEG compact) et stockée sous le hash de son contenu.
+    """
+    if not await db.users.find_one({"id": user_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
+    
+    data = await file.read(LOGO_MAX_UPLOAD + 1)
+    if len(data) > LOGO_MAX_UPLOAD:
+        raise HTTPException(status_code=413, detail="Logo trop volumineux (5 Mo maximum)")
+    
+    try:
+        logo_hash = await asyncio.to_thread(save_logo, data)
+    except LogoError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    logo_url = f"/api/logos/{logo_hash}"
+    result = await db.users.update_one(
+        {"id": user_id},
+        {"$set": {"entreprise.logo_hash": logo_hash, "entreprise.logo_url": logo_url, **await sync_log.stamp(user_id)}}
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
+    await invalidation_bus.publish("profile", user_id)
+    
+    return {"logo_hash": logo_hash, "logo_url": logo_url}
+
+
+@api_router.delete("/entreprise/logo")
+async def delete_logo(user_id: str = Depends(get_current_user_id)):
+    if not await db.users.find_one({"id": user_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
+    
+    result = await db.users.update_one(
+        {"id": user_id},
+        {"$unset": {"entreprise.logo_hash": "", "entreprise.logo_url": ""}, "$set": await sync_log.stamp(user_id)}
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Utilisateur non trouvé")
+    await invalidation_bus.publish("profile", user_id)
+    return {"message": "Logo supprimé"}
+
+
+@api_router.get("/logos/{logo_hash}")
+async def get_logo_file(logo_hash: str):
+    """Fichier de logo (contenu immuable : mis en cache indéfiniment)"""
+    path = logo_path(logo_hash)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Logo non trouvé")
+    return FileResponse(
+        path,
+        media_type=LOGO_FORMATS[path.suffix[1:]],
+        headers={"Cache-Control": "public, max-age=31536000, immutable"}
+    )
+
+
 # ==================== REFERENCE DATA ROUTES ====================
+# Collections du catalogue exposées par /references/...
+REFERENCE_COLLECTIONS = {
+    "cuisine_types": "ref_cuisine_types",
+    "plans_travail": "ref_plans_travail",
+    "cloisons": "ref_cloisons",
+    "cloison_options": "ref_cloison_options",
+    "peintures": "ref_peintures",
+    "parquets": "ref_parquets",
+    "parquet_poses": "ref_parquet_poses",
+    "extras": "ref_extras",
+}
+
+# Le catalogue ne change qu'au rechargement des tarifs : ses réponses sont
+# sérialisées et compressées une fois, puis servies telles quelles
+reference_cache = PrecompressedCache()
+invalidation_bus.subscribe("catalog", lambda key, payload: reference_cache.clear())
+
+
+async def load_references(name: str, query: Optional[dict] = None) -> list:
+    return await db[REFERENCE_COLLECTIONS[name]].find(query or {}, {"_id": 0}).to_list(100)
+
+
+async def reference_response(key: str, load, accept_encoding: Optional[str]) -> Response:
+    async def build():
+        return orjson.dumps(await load())
+    body = await reference_cache.get(key, build)
+    return body.response(accept_encoding)
+
+
+@api_router.get("/references")
+async def get_references(accept_encoding: Optional[str] = Header(None)):
+    """Catalogue complet en une seule réponse"""
+    async def load():
+        return {name: await load_references(name) for name in REFERENCE_COLLECTIONS}
+    return await reference_response("all", load, accept_encoding)
+
+
 @api_router.get("/references/cuisine/types")
-async def get_cuisine_types():
-    items = await db.ref_cuisine_types.find({}, {"_id": 0}).to_list(100)
-    return items
+async def get_cuisine_types(accept_encoding: Optional[str] = Header(None)):
+    return await reference_response("cuisine_types", lambda: load_references("cuisine_types"), accept_encoding)
 
 
 @api_router.get("/references/cuisine/plans-travail")
-async def get_plans_travail():
-    items = await db.ref_plans_travail.find({}, {"_id": 0}).to_list(100)
-    return items
+async def get_plans_travail(accept_encoding: Optional[str] = Header(None)):
+    return await reference_response("plans_travail", lambda: load_references("plans_travail"), accept_encoding)
 
 
 @api_router.get("/references/cloisons")
-async def get_cloisons():
-    items = await db.ref_cloisons.find({}, {"_id": 0}).to_list(100)
-    return items
+async def get_cloisons(accept_encoding: Optional[str] = Header(None)):
+    return await reference_response("cloisons", lambda: load_references("cloisons"), accept_encoding)
 
 
 @api_router.get("/references/cloisons/options")
-async def get_cloison_options():
-    items = await db.ref_cloison_options.find({}, {"_id": 0}).to_list(100)
-    return items
+async def get_cloison_options(accept_encoding: Optional[str] = Header(None)):
+    return await reference_response("cloison_options", lambda: load_references("cloison_options"), accept_encoding)
 
 
 @api_router.get("/references/peintures")
-async def get_peintures():
-    items = await db.ref_peintures.find({}, {"_id": 0}).to_list(100)
-    return items
+async def get_peintures(accept_encoding: Optional[str] = Header(None)):
+    return await reference_response("peintures", lambda: load_references("peintures"), accept_encoding)
 
 
 @api_router.get("/references/parquets")
-async def get_parquets():
-    items = await db.ref_parquets.find({}, {"_id": 0}).to_list(100)
-    return items
+async def get_parquets(accept_encoding: Optional[str] = Header(None)):
+    return await reference_response("parquets", lambda: load_references("parquets"), accept_encoding)
 
 
 @api_router.get("/references/parquets/poses")
-async def get_parquet_poses():
-    items = await db.ref_parquet_poses.find({}, {"_id": 0}).to_list(100)
-    return items
+async def get_parquet_poses(accept_encoding: Optional[str] = Header(None)):
+    return await reference_response("parquet_poses", lambda: load_references("parquet_poses"), accept_encoding)
 
 
 @api_router.get("/references/extras")
-async def get_extras(categorie: Optional[str] = None):
-    query = {"categorie": categorie} if categorie else {}
-    items = await db.ref_extras.find(query, {"_id": 0}).to_list(100)
-    return items
+async def get_extras(categorie: Optional[str] = None, accept_encoding: Optional[str] = Header(None)):
+    if categorie:
+        # Filtre libre : pas mis en cache (clés non bornées), compressé par le middleware
+        return FastJSONResponse(await load_references("extras", {"categorie": categorie}))
+    return await reference_response("extras", lambda: load_references("extras"), accept_encoding)
 
 
 # ==================== DEVIS ROUTES ====================
@@ -264,6 +435,88 @@ def generate_numero_devis():
     return f"DEV-{timestamp}"
 
 
+MS_PER_DAY = 24 * 3600 * 1000
+# Champs repris dans les notifications de changement (GET /api/events)
+CHANGE_EVENT_FIELDS = ("id", "devis_id", "statut", "version", "sync_seq")
+CHANGE_EVENT_PROJECTION = {"_id": 0, **{field: 1 for field in CHANGE_EVENT_FIELDS}}
+
+
+def literal(value):
+    """Valeur à écrire telle quelle dans une mise à jour en pipeline"""
+    return {"$literal": value}
+
+
+def not_modified(version: Optional[int]) -> Response:
+    return Response(status_code=304, headers={"ETag": etag(version)})
+
+
+def partial_response(doc: dict, fields: set) -> FastJSONResponse:
+    """Objet JSON limité aux champs demandés (?fields=), sans modèle Pydantic"""
+    return FastJSONResponse(pick(doc, fields), headers={"ETag": etag(doc.get("version"))})
+
+
+async def raise_write_failed(collection, doc_id: str, user_id: str, expected_version: Optional[int], not_found: str):
+    """Écriture sans effet : 412 si le document existe dans une autre version, 404 sinon"""
+    if expected_version is not None:
+        current = await collection.find_one({"id": doc_id, "user_id": user_id}, {"_id": 0, "version": 1})
+        if current is not None:
+            raise HTTPException(
+                status_code=412,
+                detail="Le document a été modifié entre-temps, veuillez le recharger",
+                headers={"ETag": etag(current.get("version"))}
+            )
+    raise HTTPException(status_code=404, detail=not_found)
+
+
+async def snapshot_devis(devis_doc: dict) -> str:
+    """Enregistre l'instantané du contenu stocké d'un devis et le rattache au devis"""
+    content = snapshot_content(devis_doc)
+    content["postes"] = await poste_store.compact(content["postes"])
+    snapshot_id = await snapshot_store.put(content)
+    # Sans effet si le devis a été modifié entre-temps (instantané périmé)
+    await db.devis.update_one(
+        {"id": devis_doc["id"], "version": devis_doc.get("version")},
+        {"$set": {"snapshot_id": snapshot_id}}
+    )
+    return snapshot_id
+
+
+async def expand_document(doc: dict) -> dict:
+    """Contenu complet d'un devis ou d'une facture tels que stockés (instantané, postes compacts)"""
+    await snapshot_store.assemble(doc)
+    return await poste_store.expand(doc)
+
+
+async def load_devis(devis_id: str, user_id: str) -> Optional[dict]:
+    """
+    Devis normalisé (migré, postes complets). Seule la version est lue en
+    base si le cache a déjà cette version ; le résultat ne doit pas être
+    modifié en profondeur (postes partagés avec le cache).
+    """
+    query = {"id": devis_id, "user_id": user_id}
+    current = await db.devis.find_one(query, {"_id": 0, "version": 1})
+    if current is None:
+        return None
+    devis_doc = devis_cache.get(user_id, devis_id, cache_version(current))
+    if devis_doc is not None:
+        return devis_doc
+    
+    devis_doc = await db.devis.find_one(query, {"_id": 0})
+    if devis_doc is None:
+        return None
+    upgrade_devis(devis_doc)
+    await poste_store.expand(devis_doc)
+    devis_cache.put(user_id, devis_doc)
+    return devis_doc
+
+
+async def publish_change(user_id: str, type: str, doc: dict):
+    """Notifie les appareils de l'utilisateur (GET /api/events) d'une écriture"""
+    await event_broker.publish(user_id, type, **{
+        field: doc[field] for field in CHANGE_EVENT_FIELDS if doc.get(field) is not None
+    })
+
+
 def calculate_devis_totals(postes_data: list, tva_taux: float):
     """Helper function to calculate devis totals"""
     postes = []
@@ -313,15 +566,24 @@ def calculate_devis_totals(postes_data: list, tva_taux: float):
 @api_router.post("/devis", response_model=Devis)
 async def create_devis(
     devis_data: DevisCreate,
+    idempotency_key: Optional[str] = Header(None),
     user_id: str = Depends(get_current_user_id)
 ):
+    """Créer un devis ; avec Idempotency-Key, une nouvelle tentative rejoue la première réponse"""
+    return await idempotency_store.run(
+        user_id, "devis", idempotency_key, devis_data,
+        lambda: insert_devis(devis_data, user_id)
+    )
+
+
+async def insert_devis(devis_data: DevisCreate, user_id: str) -> FastJSONResponse:
     # Create devis
     devis_id = str(uuid.uuid4())
     numero_devis = generate_numero_devis()
     
     # Get user's default conditions if not provided
     if not devis_data.conditions_paiement:
-        user_doc = await db.users.find_one({"id": user_id})
+        user_doc = await load_profile(user_id)
         if user_doc and user_doc.get("entreprise"):
             entreprise = user_doc["entreprise"]
             if "conditions_paiement" in entreprise:
@@ -356,14 +618,20 @@ async def create_devis(
         statut=StatutDevis.BROUILLON,
         conditions_paiement=devis_data.conditions_paiement,
         notes=devis_data.notes or "",
-        postes=postes
+        postes=postes,
+        version=1
     )
     
     # Save to database
     devis_dict = devis.dict()
+    devis_dict["schema_version"] = DEVIS_SCHEMA_VERSION
+    devis_dict["postes"] = await poste_store.compact(devis_dict["postes"])
+    devis_dict.update(await sync_log.stamp(user_id))
     await db.devis.insert_one(devis_dict)
+    await publish_change(user_id, "devis.created", devis_dict)
     
-    return devis
+    # Modèle déjà validé : pas de seconde validation contre response_model
+    return FastJSONResponse(devis, headers={"ETag": etag(devis.version)})
 
 
 @api_router.get("/devis", response_model=List[DevisListItem])
@@ -375,576 +643,412 @@ async def list_devis(
     if statut:
         query["statut"] = statut
     
-    devis_list = await db.devis.find(query).sort("date_creation", -1).to_list(100)
+    devis_list = await db.devis.find(query, {"_id": 0, "postes": 0}).sort("date_creation", -1).to_list(100)
     
-    result = []
-    for d in devis_list:
-        # Handle both old format (client_nom) and new format (client object)
-        if isinstance(d.get("client"), dict):
-            client_nom = d["client"].get("nom", "Client inconnu")
-        else:
-            client_nom = d.get("client_nom", "Client inconnu")
-        
-        result.append(DevisListItem(
-            id=d["id"],
-            numero_devis=d["numero_devis"],
-            client_nom=client_nom,
-            date_creation=d["date_creation"],
-            total_ttc=d["total_ttc"],
-            statut=d["statut"]
-        ))
-    
-    return result
+    return FastJSONResponse([devis_list_item(d) for d in devis_list])
 
 
-@api_router.get("/devis/{devis_id}", response_model=Devis)
+def devis_list_item(d: dict) -> dict:
+    """Ligne de liste d'un devis (forme DevisListItem, sans modèle Pydantic)"""
+    upgrade_devis(d)
+    return {
+        "id": d["id"],
+        "numero_devis": d["numero_devis"],
+        "client_nom": d["client"].get("nom", "Client inconnu"),
+        "date_creation": d["date_creation"],
+        "total_ttc": d["total_ttc"],
+        "statut": d["statut"],
+    }
+
+
+@api_router.get("/devis/{devis_id}", response_model=Union[Devis, DevisSummary])
 async def get_devis(
     devis_id: str,
+    response: Response,
+    include: Optional[Literal["summary"]] = None,
+    fields: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
     user_id: str = Depends(get_current_user_id)
 ):
-    devis_doc = await db.devis.find_one({"id": devis_id, "user_id": user_id})
+    """
+    Devis complet, ou avec ?include=summary l'en-tête, les totaux et les
+    sous-totaux par catégorie sans les postes (lus ensuite page par page
+    via /devis/{id}/postes), ou avec ?fields=a,b seulement ces champs.
+    """
+    requested = parse_fields(fields, Devis)
+    if requested and include:
+        raise HTTPException(status_code=400, detail="include et fields ne peuvent pas être combinés")
+    
+    if if_none_match:
+        # Polling : seule la version est lue tant que le devis n'a pas changé
+        current = await db.devis.find_one({"id": devis_id, "user_id": user_id}, {"_id": 0, "version": 1})
+        if current is None:
+            raise HTTPException(status_code=404, detail="Devis non trouvé")
+        if etag_matches(if_none_match, current.get("version")):
+            return not_modified(current.get("version"))
+    
+    if include == "summary":
+        return await get_devis_summary(devis_id, user_id, response)
+    
+    query = {"id": devis_id, "user_id": user_id}
+    if requested:
+        devis_doc = await db.devis.find_one(query, field_projection(requested | {"version", "schema_version"}))
+        if devis_doc is None:
+            raise HTTPException(status_code=404, detail="Devis non trouvé")
+        if devis_doc.get("schema_version", 0) < DEVIS_SCHEMA_VERSION:
+            # Devis pas encore migré : relu en entier pour être complété
+            devis_doc = upgrade_devis(await db.devis.find_one(query, {"_id": 0}))
+        if "postes" in requested:
+            await poste_store.expand(devis_doc)
+        return partial_response(devis_doc, requested)
+    
+    devis_doc = await load_devis(devis_id, user_id)
     if not devis_doc:
         raise HTTPException(status_code=404, detail="Devis non trouvé")
     
-    # Handle backward compatibility - convert old format to new
-    if "client" not in devis_doc or not isinstance(devis_doc["client"], dict):
-        client_nom = devis_doc.get("client_nom", "Client")
-        devis_doc["client"] = {
-            "nom": client_nom,
-            "prenom": "",
-            "adresse": "",
-            "code_postal": "",
-            "ville": "",
-            "telephone": "",
-            "email": ""
-        }
-    
-    # Ensure all required fields exist
-    if "date_validite" not in devis_doc:
-        from datetime import timedelta
-        devis_doc["date_validite"] = devis_doc["date_creation"] + timedelta(days=30)
-    
-    if "total_tva" not in devis_doc:
-        devis_doc["total_tva"] = devis_doc["total_ttc"] - devis_doc["total_ht"]
+    return FastJSONResponse(trusted(Devis, devis_doc), headers={"ETag": etag(devis_doc.get("version"))})
+
+
+async def get_devis_summary(devis_id: str, user_id: str, response: Response) -> DevisSummary:
+    # Une seule requête : l'en-tête sans les postes et les sous-totaux calculés par Mongo
+    pipeline = [
+        {"$match": {"id": devis_id, "user_id": user_id}},
+        {"$facet": {
+            "header": [{"$project": {"_id": 0, "postes": 0}}],
+            "groups": SUBTOTAL_STAGES,
+        }},
+    ]
+    result = (await db.devis.aggregate(pipeline).to_list(1))[0]
+    if not result["header"]:
+        raise HTTPException(status_code=404, detail="Devis non trouvé")
     
-    if "conditions_paiement" not in devis_doc:
-        devis_doc["conditions_paiement"] = {"type": "jours", "delai_jours": 30, "acomptes": []}
+    devis_doc = upgrade_devis(result["header"][0])
+    sous_totaux = await poste_store.category_subtotals(result["groups"])
+    response.headers["ETag"] = etag(devis_doc.get("version"))
+    return DevisSummary(
+        **devis_doc,
+        nb_postes=sum(entry["nb_postes"] for entry in sous_totaux),
+        sous_totaux=sous_totaux
+    )
+
+
+def parse_postes_cursor(cursor: Optional[str]):
+    """Curseur « version:position » -> (version, position) ; (None, 0) pour la première page"""
+    if not cursor:
+        return None, 0
+    try:
+        version, position = (int(part) for part in cursor.split(":"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Curseur invalide")
+    if position < 0:
+        raise HTTPException(status_code=400, detail="Curseur invalide")
+    return version, position
+
+
+@api_router.get("/devis/{devis_id}/postes", response_model=PostesPage)
+async def list_devis_postes(
+    devis_id: str,
+    categorie: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(200, ge=1, le=1000),
+    user_id: str = Depends(get_current_user_id)
+):
+    """
+    Postes d'un devis page par page, dans l'ordre de saisie, éventuellement
+    filtrés par catégorie. Seule la page demandée est lue : $filter et
+    $slice sont appliqués par Mongo. Le curseur est lié à la version du
+    devis ; s'il a été modifié entre deux pages, la lecture est à reprendre
+    (409).
+    """
+    cursor_version, position = parse_postes_cursor(cursor)
+    
+    postes = "$postes"
+    if categorie:
+        keys = await poste_store.descriptor_keys(categorie)
+        postes = {"$filter": {
+            "input": "$postes",
+            "as": "poste",
+            "cond": {"$or": [{"$in": ["$$poste.d", keys]}, {"$eq": ["$$poste.categorie", categorie]}]},
+        }}
+    pipeline = [
+        {"$match": {"id": devis_id, "user_id": user_id}},
+        # Un poste de plus que demandé : indique s'il reste une page
+        {"$project": {"_id": 0, "id": 1, "version": 1, "postes": {"$slice": [postes, position, limit + 1]}}},
+    ]
+    docs = await db.devis.aggregate(pipeline).to_list(1)
+    if not docs:
+        raise HTTPException(status_code=404, detail="Devis non trouvé")
     
-    if "notes" not in devis_doc:
-        devis_doc["notes"] = ""
+    devis_doc = docs[0]
+    version = devis_doc.get("version") or 0
+    if cursor_version is not None and cursor_version != version:
+        raise HTTPException(
+            status_code=409,
+            detail="Le devis a été modifié, veuillez recharger les postes",
+            headers={"ETag": etag(version)}
+        )
     
-    return Devis(**devis_doc)
+    has_more = len(devis_doc["postes"]) > limit
+    del devis_doc["postes"][limit:]
+    await poste_store.expand(devis_doc)
+    
+    return FastJSONResponse(
+        {
+            "postes": devis_doc["postes"],
+            "next_cursor": f"{version}:{position + limit}" if has_more else None,
+            "version": version,
+        },
+        headers={"ETag": etag(version)}
+    )
 
 
 @api_router.put("/devis/{devis_id}", response_model=Devis)
 async def update_devis_full(
     devis_id: str,
     update_data: DevisUpdate,
+    if_match: Optional[str] = Header(None),
     user_id: str = Depends(get_current_user_id)
 ):
     """Full update of a quote - allows modification of all fields including postes"""
-    devis_doc = await db.devis.find_one({"id": devis_id, "user_id": user_id})
-    if not devis_doc:
-        raise HTTPException(status_code=404, detail="Devis non trouvé")
-    
-    update_dict = {}
+    devis = await apply_devis_update(devis_id, update_data, user_id, parse_if_match(if_match))
+    return FastJSONResponse(devis, headers={"ETag": etag(devis.version)})
+
+
+@api_router.patch("/devis/{devis_id}", response_model=Devis)
+async def update_devis_partial(
+    devis_id: str,
+    update_data: DevisUpdate,
+    if_match: Optional[str] = Header(None),
+    user_id: str = Depends(get_current_user_id)
+):
+    """Partial update - mainly for status changes"""
+    return await update_devis_full(devis_id, update_data, if_match, user_id)
+
+
+async def apply_devis_update(devis_id: str, update_data: DevisUpdate, user_id: str, expected_version: Optional[int]) -> Devis:
+    """
+    Applique la mise à jour en une seule écriture atomique.
+    Avec une version attendue (If-Match), l'écriture échoue en 412 si le
+    devis a été modifié entre-temps.
+    """
+    # Mise à jour en pipeline : les valeurs envoyées sont passées en $literal,
+    # les champs dérivés de l'existant (date_validite, TVA) sont calculés par Mongo
+    update_stage = {}
     
     # Update client info
     if update_data.client is not None:
-        update_dict["client"] = update_data.client.dict()
+        update_stage["client"] = literal(update_data.client.dict())
     
     # Update TVA
     if update_data.tva_taux is not None:
-        update_dict["tva_taux"] = update_data.tva_taux
+        update_stage["tva_taux"] = literal(update_data.tva_taux)
     
-    # Update validity
+    # Update validity (calculée à partir de la date de création stockée)
     if update_data.validite_jours is not None:
-        from datetime import timedelta
-        update_dict["validite_jours"] = update_data.validite_jours
-        update_dict["date_validite"] = devis_doc["date_creation"] + timedelta(days=update_data.validite_jours)
+        update_stage["validite_jours"] = literal(update_data.validite_jours)
+        update_stage["date_validite"] = {"$add": ["$date_creation", update_data.validite_jours * MS_PER_DAY]}
     
     # Update payment conditions
     if update_data.conditions_paiement is not None:
-        update_dict["conditions_paiement"] = update_data.conditions_paiement.dict()
+        update_stage["conditions_paiement"] = literal(update_data.conditions_paiement.dict())
     
     # Update notes
     if update_data.notes is not None:
-        update_dict["notes"] = update_data.notes
+        update_stage["notes"] = literal(update_data.notes)
     
     # Update status
     if update_data.statut is not None:
-        update_dict["statut"] = update_data.statut.value
+        update_stage["statut"] = literal(update_data.statut.value)
     
     # Update postes if provided
     if update_data.postes is not None:
-        tva_taux = update_data.tva_taux if update_data.tva_taux is not None else devis_doc["tva_taux"]
-        postes, total_ht, total_tva, total_ttc = calculate_devis_totals(update_data.postes, tva_taux)
-        
-        # Update devis_id in postes
+        postes, total_ht, _, _ = calculate_devis_totals(update_data.postes, 0)
         postes_dicts = []
         for poste in postes:
             poste.devis_id = devis_id
             postes_dicts.append(poste.dict())
         
-        update_dict["postes"] = postes_dicts
-        update_dict["total_ht"] = total_ht
-        update_dict["total_tva"] = total_tva
-        update_dict["total_ttc"] = total_ttc
-    
-    # Update the document
-    if update_dict:
-        await db.devis.update_one(
-            {"id": devis_id},
-            {"$set": update_dict}
+        # Mêmes calculs que calculate_devis_totals, avec le taux stocké si non fourni
+        total_ht_raw = sum(poste.sous_total for poste in postes if not poste.offert)
+        tva_taux = update_data.tva_taux if update_data.tva_taux is not None else "$tva_taux"
+        total_tva_raw = {"$multiply": [total_ht_raw, {"$divide": [tva_taux, 100]}]}
+        
+        update_stage["postes"] = literal(await poste_store.compact(postes_dicts))
+        update_stage["total_ht"] = literal(total_ht)
+        update_stage["total_tva"] = {"$round": [total_tva_raw, 2]}
+        update_stage["total_ttc"] = {"$round": [{"$add": [total_ht_raw, total_tva_raw]}, 2]}
+    
+    # Le contenu change : l'instantané de validation ne le décrit plus
+    if any(field in update_stage for field in SNAPSHOT_FIELDS):
+        update_stage["snapshot_id"] = None
+    
+    query = {"id": devis_id, "user_id": user_id, **version_filter(expected_version)}
+    if update_stage:
+        update_stage["version"] = NEXT_VERSION
+        update_stage.update({field: literal(value) for field, value in (await sync_log.stamp(user_id)).items()})
+        # Postes inchangés et devis en cache : ils ne sont pas relus
+        cached = devis_cache.peek(user_id, devis_id) if "postes" not in update_stage else None
+        devis_doc = await db.devis.find_one_and_update(
+            query,
+            [{"$set": update_stage}],
+            projection={"_id": 0, "postes": 0} if cached else {"_id": 0},
+            return_document=ReturnDocument.AFTER
         )
-        devis_doc.update(update_dict)
-    
-    # Handle backward compatibility
-    if "client" not in devis_doc or not isinstance(devis_doc["client"], dict):
-        client_nom = devis_doc.get("client_nom", "Client")
-        devis_doc["client"] = {
-            "nom": client_nom, "prenom": "", "adresse": "", 
-            "code_postal": "", "ville": "", "telephone": "", "email": ""
-        }
+        if devis_doc and cached:
+            if cache_version(devis_doc) == cache_version(cached) + 1:
+                devis_doc["postes"] = cached["postes"]
+            else:
+                # Autre écriture depuis la version en cache : lecture complète
+                devis_doc = await db.devis.find_one({"id": devis_id, "user_id": user_id}, {"_id": 0})
+    else:
+        devis_doc = await db.devis.find_one(query, {"_id": 0})
+    if not devis_doc:
+        await raise_write_failed(db.devis, devis_id, user_id, expected_version, "Devis non trouvé")
     
-    if "date_validite" not in devis_doc:
-        from datetime import timedelta
-        devis_doc["date_validite"] = devis_doc["date_creation"] + timedelta(days=30)
+    # Devis validé/envoyé : PDF pré-rendu en arrière-plan pour le premier téléchargement
+    if update_stage and devis_doc.get("statut") in PRERENDER_STATUTS:
+        await pdf_job_queue.schedule_prerender(user_id, "devis", devis_id, cache_version(devis_doc))
     
-    if "total_tva" not in devis_doc:
-        devis_doc["total_tva"] = devis_doc["total_ttc"] - devis_doc["total_ht"]
+    upgrade_devis(devis_doc)
     
-    if "conditions_paiement" not in devis_doc:
-        devis_doc["conditions_paiement"] = {"type": "jours", "delai_jours": 30, "acomptes": []}
+    # Devis validé : instantané de son contenu, repris tel quel par la facture
+    if devis_doc.get("statut") in SNAPSHOT_STATUTS and not devis_doc.get("snapshot_id"):
+        devis_doc["snapshot_id"] = await snapshot_devis(devis_doc)
     
-    if "notes" not in devis_doc:
-        devis_doc["notes"] = ""
+    if update_stage:
+        await publish_change(user_id, "devis.updated", devis_doc)
     
-    return Devis(**devis_doc)
-
-
-@api_router.patch("/devis/{devis_id}", response_model=Devis)
-async def update_devis_partial(
-    devis_id: str,
-    update_data: DevisUpdate,
-    user_id: str = Depends(get_current_user_id)
-):
-    """Partial update - mainly for status changes"""
-    return await update_devis_full(devis_id, update_data, user_id)
+    await poste_store.expand(devis_doc)
+    if update_stage:
+        devis_cache.put(user_id, devis_doc)
+    
+    return trusted(Devis, devis_doc)
 
 
 @api_router.delete("/devis/{devis_id}")
 async def delete_devis(
     devis_id: str,
+    if_match: Optional[str] = Header(None),
     user_id: str = Depends(get_current_user_id)
 ):
-    result = await db.devis.delete_one({"id": devis_id, "user_id": user_id})
+    expected_version = parse_if_match(if_match)
+    result = await db.devis.delete_one({"id": devis_id, "user_id": user_id, **version_filter(expected_version)})
     if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Devis non trouvé")
+        await raise_write_failed(db.devis, devis_id, user_id, expected_version, "Devis non trouvé")
+    devis_cache.invalidate(user_id, devis_id)
+    stamp = await sync_log.tombstone(user_id, "devis", devis_id)
+    await publish_change(user_id, "devis.deleted", {"id": devis_id, **stamp})
     
     return {"message": "Devis supprimé avec succès"}
 
 
+def pdf_capacity_error(e: BulkheadFull) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Trop de PDF en cours de génération, veuillez réessayer dans quelques instants",
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+
+async def acquire_pdf_ticket(user_id: str):
+    """Réserve un emplacement de rendu PDF, 503 + Retry-After si saturé"""
+    try:
+        return await pdf_bulkhead.acquire(user_id)
+    except BulkheadFull as e:
+        raise pdf_capacity_error(e)
+
+
+def check_pdf_capacity(user_id: str):
+    """503 + Retry-After si une demande de rendu serait refusée"""
+    try:
+        pdf_bulkhead.check(user_id)
+    except BulkheadFull as e:
+        raise pdf_capacity_error(e)
+
+
+@asynccontextmanager
+async def pdf_render_slot(user_id: str):
+    ticket = await acquire_pdf_ticket(user_id)
+    try:
+        yield
+    finally:
+        ticket.release()
+
+
+# Rendus simultanés du même document (même version, même profil) regroupés
+pdf_flight = SingleFlight()
+
+
+async def render_pdf_once(kind: str, user_id: str, doc: dict, profile: Optional[dict]):
+    """Rendu PDF synchrone ; les demandes identiques en cours partagent le même rendu"""
+    entreprise = profile.get("entreprise", {}) if profile else {}
+    
+    async def render():
+        async with pdf_render_slot(user_id):
+            return await pdf_workers.render_in_pool(kind, doc, entreprise)
+    
+    key = (kind, user_id, doc["id"], doc.get("version"), profile.get("sync_seq") if profile else None)
+    return await pdf_flight.do(key, render)
+
+
+PRERENDER_STATUTS = (StatutDevis.VALIDE, StatutDevis.ENVOYE)
+SNAPSHOT_STATUTS = (StatutDevis.VALIDE, StatutDevis.ENVOYE, StatutDevis.ACCEPTE)
+
+
+async def load_prerender(user_id: str, kind: str, document_id: str):
+    """Devis et profil à pré-rendre, ou None si le devis n'est plus validé/envoyé"""
+    devis_doc = await load_devis(document_id, user_id)
+    if not devis_doc or devis_doc.get("statut") not in PRERENDER_STATUTS:
+        return None
+    return devis_doc, await load_profile(user_id)
+
+
+pdf_job_queue.prerender_loader = load_prerender
+
+
 @api_router.get("/devis/{devis_id}/pdf")
 async def generate_pdf(
     devis_id: str,
     user_id: str = Depends(get_current_user_id)
 ):
     """Generate professional PDF for a quote"""
-    from reportlab.lib.pagesizes import A4
-    from reportlab.lib import colors
-    from reportlab.lib.units import cm, mm
-    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image, KeepTogether, PageBreak
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.lib.enums import TA_CENTER, TA_RIGHT, TA_LEFT
-    import io
-    import base64
-    
-    # Get devis
-    devis_doc = await db.devis.find_one({"id": devis_id, "user_id": user_id})
+    devis_doc = await load_devis(devis_id, user_id)
     if not devis_doc:
         raise HTTPException(status_code=404, detail="Devis non trouvé")
     
     # Get user's entreprise info
-    user_doc = await db.users.find_one({"id": user_id})
-    entreprise = user_doc.get("entreprise", {}) if user_doc else {}
-    
-    # Handle backward compatibility for client
-    if isinstance(devis_doc.get("client"), dict):
-        client = devis_doc["client"]
-    else:
-        client = {"nom": devis_doc.get("client_nom", "Client"), "prenom": "", "adresse": "", "code_postal": "", "ville": "", "telephone": "", "email": ""}
-    
-    # Get date validité
-    from datetime import timedelta
-    date_validite = devis_doc.get("date_validite", devis_doc["date_creation"] + timedelta(days=30))
-    
-    # Calculate totals - les prix sont en TTC, recalculer le HT
-    tva_taux = devis_doc["tva_taux"]
-    
-    # Calculer le total TTC en excluant les postes offerts
-    total_ttc = sum(
-        poste.get("sous_total", 0) 
-        for poste in devis_doc["postes"] 
-        if not poste.get("offert", False)
-    )
-    # Recalculer le HT à partir du TTC
-    total_ht = total_ttc / (1 + tva_taux / 100)
-    total_tva = total_ttc - total_ht
-    
-    # Create PDF with page numbering
-    buffer = io.BytesIO()
-    
-    # Page numbering function
-    def add_page_number(canvas, doc):
-        page_num = canvas.getPageNumber()
-        text = f"Page {page_num}"
-        canvas.saveState()
-        canvas.setFont('Helvetica', 8)
-        canvas.setFillColor(colors.HexColor('#7f8c8d'))
-        canvas.drawCentredString(A4[0]/2, 1*cm, text)
-        canvas.restoreState()
-    
-    doc = SimpleDocTemplate(
-        buffer, 
-        pagesize=A4,
-        leftMargin=1.5*cm,
-        rightMargin=1.5*cm,
-        topMargin=1.5*cm,
-        bottomMargin=2*cm
-    )
+    profile = await load_profile(user_id)
     
-    styles = getSampleStyleSheet()
+    # PDF déjà pré-rendu pour ce contenu exact
+    cached_job = await pdf_job_queue.find_cached("devis", devis_doc, profile)
+    if cached_job:
+        response = await pdf_job_file_response(cached_job)
+        if response is not None:
+            return response
     
-    # Custom styles
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=20,
-        textColor=colors.HexColor('#1a5276'),
-        alignment=TA_CENTER,
-        spaceAfter=10
-    )
-    
-    header_style = ParagraphStyle(
-        'Header',
-        fontSize=10,
-        textColor=colors.HexColor('#2c3e50'),
-        leading=14
-    )
-    
-    small_style = ParagraphStyle(
-        'Small',
-        fontSize=8,
-        textColor=colors.HexColor('#7f8c8d'),
-        leading=10
-    )
-    
-    section_title_style = ParagraphStyle(
-        'SectionTitle',
-        fontSize=11,
-        fontName='Helvetica-Bold',
-        textColor=colors.HexColor('#1a5276'),
-        spaceBefore=10,
-        spaceAfter=5
-    )
-    
-    # Style pour les descriptions dans le tableau (avec retour à la ligne)
-    desc_style = ParagraphStyle(
-        'Description',
-        fontSize=9,
-        textColor=colors.HexColor('#2c3e50'),
-        leading=11,
-        wordWrap='CJK'  # Permet le retour à la ligne sans coupure de mot
-    )
-    
-    # Style pour les entêtes de catégorie
-    category_header_style = ParagraphStyle(
-        'CategoryHeader',
-        fontSize=10,
-        fontName='Helvetica-Bold',
-        textColor=colors.HexColor('#1a5276'),
-        leading=12
-    )
-    
-    elements = []
-    
-    # ==== HEADER: Entreprise + Devis Info ====
-    entreprise_nom = entreprise.get("nom", "Votre Entreprise")
-    entreprise_adresse = entreprise.get("adresse", "")
-    entreprise_cp = entreprise.get("code_postal", "")
-    entreprise_ville = entreprise.get("ville", "")
-    entreprise_tel = entreprise.get("telephone", "")
-    entreprise_email = entreprise.get("email", "")
-    entreprise_siret = entreprise.get("siret", "")
-    entreprise_tva = entreprise.get("tva_intracom", "")
-    
-    # Entreprise info (left side)
-    entreprise_text = f"""<b>{entreprise_nom}</b><br/>
-{entreprise_adresse}<br/>
-{entreprise_cp} {entreprise_ville}<br/>
-{f'Tél: {entreprise_tel}' if entreprise_tel else ''}<br/>
-{f'Email: {entreprise_email}' if entreprise_email else ''}<br/>
-{f'SIRET: {entreprise_siret}' if entreprise_siret else ''}<br/>
-{f'TVA: {entreprise_tva}' if entreprise_tva else ''}"""
-    
-    # Devis info (right side)
-    devis_info_text = f"""<b>DEVIS N° {devis_doc['numero_devis']}</b><br/>
-Date: {devis_doc['date_creation'].strftime('%d/%m/%Y')}<br/>
-Validité: {date_validite.strftime('%d/%m/%Y')}"""
-    
-    header_table_data = [[
-        Paragraph(entreprise_text, header_style),
-        Paragraph(devis_info_text, header_style)
-    ]]
-    header_table = Table(header_table_data, colWidths=[10*cm, 7*cm])
-    header_table.setStyle(TableStyle([
-        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-        ('ALIGN', (1, 0), (1, 0), 'RIGHT'),
-    ]))
-    elements.append(header_table)
-    elements.append(Spacer(1, 1*cm))
-    
-    # ==== CLIENT INFO ====
-    elements.append(Paragraph("CLIENT", section_title_style))
-    
-    client_nom_complet = f"{client.get('prenom', '')} {client.get('nom', '')}".strip()
-    client_adresse = client.get('adresse', '')
-    client_cp = client.get('code_postal', '')
-    client_ville = client.get('ville', '')
-    client_tel = client.get('telephone', '')
-    client_email = client.get('email', '')
-    
-    client_text = f"""<b>{client_nom_complet}</b><br/>
-{client_adresse}<br/>
-{client_cp} {client_ville}<br/>
-{f'Tél: {client_tel}' if client_tel else ''}<br/>
-{f'Email: {client_email}' if client_email else ''}"""
-    
-    client_box = Table([[Paragraph(client_text, header_style)]], colWidths=[9*cm])
-    client_box.setStyle(TableStyle([
-        ('BOX', (0, 0), (-1, -1), 0.5, colors.HexColor('#bdc3c7')),
-        ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#f8f9fa')),
-        ('PADDING', (0, 0), (-1, -1), 10),
-    ]))
-    elements.append(client_box)
-    elements.append(Spacer(1, 0.8*cm))
-    
-    # ==== POSTES TABLE - Groupés par catégorie avec sous-totaux ====
-    elements.append(Paragraph("DÉTAIL DES PRESTATIONS", section_title_style))
-    
-    # Grouper les postes par catégorie
-    postes_by_category = {}
-    category_order = ['cuisine', 'cloison', 'peinture', 'parquet', 'autre', 'service']
-    category_labels = {
-        'cuisine': 'CUISINE',
-        'cloison': 'CLOISON',
-        'peinture': 'PEINTURE',
-        'parquet': 'PARQUET',
-        'autre': 'AUTRE',
-        'service': 'SERVICES'
-    }
-    
-    for poste in devis_doc["postes"]:
-        cat = poste.get("categorie", "autre").lower()
-        if cat not in postes_by_category:
-            postes_by_category[cat] = []
-        postes_by_category[cat].append(poste)
-    
-    # Construire le tableau avec groupement par catégorie
-    table_data = [["Description", "Qté", "Unité", "P.U. TTC", "Total TTC"]]
-    
-    # Style des lignes (pour alterner les couleurs et marquer les entêtes)
-    row_styles = []
-    current_row = 1  # Commence à 1 car row 0 = header
-    
-    for cat in category_order:
-        if cat not in postes_by_category:
-            continue
-        
-        postes = postes_by_category[cat]
-        cat_label = category_labels.get(cat, cat.upper())
-        
-        # Ligne d'entête de catégorie
-        table_data.append([
-            Paragraph(f"<b>{cat_label}</b>", category_header_style),
-            "", "", "", ""
-        ])
-        row_styles.append(('BACKGROUND', (0, current_row), (-1, current_row), colors.HexColor('#e8f4f8')))
-        row_styles.append(('SPAN', (0, current_row), (-1, current_row)))
-        current_row += 1
-        
-        # Sous-total de la catégorie
-        cat_subtotal = 0
-        
-        # Lignes des postes
-        for poste in postes:
-            is_offert = poste.get("offert", False)
-            # Description sans préfixe de catégorie
-            description = poste['reference_nom']
-            
-            # Utiliser Paragraph pour le retour à la ligne automatique
-            desc_para = Paragraph(description, desc_style)
-            
-            sous_total = poste.get('sous_total', 0)
-            if not is_offert:
-                cat_subtotal += sous_total
-            
-            table_data.append([
-                desc_para,
-                f"{poste['quantite']:.2f}",
-                poste['unite'],
-                f"{poste['prix_ajuste']:.2f} €",
-                "OFFERT" if is_offert else f"{sous_total:.2f} €"
-            ])
-            current_row += 1
-        
-        # Ligne de sous-total de la catégorie
-        table_data.append([
-            Paragraph(f"<i>Sous-total {cat_label}</i>", desc_style),
-            "", "", "",
-            f"{cat_subtotal:.2f} €"
-        ])
-        row_styles.append(('BACKGROUND', (0, current_row), (-1, current_row), colors.HexColor('#f5f5f5')))
-        row_styles.append(('FONTNAME', (4, current_row), (4, current_row), 'Helvetica-Bold'))
-        current_row += 1
-    
-    # Créer le tableau
-    postes_table = Table(table_data, colWidths=[8*cm, 1.8*cm, 2.2*cm, 2.5*cm, 3*cm])
-    
-    # Styles de base
-    base_styles = [
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1a5276')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (1, 0), (-1, -1), 'CENTER'),
-        ('ALIGN', (3, 1), (-1, -1), 'RIGHT'),
-        ('ALIGN', (0, 0), (0, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 9),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 10),
-        ('TOPPADDING', (0, 0), (-1, 0), 10),
-        ('BOTTOMPADDING', (0, 1), (-1, -1), 6),
-        ('TOPPADDING', (0, 1), (-1, -1), 6),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#bdc3c7')),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-    ]
-    
-    # Ajouter les styles spécifiques aux lignes
-    all_styles = base_styles + row_styles
-    postes_table.setStyle(TableStyle(all_styles))
+    data = await render_pdf_once("devis", user_id, devis_doc, profile)
+    return PDFResponse(data, filename=pdf_filename("devis", devis_doc))
+
+
+@api_router.get("/devis/{devis_id}/export")
+async def export_devis(
+    devis_id: str,
+    format: FormatExport = FormatExport.CSV,
+    user_id: str = Depends(get_current_user_id)
+):
+    """Postes du devis en CSV ou XLSX (mêmes regroupements que le PDF)"""
+    devis_doc = await load_devis(devis_id, user_id)
+    if not devis_doc:
+        raise HTTPException(status_code=404, detail="Devis non trouvé")
     
-    elements.append(postes_table)
-    elements.append(Spacer(1, 0.5*cm))
+    writer = make_writer(format.value, DEVIS_COLUMNS, sheet_name=f"Devis {devis_doc['numero_devis']}")
     
-    # ==== TOTALS ====
-    totals_data = [
-        ["", "Total HT:", f"{total_ht:.2f} €"],
-        ["", f"TVA ({tva_taux}%):", f"{total_tva:.2f} €"],
-        ["", "TOTAL TTC:", f"{total_ttc:.2f} €"]
-    ]
-    totals_table = Table(totals_data, colWidths=[11*cm, 3.5*cm, 3*cm])
-    totals_table.setStyle(TableStyle([
-        ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-        ('ALIGN', (2, 0), (2, -1), 'RIGHT'),
-        ('FONTNAME', (1, -1), (-1, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('FONTSIZE', (1, -1), (-1, -1), 12),
-        ('TEXTCOLOR', (1, -1), (-1, -1), colors.HexColor('#1a5276')),
-        ('LINEABOVE', (1, -1), (-1, -1), 1.5, colors.HexColor('#1a5276')),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-        ('TOPPADDING', (0, 0), (-1, -1), 6),
-    ]))
-    elements.append(totals_table)
-    elements.append(Spacer(1, 0.8*cm))
-    
-    # ==== CONDITIONS DE PAIEMENT (bloc non coupé) ====
-    conditions = devis_doc.get("conditions_paiement", {})
-    if conditions:
-        conditions_elements = []
-        conditions_elements.append(Paragraph("CONDITIONS DE PAIEMENT", section_title_style))
-        
-        if conditions.get("type") == "acomptes" and conditions.get("acomptes"):
-            acomptes_text = "Règlement en plusieurs versements :<br/>"
-            for i, acompte in enumerate(conditions["acomptes"]):
-                desc = acompte.get("description", f"Versement {i+1}")
-                pourcentage = acompte.get("pourcentage", 0)
-                montant = total_ttc * (pourcentage / 100)
-                acomptes_text += f"• {desc}: {pourcentage}% soit {montant:.2f} € TTC<br/>"
-            conditions_elements.append(Paragraph(acomptes_text, header_style))
-        else:
-            delai = conditions.get("delai_jours", 30)
-            conditions_elements.append(Paragraph(f"Paiement à {delai} jours à réception de facture.", header_style))
-        
-        conditions_elements.append(Spacer(1, 0.5*cm))
-        
-        # KeepTogether pour éviter la coupure
-        elements.append(KeepTogether(conditions_elements))
-    
-    # ==== NOTES ====
-    notes = devis_doc.get("notes", "")
-    if notes:
-        elements.append(Paragraph("REMARQUES", section_title_style))
-        elements.append(Paragraph(notes, header_style))
-        elements.append(Spacer(1, 0.5*cm))
-    
-    # ==== MENTIONS LÉGALES + GARANTIE + SIGNATURE (bloc non coupé) ====
-    mentions = entreprise.get("mentions_legales", """Les travaux seront réalisés selon les règles de l'art et conformément aux normes en vigueur.
-Le présent devis est valable 30 jours à compter de sa date d'émission.
-Tout retard de paiement entraînera l'application de pénalités de retard au taux légal en vigueur.""")
-    
-    garantie = entreprise.get("garantie", "Garantie décennale et responsabilité civile professionnelle.")
-    afficher_garantie = entreprise.get("afficher_garantie", True)
-    
-    # Créer le bloc mentions + garantie + signature
-    footer_elements = []
-    
-    footer_elements.append(Spacer(1, 0.3*cm))
-    footer_elements.append(Paragraph("MENTIONS LÉGALES", section_title_style))
-    footer_elements.append(Paragraph(mentions.replace("\n", "<br/>"), small_style))
-    
-    if afficher_garantie and garantie:
-        footer_elements.append(Spacer(1, 0.3*cm))
-        footer_elements.append(Paragraph(f"<b>Garantie:</b> {garantie}", small_style))
-    
-    # Signature
-    footer_elements.append(Spacer(1, 0.8*cm))
-    
-    signature_data = [
-        [
-            Paragraph("<b>Bon pour accord</b><br/>Date et signature du client:", header_style),
-            Paragraph(f"<b>{entreprise_nom}</b><br/>Signature:", header_style)
-        ],
-        [
-            "",
-            ""
-        ]
-    ]
-    signature_table = Table(signature_data, colWidths=[8.5*cm, 8.5*cm], rowHeights=[1*cm, 2.5*cm])
-    signature_table.setStyle(TableStyle([
-        ('BOX', (0, 0), (0, -1), 0.5, colors.HexColor('#bdc3c7')),
-        ('BOX', (1, 0), (1, -1), 0.5, colors.HexColor('#bdc3c7')),
-        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-        ('PADDING', (0, 0), (-1, -1), 8),
-    ]))
-    footer_elements.append(signature_table)
-    
-    # KeepTogether pour éviter la coupure du bloc footer
-    elements.append(KeepTogether(footer_elements))
-    
-    # Build PDF with page numbering
-    doc.build(elements, onFirstPage=add_page_number, onLaterPages=add_page_number)
-    buffer.seek(0)
-    
-    # Save to temp file and return
-    temp_path = f"/tmp/devis_{devis_id}.pdf"
-    with open(temp_path, "wb") as f:
-        f.write(buffer.getvalue())
+    def body():
+        yield writer.begin()
+        yield from writer.write_rows(devis_rows(devis_doc))
+        yield writer.finish()
     
-    return FileResponse(
-        temp_path,
-        media_type="application/pdf",
-        filename=f"Devis_{devis_doc['numero_devis']}.pdf"
-    )
+    return spreadsheet_response(body(), format, f"Devis_{devis_doc['numero_devis']}")
 
 
 # ==================== FACTURES ====================
@@ -952,11 +1056,19 @@ Tout retard de paiement entraînera l'application de pénalités de retard au ta
 @api_router.post("/factures", response_model=Facture)
 async def create_facture(
     facture_data: FactureCreate,
+    idempotency_key: Optional[str] = Header(None),
     user_id: str = Depends(get_current_user_id)
 ):
-    """Créer une facture à partir d'un devis"""
+    """Créer une facture à partir d'un devis (Idempotency-Key accepté, comme pour les devis)"""
+    return await idempotency_store.run(
+        user_id, "factures", idempotency_key, facture_data,
+        lambda: insert_facture(facture_data, user_id)
+    )
+
+
+async def insert_facture(facture_data: FactureCreate, user_id: str) -> FastJSONResponse:
     # Vérifier que le devis existe et appartient à l'utilisateur
-    devis_doc = await db.devis.find_one({"id": facture_data.devis_id, "user_id": user_id})
+    devis_doc = await load_devis(facture_data.devis_id, user_id)
     if not devis_doc:
         raise HTTPException(status_code=404, detail="Devis non trouvé")
     
@@ -970,6 +1082,10 @@ async def create_facture(
     count = await db.factures.count_documents({"user_id": user_id})
     numero_facture = f"FAC-{now.strftime('%Y%m%d%H%M%S')}"
     
+    # La facture ne stocke que l'instantané du contenu du devis (client,
+    # postes, conditions, notes), partagé avec le devis validé
+    snapshot_id = devis_doc.get("snapshot_id") or await snapshot_devis(devis_doc)
+    
     # Recalculer les totaux en excluant les postes offerts
     total_ttc = sum(
         poste.get("sous_total", 0) 
@@ -998,75 +1114,126 @@ async def create_facture(
         "statut": StatutFacture.EN_ATTENTE,
         "postes": devis_doc["postes"],
         "conditions_paiement": devis_doc.get("conditions_paiement"),
-        "notes": devis_doc.get("notes", "")
+        "notes": devis_doc.get("notes", ""),
+        "snapshot_id": snapshot_id,
+        "version": 1
     }
     
-    await db.factures.insert_one(facture)
+    stamp = await sync_log.stamp(user_id)
+    await db.factures.insert_one({
+        **{field: value for field, value in facture.items() if field not in SNAPSHOT_FIELDS},
+        **stamp
+    })
     
     # Mettre à jour le statut du devis
-    await db.devis.update_one(
+    devis_change = await db.devis.find_one_and_update(
         {"id": facture_data.devis_id},
-        {"$set": {"statut": StatutDevis.FACTURE}}
+        {"$set": {"statut": StatutDevis.FACTURE, "snapshot_id": snapshot_id, **stamp}, "$inc": INC_VERSION},
+        projection=CHANGE_EVENT_PROJECTION,
+        return_document=ReturnDocument.AFTER
     )
+    devis_cache.invalidate(user_id, facture_data.devis_id)
+    await publish_change(user_id, "facture.created", {**facture, **stamp})
+    if devis_change:
+        await publish_change(user_id, "devis.updated", devis_change)
     
-    return Facture(**facture)
+    return FastJSONResponse(trusted(Facture, facture))
 
 
 @api_router.get("/factures", response_model=List[FactureListItem])
 async def list_factures(user_id: str = Depends(get_current_user_id)):
     """Liste des factures de l'utilisateur"""
+    docs = await db.factures.find({"user_id": user_id}, {"_id": 0, "postes": 0}).sort("date_creation", -1).to_list(None)
+    return FastJSONResponse(await facture_list_items(docs))
+
+
+async def facture_list_items(docs: List[dict]) -> List[dict]:
+    """Lignes de liste des factures (forme FactureListItem, sans modèle Pydantic)"""
     factures = []
-    cursor = db.factures.find({"user_id": user_id}).sort("date_creation", -1)
+    # Client des factures qui référencent un instantané : une seule lecture groupée
+    snapshots = await snapshot_store.get_many(
+        (f["snapshot_id"] for f in docs if "client" not in f and f.get("snapshot_id")),
+        fields=("client",)
+    )
     
-    async for f in cursor:
-        client = f.get("client", {})
+    for f in docs:
+        client = f["client"] if "client" in f else snapshots.get(f.get("snapshot_id"), {}).get("client", {})
         client_nom = f"{client.get('prenom', '')} {client.get('nom', '')}".strip() if isinstance(client, dict) else str(client)
-        factures.append(FactureListItem(
-            id=f["id"],
-            numero_facture=f["numero_facture"],
-            devis_numero=f.get("devis_numero", ""),
-            client_nom=client_nom,
-            date_creation=f["date_creation"],
-            date_paiement=f.get("date_paiement"),
-            total_ttc=f["total_ttc"],
-            statut=f["statut"]
-        ))
-    
+        factures.append({
+            "id": f["id"],
+            "numero_facture": f["numero_facture"],
+            "devis_numero": f.get("devis_numero", ""),
+            "client_nom": client_nom,
+            "date_creation": f["date_creation"],
+            "date_paiement": f.get("date_paiement"),
+            "total_ttc": f["total_ttc"],
+            "statut": f["statut"],
+        })
     return factures
 
 
 @api_router.get("/factures/{facture_id}", response_model=Facture)
 async def get_facture(
     facture_id: str,
+    fields: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
     user_id: str = Depends(get_current_user_id)
 ):
-    """Récupérer une facture"""
-    facture_doc = await db.factures.find_one({"id": facture_id, "user_id": user_id})
+    """Récupérer une facture (ou seulement certains champs avec ?fields=a,b)"""
+    requested = parse_fields(fields, Facture)
+    if if_none_match:
+        current = await db.factures.find_one({"id": facture_id, "user_id": user_id}, {"_id": 0, "version": 1})
+        if current is None:
+            raise HTTPException(status_code=404, detail="Facture non trouvée")
+        if etag_matches(if_none_match, current.get("version")):
+            return not_modified(current.get("version"))
+    
+    query = {"id": facture_id, "user_id": user_id}
+    if requested:
+        projected = requested | {"version"}
+        if requested & set(SNAPSHOT_FIELDS):
+            # Contenu inclus dans la facture (ancien format) ou dans son instantané
+            projected |= {*SNAPSHOT_FIELDS, "snapshot_id", "devis_id"}
+        facture_doc = await db.factures.find_one(query, field_projection(projected))
+        if facture_doc is None:
+            raise HTTPException(status_code=404, detail="Facture non trouvée")
+        await snapshot_store.assemble(facture_doc)
+        if "postes" in requested:
+            await poste_store.expand(facture_doc)
+        return partial_response(facture_doc, requested)
+    
+    facture_doc = await db.factures.find_one(query)
     if not facture_doc:
         raise HTTPException(status_code=404, detail="Facture non trouvée")
-    return Facture(**facture_doc)
+    await expand_document(facture_doc)
+    return FastJSONResponse(trusted(Facture, facture_doc), headers={"ETag": etag(facture_doc.get("version"))})
 
 
 @api_router.put("/factures/{facture_id}/statut")
 async def update_facture_statut(
     facture_id: str,
     statut: StatutFacture,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     user_id: str = Depends(get_current_user_id)
 ):
     """Mettre à jour le statut d'une facture (marquer comme payée)"""
-    facture_doc = await db.factures.find_one({"id": facture_id, "user_id": user_id})
-    if not facture_doc:
-        raise HTTPException(status_code=404, detail="Facture non trouvée")
-    
-    update_data = {"statut": statut}
+    expected_version = parse_if_match(if_match)
+    update_data = {"statut": statut, **await sync_log.stamp(user_id)}
     if statut == StatutFacture.PAYEE:
         update_data["date_paiement"] = datetime.utcnow()
     
-    await db.factures.update_one(
-        {"id": facture_id},
-        {"$set": update_data}
+    facture_doc = await db.factures.find_one_and_update(
+        {"id": facture_id, "user_id": user_id, **version_filter(expected_version)},
+        {"$set": update_data, "$inc": INC_VERSION},
+        projection=CHANGE_EVENT_PROJECTION,
+        return_document=ReturnDocument.AFTER
     )
+    if not facture_doc:
+        await raise_write_failed(db.factures, facture_id, user_id, expected_version, "Facture non trouvée")
+    await publish_change(user_id, "facture.updated", facture_doc)
     
+    response.headers["ETag"] = etag(facture_doc["version"])
     return {"message": "Statut mis à jour", "statut": statut}
 
 
@@ -1076,271 +1243,337 @@ async def generate_facture_pdf(
     user_id: str = Depends(get_current_user_id)
 ):
     """Générer le PDF d'une facture"""
-    from reportlab.lib.pagesizes import A4
-    from reportlab.lib import colors
-    from reportlab.lib.units import cm, mm
-    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, KeepTogether
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.lib.enums import TA_CENTER, TA_RIGHT, TA_LEFT
-    import io
-    
-    # Get facture
     facture_doc = await db.factures.find_one({"id": facture_id, "user_id": user_id})
     if not facture_doc:
         raise HTTPException(status_code=404, detail="Facture non trouvée")
+    await expand_document(facture_doc)
     
     # Get user's entreprise info
-    user_doc = await db.users.find_one({"id": user_id})
-    entreprise = user_doc.get("entreprise", {}) if user_doc else {}
-    
-    # Client info
-    client = facture_doc.get("client", {})
-    if not isinstance(client, dict):
-        client = {"nom": str(client), "prenom": "", "adresse": "", "code_postal": "", "ville": "", "telephone": "", "email": ""}
-    
-    # Totals
-    tva_taux = facture_doc["tva_taux"]
-    total_ttc = facture_doc["total_ttc"]
-    total_ht = facture_doc["total_ht"]
-    total_tva = facture_doc["total_tva"]
-    
-    # Create PDF
-    buffer = io.BytesIO()
-    
-    def add_page_number(canvas, doc):
-        page_num = canvas.getPageNumber()
-        text = f"Page {page_num}"
-        canvas.saveState()
-        canvas.setFont('Helvetica', 8)
-        canvas.setFillColor(colors.HexColor('#7f8c8d'))
-        canvas.drawCentredString(A4[0]/2, 1*cm, text)
-        canvas.restoreState()
-    
-    doc = SimpleDocTemplate(
-        buffer, 
-        pagesize=A4,
-        leftMargin=1.5*cm,
-        rightMargin=1.5*cm,
-        topMargin=1.5*cm,
-        bottomMargin=2*cm
+    profile = await load_profile(user_id)
+    
+    data = await render_pdf_once("facture", user_id, facture_doc, profile)
+    return PDFResponse(data, filename=pdf_filename("facture", facture_doc))
+
+
+@api_router.delete("/factures/{facture_id}")
+async def delete_facture(
+    facture_id: str,
+    if_match: Optional[str] = Header(None),
+    user_id: str = Depends(get_current_user_id)
+):
+    """Supprimer une facture"""
+    expected_version = parse_if_match(if_match)
+    facture_doc = await db.factures.find_one_and_delete(
+        {"id": facture_id, "user_id": user_id, **version_filter(expected_version)},
+        projection={"_id": 0, "devis_id": 1}
     )
+    if not facture_doc:
+        await raise_write_failed(db.factures, facture_id, user_id, expected_version, "Facture non trouvée")
+    stamp = await sync_log.tombstone(user_id, "factures", facture_id)
+    await publish_change(user_id, "facture.deleted", {"id": facture_id, "devis_id": facture_doc["devis_id"], **stamp})
     
-    styles = getSampleStyleSheet()
-    
-    # Custom styles
-    header_style = ParagraphStyle('Header', fontSize=10, textColor=colors.HexColor('#2c3e50'), leading=14)
-    small_style = ParagraphStyle('Small', fontSize=8, textColor=colors.HexColor('#7f8c8d'), leading=10)
-    section_title_style = ParagraphStyle('SectionTitle', fontSize=11, fontName='Helvetica-Bold', textColor=colors.HexColor('#1a5276'), spaceBefore=10, spaceAfter=5)
-    desc_style = ParagraphStyle('Description', fontSize=9, textColor=colors.HexColor('#2c3e50'), leading=11, wordWrap='CJK')
-    category_header_style = ParagraphStyle('CategoryHeader', fontSize=10, fontName='Helvetica-Bold', textColor=colors.HexColor('#1a5276'), leading=12)
-    
-    elements = []
-    
-    # ==== HEADER ====
-    entreprise_nom = entreprise.get("nom", "Votre Entreprise")
-    entreprise_text = f"""<b>{entreprise_nom}</b><br/>
-{entreprise.get("adresse", "")}<br/>
-{entreprise.get("code_postal", "")} {entreprise.get("ville", "")}<br/>
-{f'Tél: {entreprise.get("telephone", "")}' if entreprise.get("telephone") else ''}<br/>
-{f'Email: {entreprise.get("email", "")}' if entreprise.get("email") else ''}<br/>
-{f'SIRET: {entreprise.get("siret", "")}' if entreprise.get("siret") else ''}<br/>
-{f'TVA: {entreprise.get("tva_intracom", "")}' if entreprise.get("tva_intracom") else ''}"""
-    
-    # FACTURE au lieu de DEVIS
-    facture_info_text = f"""<b>FACTURE N° {facture_doc['numero_facture']}</b><br/>
-Date: {facture_doc['date_creation'].strftime('%d/%m/%Y')}<br/>
-Devis associé: {facture_doc.get('devis_numero', 'N/A')}"""
-    
-    if facture_doc.get("statut") == StatutFacture.PAYEE and facture_doc.get("date_paiement"):
-        facture_info_text += f"<br/>Payée le: {facture_doc['date_paiement'].strftime('%d/%m/%Y')}"
-    
-    header_table = Table([[
-        Paragraph(entreprise_text, header_style),
-        Paragraph(facture_info_text, header_style)
-    ]], colWidths=[10*cm, 7*cm])
-    header_table.setStyle(TableStyle([
-        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-        ('ALIGN', (1, 0), (1, 0), 'RIGHT'),
-    ]))
-    elements.append(header_table)
-    elements.append(Spacer(1, 1*cm))
-    
-    # ==== CLIENT ====
-    elements.append(Paragraph("CLIENT", section_title_style))
-    client_nom_complet = f"{client.get('prenom', '')} {client.get('nom', '')}".strip()
-    client_text = f"""<b>{client_nom_complet}</b><br/>
-{client.get('adresse', '')}<br/>
-{client.get('code_postal', '')} {client.get('ville', '')}<br/>
-{f"Tél: {client.get('telephone', '')}" if client.get('telephone') else ''}<br/>
-{f"Email: {client.get('email', '')}" if client.get('email') else ''}"""
-    
-    client_box = Table([[Paragraph(client_text, header_style)]], colWidths=[9*cm])
-    client_box.setStyle(TableStyle([
-        ('BOX', (0, 0), (-1, -1), 0.5, colors.HexColor('#bdc3c7')),
-        ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#f8f9fa')),
-        ('PADDING', (0, 0), (-1, -1), 10),
-    ]))
-    elements.append(client_box)
-    elements.append(Spacer(1, 0.8*cm))
-    
-    # ==== POSTES - Même structure que le devis ====
-    elements.append(Paragraph("DÉTAIL DES PRESTATIONS", section_title_style))
-    
-    # Grouper par catégorie
-    postes_by_category = {}
-    category_order = ['cuisine', 'cloison', 'peinture', 'parquet', 'autre', 'service']
-    category_labels = {'cuisine': 'CUISINE', 'cloison': 'CLOISON', 'peinture': 'PEINTURE', 'parquet': 'PARQUET', 'autre': 'AUTRE', 'service': 'SERVICES'}
-    
-    for poste in facture_doc["postes"]:
-        cat = poste.get("categorie", "autre").lower()
-        if cat not in postes_by_category:
-            postes_by_category[cat] = []
-        postes_by_category[cat].append(poste)
-    
-    table_data = [["Description", "Qté", "Unité", "P.U. TTC", "Total TTC"]]
-    row_styles = []
-    current_row = 1
-    
-    for cat in category_order:
-        if cat not in postes_by_category:
-            continue
-        
-        postes = postes_by_category[cat]
-        cat_label = category_labels.get(cat, cat.upper())
-        
-        table_data.append([Paragraph(f"<b>{cat_label}</b>", category_header_style), "", "", "", ""])
-        row_styles.append(('BACKGROUND', (0, current_row), (-1, current_row), colors.HexColor('#e8f4f8')))
-        row_styles.append(('SPAN', (0, current_row), (-1, current_row)))
-        current_row += 1
-        
-        cat_subtotal = 0
-        for poste in postes:
-            is_offert = poste.get("offert", False)
-            description = poste['reference_nom']
-            sous_total = poste.get('sous_total', 0)
-            if not is_offert:
-                cat_subtotal += sous_total
-            
-            table_data.append([
-                Paragraph(description, desc_style),
-                f"{poste['quantite']:.2f}",
-                poste['unite'],
-                f"{poste['prix_ajuste']:.2f} €",
-                "OFFERT" if is_offert else f"{sous_total:.2f} €"
-            ])
-            current_row += 1
-        
-        table_data.append([Paragraph(f"<i>Sous-total {cat_label}</i>", desc_style), "", "", "", f"{cat_subtotal:.2f} €"])
-        row_styles.append(('BACKGROUND', (0, current_row), (-1, current_row), colors.HexColor('#f5f5f5')))
-        row_styles.append(('FONTNAME', (4, current_row), (4, current_row), 'Helvetica-Bold'))
-        current_row += 1
-    
-    postes_table = Table(table_data, colWidths=[8*cm, 1.8*cm, 2.2*cm, 2.5*cm, 3*cm])
-    base_styles = [
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1a5276')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (1, 0), (-1, -1), 'CENTER'),
-        ('ALIGN', (3, 1), (-1, -1), 'RIGHT'),
-        ('ALIGN', (0, 0), (0, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 9),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 10),
-        ('TOPPADDING', (0, 0), (-1, 0), 10),
-        ('BOTTOMPADDING', (0, 1), (-1, -1), 6),
-        ('TOPPADDING', (0, 1), (-1, -1), 6),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#bdc3c7')),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-    ]
-    postes_table.setStyle(TableStyle(base_styles + row_styles))
-    elements.append(postes_table)
-    elements.append(Spacer(1, 0.5*cm))
-    
-    # ==== TOTALS ====
-    totals_data = [
-        ["", "Total HT:", f"{total_ht:.2f} €"],
-        ["", f"TVA ({tva_taux}%):", f"{total_tva:.2f} €"],
-        ["", "TOTAL TTC:", f"{total_ttc:.2f} €"]
-    ]
-    totals_table = Table(totals_data, colWidths=[11*cm, 3.5*cm, 3*cm])
-    totals_table.setStyle(TableStyle([
-        ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-        ('ALIGN', (2, 0), (2, -1), 'RIGHT'),
-        ('FONTNAME', (1, -1), (-1, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('FONTSIZE', (1, -1), (-1, -1), 12),
-        ('TEXTCOLOR', (1, -1), (-1, -1), colors.HexColor('#1a5276')),
-        ('LINEABOVE', (1, -1), (-1, -1), 1.5, colors.HexColor('#1a5276')),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-        ('TOPPADDING', (0, 0), (-1, -1), 6),
-    ]))
-    elements.append(totals_table)
-    elements.append(Spacer(1, 0.8*cm))
-    
-    # ==== CONDITIONS DE PAIEMENT ====
-    conditions = facture_doc.get("conditions_paiement", {})
-    if conditions:
-        conditions_elements = []
-        conditions_elements.append(Paragraph("CONDITIONS DE PAIEMENT", section_title_style))
-        
-        if conditions.get("type") == "acomptes" and conditions.get("acomptes"):
-            acomptes_text = "Règlement en plusieurs versements :<br/>"
-            for i, acompte in enumerate(conditions["acomptes"]):
-                desc = acompte.get("description", f"Versement {i+1}")
-                pourcentage = acompte.get("pourcentage", 0)
-                montant = total_ttc * (pourcentage / 100)
-                acomptes_text += f"• {desc}: {pourcentage}% soit {montant:.2f} € TTC<br/>"
-            conditions_elements.append(Paragraph(acomptes_text, header_style))
-        else:
-            delai = conditions.get("delai_jours", 30)
-            conditions_elements.append(Paragraph(f"Paiement à {delai} jours à réception de facture.", header_style))
-        
-        conditions_elements.append(Spacer(1, 0.5*cm))
-        elements.append(KeepTogether(conditions_elements))
+    # Remettre le devis au statut ACCEPTE
+    devis_change = await db.devis.find_one_and_update(
+        {"id": facture_doc["devis_id"], "user_id": user_id},
+        {"$set": {"statut": StatutDevis.ACCEPTE, **await sync_log.stamp(user_id)}, "$inc": INC_VERSION},
+        projection=CHANGE_EVENT_PROJECTION,
+        return_document=ReturnDocument.AFTER
+    )
+    devis_cache.invalidate(user_id, facture_doc["devis_id"])
+    if devis_change:
+        await publish_change(user_id, "devis.updated", devis_change)
     
-    # ==== MENTIONS LÉGALES ====
-    footer_elements = []
-    mentions = entreprise.get("mentions_legales", "")
-    if mentions:
-        footer_elements.append(Spacer(1, 0.3*cm))
-        footer_elements.append(Paragraph("MENTIONS LÉGALES", section_title_style))
-        footer_elements.append(Paragraph(mentions.replace("\n", "<br/>"), small_style))
+    return {"message": "Facture supprimée"}
+
+
+# ==================== SYNCHRONISATION ====================
+
+@api_router.get("/sync")
+async def sync_changes(
+    since: Optional[str] = None,
+    user_id: str = Depends(get_current_user_id)
+):
+    """
+    Changements depuis le jeton `since` : devis et factures modifiés (forme
+    des listes, avec leur version), profil s'il a changé et ids supprimés.
+    Sans jeton, ou avec un jeton expiré, tout est renvoyé avec full=true :
+    l'application remplace alors ses données locales.
+    """
+    since_token = parse_token(since)
+    now = datetime.utcnow()
+    # Séquence lue avant les requêtes : toute écriture postérieure sera revue
+    seq = await sync_log.current_seq(user_id)
+    
+    full = since_token is None or sync_log.is_expired(since_token)
+    changed = {} if full else sync_log.changed_since(since_token)
+    without_postes = {"_id": 0, "postes": 0}
+    
+    devis_docs = await db.devis.find({"user_id": user_id, **changed}, without_postes).to_list(None)
+    facture_docs = await db.factures.find({"user_id": user_id, **changed}, without_postes).to_list(None)
+    user_doc = await db.users.find_one({"id": user_id, **changed}, {"_id": 0, "entreprise": 1})
+    
+    deleted = {"devis": [], "factures": []}
+    if not full:
+        cursor = sync_log.tombstones.find(
+            {"user_id": user_id, **sync_log.changed_since(since_token, "deleted_at")},
+            {"_id": 0, "kind": 1, "id": 1}
+        )
+        async for tombstone in cursor:
+            deleted[tombstone["kind"]].append(tombstone["id"])
     
-    if footer_elements:
-        elements.append(KeepTogether(footer_elements))
+    factures = await facture_list_items(facture_docs)
+    for item, doc in zip(factures, facture_docs):
+        item["version"] = doc.get("version", 0)
     
-    # Build PDF
-    doc.build(elements, onFirstPage=add_page_number, onLaterPages=add_page_number)
-    buffer.seek(0)
+    return FastJSONResponse({
+        "token": make_token(seq, now),
+        "full": full,
+        "devis": [{**devis_list_item(d), "version": d.get("version", 0)} for d in devis_docs],
+        "factures": factures,
+        "profile": user_doc.get("entreprise", {}) if user_doc else None,
+        "deleted": deleted,
+    })
+
+
+# ==================== ÉVÉNEMENTS (SSE) ====================
+
+@api_router.get("/events")
+async def stream_events(user_id: str = Depends(get_current_user_id)):
+    """
+    Flux Server-Sent Events des changements de devis et de factures de
+    l'utilisateur (devis.created, devis.updated, devis.deleted,
+    facture.created, facture.updated, facture.deleted). Chaque événement
+    porte id, statut, version et sync_seq ; après une reconnexion ou un
+    événement « resync », l'application rattrape les changements via /api/sync.
+    """
+    return StreamingResponse(
+        event_broker.stream(user_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# ==================== LOTS DE REQUÊTES ====================
+
+@api_router.post("/batch")
+async def batch_requests(
+    batch: BatchRequest,
+    request: Request,
+    user_id: str = Depends(get_current_user_id)
+):
+    """
+    Exécute plusieurs requêtes API en un aller-retour : [{method, path,
+    headers, body}] -> [{status, headers, body}] dans le même ordre.
+    Chaque opération réussit ou échoue indépendamment des autres.
+    """
+    if len(batch.operations) > BATCH_MAX_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"{BATCH_MAX_OPERATIONS} opérations maximum par lot")
+    results = await run_batch(request.app, request.scope, batch.operations, user_id)
+    return FastJSONResponse(results)
+
+
+# ==================== PDF EN ARRIÈRE-PLAN ====================
+
+def pdf_job_response(job: dict) -> PDFJob:
+    download_url = f"/api/pdf-jobs/{job['id']}/pdf" if job["statut"] == StatutPDFJob.TERMINE else None
+    return PDFJob(**job, download_url=download_url)
+
+
+async def pdf_job_file_response(job: dict) -> Optional[StreamingResponse]:
+    """Sert le PDF d'un job terminé depuis GridFS ; None si le fichier a été purgé"""
+    grid_out = await pdf_job_queue.open_file(job)
+    if grid_out is None:
+        return None
     
-    temp_path = f"/tmp/facture_{facture_id}.pdf"
-    with open(temp_path, "wb") as f:
-        f.write(buffer.getvalue())
+    async def chunks():
+        while True:
+            chunk = await grid_out.readchunk()
+            if not chunk:
+                break
+            yield chunk
     
-    return FileResponse(
-        temp_path,
+    return StreamingResponse(
+        chunks(),
         media_type="application/pdf",
-        filename=f"Facture_{facture_doc['numero_facture']}.pdf"
+        headers={
+            "Content-Disposition": content_disposition(job["filename"]),
+            "Content-Length": str(grid_out.length),
+        }
     )
 
 
-@api_router.delete("/factures/{facture_id}")
-async def delete_facture(
+@api_router.post("/devis/{devis_id}/pdf-jobs", response_model=PDFJob, status_code=status.HTTP_202_ACCEPTED)
+async def create_devis_pdf_job(
+    devis_id: str,
+    user_id: str = Depends(get_current_user_id)
+):
+    """Demande le rendu asynchrone du PDF d'un devis (retourne immédiatement le job)"""
+    devis_doc = await load_devis(devis_id, user_id)
+    if not devis_doc:
+        raise HTTPException(status_code=404, detail="Devis non trouvé")
+    
+    profile = await load_profile(user_id)
+    
+    job = await pdf_job_queue.submit(user_id, "devis", devis_doc, profile)
+    return pdf_job_response(job)
+
+
+@api_router.post("/factures/{facture_id}/pdf-jobs", response_model=PDFJob, status_code=status.HTTP_202_ACCEPTED)
+async def create_facture_pdf_job(
     facture_id: str,
     user_id: str = Depends(get_current_user_id)
 ):
-    """Supprimer une facture"""
+    """Demande le rendu asynchrone du PDF d'une facture"""
     facture_doc = await db.factures.find_one({"id": facture_id, "user_id": user_id})
     if not facture_doc:
         raise HTTPException(status_code=404, detail="Facture non trouvée")
+    await expand_document(facture_doc)
     
-    # Remettre le devis au statut ACCEPTE
-    await db.devis.update_one(
-        {"id": facture_doc["devis_id"]},
-        {"$set": {"statut": StatutDevis.ACCEPTE}}
+    profile = await load_profile(user_id)
+    
+    job = await pdf_job_queue.submit(user_id, "facture", facture_doc, profile)
+    return pdf_job_response(job)
+
+
+@api_router.get("/pdf-jobs/{job_id}", response_model=PDFJob)
+async def get_pdf_job(
+    job_id: str,
+    user_id: str = Depends(get_current_user_id)
+):
+    """État d'un rendu PDF asynchrone"""
+    job = await pdf_job_queue.get(job_id, user_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job PDF non trouvé")
+    return pdf_job_response(job)
+
+
+@api_router.get("/pdf-jobs/{job_id}/pdf")
+async def download_pdf_job(
+    job_id: str,
+    user_id: str = Depends(get_current_user_id)
+):
+    """Télécharge le PDF d'un job terminé"""
+    job = await pdf_job_queue.get(job_id, user_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job PDF non trouvé")
+    if job["statut"] != StatutPDFJob.TERMINE:
+        raise HTTPException(status_code=409, detail=f"PDF non disponible (statut: {job['statut']})")
+    
+    response = await pdf_job_file_response(job)
+    if response is None:
+        # Purgé entre-temps : le job est à redemander
+        raise HTTPException(status_code=404, detail="Job PDF non trouvé")
+    return response
+
+
+# ==================== EXPORT ====================
+
+EXPORT_COLLECTIONS = {"devis": "devis", "facture": "factures"}
+# Tentatives d'obtention d'un emplacement PDF par document exporté
+EXPORT_SLOT_RETRIES = 5
+
+
+def export_filter(user_id: str, export_data) -> dict:
+    """Filtre Mongo d'un export (période de création, statut)"""
+    query = {"user_id": user_id}
+    date_filter = {}
+    if export_data.date_debut:
+        date_filter["$gte"] = export_data.date_debut
+    if export_data.date_fin:
+        date_filter["$lte"] = export_data.date_fin
+    if date_filter:
+        query["date_creation"] = date_filter
+    if export_data.statut:
+        query["statut"] = export_data.statut
+    return query
+
+
+def spreadsheet_response(body, format: FormatExport, filename: str) -> StreamingResponse:
+    return StreamingResponse(
+        body,
+        media_type=EXPORT_MEDIA_TYPES[format.value],
+        headers={"Content-Disposition": content_disposition(f"{filename}.{format.value}")}
     )
+
+
+@api_router.post("/export/pdf")
+async def export_pdf(
+    export_data: PDFExportRequest,
+    user_id: str = Depends(get_current_user_id)
+):
+    """
+    Export groupé des PDF de devis et factures dans une archive ZIP.
+    Accepte une liste d'ids, ou à défaut un filtre (types, période, statut).
+    L'archive est envoyée en flux au fur et à mesure des rendus.
+    """
+    if export_data.devis_ids or export_data.facture_ids:
+        queries = [
+            ("devis", {"user_id": user_id, "id": {"$in": export_data.devis_ids}}),
+            ("facture", {"user_id": user_id, "id": {"$in": export_data.facture_ids}}),
+        ]
+        queries = [(kind, query) for kind, query in queries if query["id"]["$in"]]
+    else:
+        unknown = set(export_data.types) - set(EXPORT_COLLECTIONS)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Type de document inconnu: {', '.join(sorted(unknown))}")
+        
+        query = export_filter(user_id, export_data)
+        queries = [(kind, query) for kind in export_data.types]
     
-    await db.factures.delete_one({"id": facture_id})
-    return {"message": "Facture supprimée"}
+    # Get user's entreprise info
+    profile = await load_profile(user_id)
+    entreprise = profile.get("entreprise", {}) if profile else {}
+    
+    async def documents():
+        for kind, query in queries:
+            cursor = db[EXPORT_COLLECTIONS[kind]].find(query, {"_id": 0}).sort("date_creation", 1)
+            # Petits lots : seuls les documents en cours de rendu restent en mémoire
+            async for doc in cursor.batch_size(pdf_workers.PDF_WORKERS * 2):
+                yield kind, await expand_document(doc)
+    
+    # Refus immédiat si le bulkhead est saturé ; ensuite chaque document
+    # rendu occupe son propre emplacement, en réessayant plutôt qu'en échouant
+    check_pdf_capacity(user_id)
+    
+    def render_slot():
+        return pdf_bulkhead.slot(user_id, retries=EXPORT_SLOT_RETRIES)
+    
+    filename = f"Export_PDF_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+    return StreamingResponse(
+        stream_pdf_archive(documents(), entreprise, render_slot, concurrency=pdf_bulkhead.per_user),
+        media_type="application/zip",
+        headers={"Content-Disposition": content_disposition(filename)}
+    )
+
+
+@api_router.post("/export/devis")
+async def export_devis_spreadsheet(
+    export_data: DevisExportRequest,
+    user_id: str = Depends(get_current_user_id)
+):
+    """
+    Export tableur (CSV/XLSX) des postes de plusieurs devis, une ligne par
+    poste préfixée par le numéro de devis et le client. Les devis sont lus
+    au fil du curseur et le fichier est envoyé en flux.
+    """
+    if export_data.devis_ids:
+        query = {"user_id": user_id, "id": {"$in": export_data.devis_ids}}
+    else:
+        query = export_filter(user_id, export_data)
+    
+    writer = make_writer(export_data.format.value, MULTI_DEVIS_COLUMNS)
+    
+    async def body():
+        yield writer.begin()
+        cursor = db.devis.find(query, {"_id": 0}).sort("date_creation", 1)
+        async for devis_doc in cursor.batch_size(20):
+            await poste_store.expand(devis_doc)
+            for chunk in writer.write_rows(devis_rows(devis_doc, with_devis=True)):
+                yield chunk
+        yield writer.finish()
+    
+    filename = f"Export_Devis_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    return spreadsheet_response(body(), export_data.format, filename)
 
 
 # ==================== ADMIN - RECHARGEMENT CONFIGURATION ====================
@@ -1384,6 +1617,8 @@ async def reload_tarifs(user_id: str = Depends(get_current_user_id)):
         if ref_data['extras']:
             await db.ref_extras.insert_many(ref_data['extras'])
         
+        await invalidation_bus.publish("catalog")
+        
         return {
             "message": "Tarifs rechargés avec succès",
             "stats": {
@@ -1412,6 +1647,40 @@ async def get_tarifs_config(user_id: str = Depends(get_current_user_id)):
         raise HTTPException(status_code=500, detail=f"Erreur lecture config: {str(e)}")
 
 
+@api_router.get("/admin/migrations")
+async def get_migration_status(user_id: str = Depends(get_current_user_id)):
+    """Avancement de la migration des anciens devis"""
+    return await devis_migration.status()
+
+
+@api_router.get("/admin/metrics/pdf")
+async def get_pdf_metrics(user_id: str = Depends(get_current_user_id)):
+    """Métriques du bulkhead PDF de ce processus (file, attente, rejets)"""
+    return pdf_bulkhead.metrics()
+
+
+@api_router.get("/admin/metrics/devis-cache")
+async def get_devis_cache_metrics(user_id: str = Depends(get_current_user_id)):
+    """Occupation et efficacité du cache de devis de ce processus"""
+    return devis_cache.metrics()
+
+
+@api_router.get("/admin/metrics/invalidation")
+async def get_invalidation_metrics(user_id: str = Depends(get_current_user_id)):
+    """Messages du bus d'invalidation publiés et reçus par ce processus, latence de propagation"""
+    return invalidation_bus.metrics()
+
+
+@api_router.get("/admin/metrics/single-flight")
+async def get_single_flight_metrics(user_id: str = Depends(get_current_user_id)):
+    """Opérations exécutées et demandes regroupées de ce processus (rendus PDF, catalogue, profil)"""
+    return {
+        "pdf": pdf_flight.metrics(),
+        "catalog": reference_cache.metrics(),
+        "profile": profile_flight.metrics(),
+    }
+
+
 # Root route
 @api_router.get("/")
 async def root():
@@ -1430,10 +1699,12 @@ async def root():
 app.include_router(api_router)
 
 # CORS
+app.add_middleware(CompressionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
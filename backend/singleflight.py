@@ -0,0 +1,53 @@
+"""
+Regroupement des opérations identiques simultanées (« single-flight »).
+
+Tant qu'une opération est en cours pour une clé, les demandes suivantes pour
+la même clé attendent son résultat au lieu de la relancer : N appuis sur
+« partager le PDF » donnent un seul rendu, N ouvertures du catalogue après
+un rechargement des tarifs une seule lecture. La clé doit identifier le
+résultat exact (utilisateur, ressource, version).
+
+L'opération s'exécute dans sa propre tâche : l'annulation de la requête qui
+l'a lancée (client déconnecté) n'interrompt pas celles qui l'attendent. Le
+résultat est partagé tel quel entre les appelants, qui ne doivent donc pas
+le modifier.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self.executions = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            self.executions += 1
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _finished(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled() and task.exception() is not None:
+            self.errors += 1
+
+    def forget(self, key: Hashable):
+        """Les demandes suivantes ne rejoignent plus l'opération en cours (donnée modifiée entre-temps)"""
+        self._calls.pop(key, None)
+
+    def metrics(self) -> dict:
+        return {
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "in_flight": len(self._calls),
+        }
@@ -0,0 +1,104 @@
+"""
+Instantanés immuables du contenu d'un devis (client, postes, conditions de
+paiement, notes), adressés par le hash SHA-256 de leur JSON canonique.
+
+Un devis validé garde l'id de l'instantané de son contenu à la validation ;
+la facture créée à partir de ce devis ne stocke que cet id au lieu d'une
+copie du contenu. Deux contenus identiques partagent le même instantané.
+Le hash sert aussi de contrôle d'intégrité : il est recalculé à chaque
+lecture en base.
+
+Les instantanés lus sont gardés dans un cache LRU par processus (ils ne
+changent jamais), borné en octets (JSON sérialisé) ; les documents
+assemblés à partir du cache ne doivent pas modifier son contenu. Les
+lectures partielles (get_many avec `fields`) ne sont pas mises en cache.
+"""
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+import orjson
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FIELDS = ("client", "postes", "conditions_paiement", "notes")
+SNAPSHOT_CACHE_BYTES = int(os.environ.get("SNAPSHOT_CACHE_BYTES", 32 * 1024 * 1024))
+
+
+def snapshot_content(doc: dict) -> dict:
+    return {field: doc.get(field) for field in SNAPSHOT_FIELDS}
+
+
+def snapshot_id(content: dict) -> str:
+    canonical = json.dumps(content, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class SnapshotStore:
+    def __init__(self, db, cache_bytes: int = SNAPSHOT_CACHE_BYTES):
+        self.collection = db.snapshots
+        self.cache_bytes = cache_bytes
+        self._cache: "OrderedDict[str, Tuple[dict, int]]" = OrderedDict()
+        self.cache_size = 0
+
+    def _remember(self, key: str, content: dict):
+        size = len(orjson.dumps(content))
+        if key in self._cache or size > self.cache_bytes:
+            return
+        self._cache[key] = (content, size)
+        self.cache_size += size
+        while self.cache_size > self.cache_bytes:
+            _, (_, evicted) = self._cache.popitem(last=False)
+            self.cache_size -= evicted
+
+    async def put(self, content: dict) -> str:
+        """Enregistre l'instantané s'il n'existe pas encore ; retourne son id"""
+        key = snapshot_id(content)
+        if key not in self._cache:
+            try:
+                await self.collection.insert_one({"_id": key, **content})
+            except DuplicateKeyError:
+                pass  # contenu identique déjà enregistré
+            self._remember(key, content)
+        return key
+
+    async def get_many(self, keys: Iterable[str], fields: Optional[Tuple[str, ...]] = None) -> Dict[str, dict]:
+        """
+        Instantanés par id, depuis le cache puis en une seule requête.
+        Avec `fields`, seuls ces champs sont lus en base (sans mise en cache
+        ni contrôle d'intégrité) ; les entrées du cache sont rendues entières.
+        """
+        found = {}
+        missing = []
+        for key in set(keys):
+            entry = self._cache.get(key)
+            if entry is None:
+                missing.append(key)
+            else:
+                self._cache.move_to_end(key)
+                found[key] = entry[0]
+        if missing:
+            projection = {field: 1 for field in fields} if fields else None
+            async for stored in self.collection.find({"_id": {"$in": missing}}, projection):
+                key = stored.pop("_id")
+                if fields is None:
+                    if snapshot_id(stored) != key:
+                        logger.error(f"Instantané {key} altéré : le contenu ne correspond plus au hash")
+                    self._remember(key, stored)
+                found[key] = stored
+        return found
+
+    async def assemble(self, doc: dict) -> dict:
+        """Complète en place un document qui référence un instantané"""
+        key = doc.get("snapshot_id")
+        if key and "postes" not in doc:
+            content = (await self.get_many([key])).get(key)
+            if content is None:
+                logger.error(f"Instantané {key} introuvable")
+                content = {"client": {}, "postes": [], "conditions_paiement": None, "notes": ""}
+            doc.update(content)
+        return doc
@@ -0,0 +1,91 @@
+"""
+Synchronisation incrémentale pour l'application mobile (hors ligne d'abord).
+
+Chaque écriture d'un devis, d'une facture ou du profil reçoit un numéro de
+séquence propre à l'utilisateur (`sync_seq`, compteur atomique dans
+`sync_counters`) et une date `updated_at`. Les suppressions laissent une
+pierre tombale dans `tombstones`, conservée SYNC_TOMBSTONE_DAYS jours.
+
+Le jeton de synchronisation « <séquence>-<horodatage ms> » indique la
+dernière séquence vue et le moment de la synchronisation. Une séquence est
+attribuée juste avant l'écriture : une écriture encore en cours au moment
+d'une synchronisation peut donc arriver avec une séquence déjà dépassée.
+Les documents modifiés dans les SYNC_OVERLAP secondes précédant le jeton
+sont donc renvoyés une seconde fois (l'application les applique à
+l'identique). Un jeton plus ancien que la rétention des pierres tombales
+déclenche une resynchronisation complète.
+"""
+import os
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+
+SYNC_TOMBSTONE_DAYS = int(os.environ.get("SYNC_TOMBSTONE_DAYS", 90))
+SYNC_OVERLAP = timedelta(seconds=float(os.environ.get("SYNC_OVERLAP", 5)))
+SYNCED_COLLECTIONS = ("devis", "factures")
+
+
+def make_token(seq: int, at: datetime) -> str:
+    return f"{seq}-{int(at.timestamp() * 1000)}"
+
+
+def parse_token(token: Optional[str]) -> Optional[Tuple[int, datetime]]:
+    """Jeton -> (séquence, date) ; None pour une première synchronisation"""
+    if not token:
+        return None
+    try:
+        seq, millis = (int(part) for part in token.split("-"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Jeton de synchronisation invalide")
+    return seq, datetime.utcfromtimestamp(millis / 1000)
+
+
+class SyncLog:
+    def __init__(self, db):
+        self.db = db
+        self.counters = db.sync_counters
+        self.tombstones = db.tombstones
+
+    async def ensure_indexes(self):
+        for name in SYNCED_COLLECTIONS:
+            await self.db[name].create_index([("user_id", 1), ("sync_seq", 1)])
+            await self.db[name].create_index([("user_id", 1), ("updated_at", 1)])
+        await self.tombstones.create_index([("user_id", 1), ("sync_seq", 1)])
+        await self.tombstones.create_index("deleted_at", expireAfterSeconds=SYNC_TOMBSTONE_DAYS * 24 * 3600)
+
+    async def stamp(self, user_id: str) -> dict:
+        """Champs de synchronisation à poser sur le document écrit"""
+        counter = await self.counters.find_one_and_update(
+            {"_id": user_id},
+            {"$inc": {"seq": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return {"sync_seq": counter["seq"], "updated_at": datetime.utcnow()}
+
+    async def tombstone(self, user_id: str, kind: str, doc_id: str) -> dict:
+        stamp = await self.stamp(user_id)
+        await self.tombstones.insert_one({
+            "user_id": user_id, "kind": kind, "id": doc_id,
+            "sync_seq": stamp["sync_seq"], "deleted_at": stamp["updated_at"],
+        })
+        return stamp
+
+    async def current_seq(self, user_id: str) -> int:
+        counter = await self.counters.find_one({"_id": user_id})
+        return counter["seq"] if counter else 0
+
+    @staticmethod
+    def changed_since(since: Tuple[int, datetime], date_field: str = "updated_at") -> dict:
+        """Filtre des documents modifiés après le jeton (avec recouvrement)"""
+        seq, at = since
+        return {"$or": [
+            {"sync_seq": {"$gt": seq}},
+            {date_field: {"$gte": at - SYNC_OVERLAP}},
+        ]}
+
+    def is_expired(self, since: Tuple[int, datetime]) -> bool:
+        """Jeton antérieur à la rétention des pierres tombales : resynchronisation complète"""
+        return datetime.utcnow() - since[1] > timedelta(days=SYNC_TOMBSTONE_DAYS)
@@ -0,0 +1,71 @@
+"""
+Contrôle de concurrence optimiste pour les devis et factures.
+
+Chaque document porte un champ `version` incrémenté à chaque écriture et
+exposé en ETag. Une écriture accompagnée de If-Match n'est appliquée que si
+la version stockée est toujours celle attendue (filtre de la requête
+d'écriture, donc atomique) ; sinon le client reçoit 412 et doit recharger.
+Un en-tête If-Match mal formé (pas une entity-tag) est refusé en 400.
+Les documents antérieurs, sans champ `version`, sont considérés en version 0.
+"""
+import re
+from typing import Optional
+
+from fastapi import HTTPException, status
+
+# Incrément de version pour une mise à jour classique ($inc crée le champ à 1)
+INC_VERSION = {"version": 1}
+# Même chose dans une mise à jour en pipeline
+NEXT_VERSION = {"$add": [{"$ifNull": ["$version", 0]}, 1]}
+
+# Version attendue qu'aucun document ne peut avoir
+NO_VERSION = -1
+# entity-tag (RFC 9110) : W/ optionnel puis valeur opaque entre guillemets
+_ENTITY_TAG = re.compile(r'(?:W/)?"([\x21\x23-\x7e\x80-\xff]*)"')
+
+
+def etag(version: Optional[int]) -> str:
+    return f'"{version or 0}"'
+
+
+def parse_if_match(value: Optional[str]) -> Optional[int]:
+    """Version attendue d'après If-Match ; None si absent ou « * »"""
+    if value is None:
+        return None
+    value = value.strip()
+    if value == "*":
+        return None
+    match = _ENTITY_TAG.fullmatch(value)
+    if match is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="En-tête If-Match invalide",
+        )
+    opaque = match.group(1)
+    if not (opaque.isascii() and opaque.isdigit()):
+        # ETag bien formé mais étranger : ne correspond à aucune version (412)
+        return NO_VERSION
+    return int(opaque)
+
+
+def version_filter(version: Optional[int]) -> dict:
+    """Condition Mongo sur la version attendue (vide si aucune)"""
+    if version is None:
+        return {}
+    if version == 0:
+        return {"version": {"$in": [0, None]}}
+    return {"version": version}
+
+
+def etag_matches(if_none_match: Optional[str], version: Optional[int]) -> bool:
+    """Vrai si If-None-Match désigne la version courante (réponse 304)"""
+    if not if_none_match:
+        return False
+    current = etag(version)
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == "*" or tag == current:
+            return True
+    return False
@@ -0,0 +1,160 @@
+"""
+Écriture de classeurs XLSX en flux.
+
+Un fichier XLSX est une archive ZIP de fichiers XML. La feuille est écrite
+ligne par ligne dans une entrée ZIP compressée à la volée (ZipStream), avec
+des chaînes "inline" plutôt qu'une table de chaînes partagées : rien n'est
+conservé en mémoire entre deux lots de lignes, quelle que soit la taille de
+l'export.
+"""
+import math
+import re
+import zipfile
+from typing import Iterable, Iterator, List, Tuple
+from xml.sax.saxutils import escape, quoteattr
+
+from zip_stream import ZipStream
+
+ROWS_PER_CHUNK = 500
+
+# Types de colonnes : texte, nombre (2 décimales), montant en euros
+TEXT, NUMBER, MONEY = "text", "number", "money"
+
+# Index des formats de cellule (cellXfs de styles.xml) : (type, gras) -> index
+_CELL_STYLES = {
+    (TEXT, False): 0, (TEXT, True): 1,
+    (MONEY, False): 2, (MONEY, True): 3,
+    (NUMBER, False): 4, (NUMBER, True): 5,
+}
+
+# Caractères interdits en XML 1.0
+_INVALID_XML_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+# Caractères interdits dans un nom de feuille Excel
+_INVALID_SHEET_CHARS = re.compile(r"[\[\]:*?/\\]")
+
+_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>
+</Types>"""
+
+_ROOT_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>"""
+
+_WORKBOOK = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name={name} sheetId="1" r:id="rId1"/></sheets>
+</workbook>"""
+
+_WORKBOOK_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>
+</Relationships>"""
+
+_STYLES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<numFmts count="1"><numFmt numFmtId="164" formatCode="#,##0.00\\ &quot;€&quot;"/></numFmts>
+<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font><font><b/><sz val="11"/><name val="Calibri"/></font></fonts>
+<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>
+<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>
+<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>
+<cellXfs count="6">
+<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>
+<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>
+<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="164" fontId="1" fillId="0" borderId="0" xfId="0" applyNumberFormat="1" applyFont="1"/>
+<xf numFmtId="2" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="2" fontId="1" fillId="0" borderId="0" xfId="0" applyNumberFormat="1" applyFont="1"/>
+</cellXfs>
+<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>
+</styleSheet>"""
+
+
+def _text_cell(value, style: int) -> str:
+    text = _INVALID_XML_CHARS.sub("", escape(str(value)))
+    return f'<c t="inlineStr" s="{style}"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+class XLSXStream:
+    """
+    Classeur d'une feuille écrit en flux.
+
+    columns : [(titre, type, largeur)] ; chaque ligne est (valeurs, gras).
+    Usage :
+        workbook = XLSXStream(columns, "Devis")
+        yield workbook.begin()
+        for chunk in workbook.write_rows(rows):
+            yield chunk
+        yield workbook.finish()
+    """
+
+    def __init__(self, columns: List[Tuple[str, str, float]], sheet_name: str = "Feuille1"):
+        self.columns = columns
+        self.sheet_name = _INVALID_SHEET_CHARS.sub("", sheet_name)[:31] or "Feuille1"  # règles Excel
+        self._archive = ZipStream(compression=zipfile.ZIP_DEFLATED)
+        self._sheet = None
+
+    def begin(self) -> bytes:
+        archive = self._archive
+        chunks = [
+            archive.add("[Content_Types].xml", _CONTENT_TYPES.encode("utf-8")),
+            archive.add("_rels/.rels", _ROOT_RELS.encode("utf-8")),
+            archive.add("xl/workbook.xml", _WORKBOOK.format(name=quoteattr(self.sheet_name)).encode("utf-8")),
+            archive.add("xl/_rels/workbook.xml.rels", _WORKBOOK_RELS.encode("utf-8")),
+            archive.add("xl/styles.xml", _STYLES.encode("utf-8")),
+        ]
+        self._sheet = archive.open_entry("xl/worksheets/sheet1.xml")
+        cols = "".join(
+            f'<col min="{i}" max="{i}" width="{width}" customWidth="1"/>'
+            for i, (_, _, width) in enumerate(self.columns, start=1)
+        )
+        header = "".join(_text_cell(title, _CELL_STYLES[(TEXT, True)]) for title, _, _ in self.columns)
+        self._sheet.write((
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+            '<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" state="frozen"/></sheetView></sheetViews>'
+            f'<cols>{cols}</cols><sheetData><row>{header}</row>'
+        ).encode("utf-8"))
+        chunks.append(archive.drain())
+        return b"".join(chunks)
+
+    def _row_xml(self, values, bold: bool) -> str:
+        cells = []
+        for value, (_, kind, _) in zip(values, self.columns):
+            if value is None or value == "" or (isinstance(value, float) and not math.isfinite(value)):
+                # NaN / infini : pas de représentation valide dans une cellule
+                cells.append("<c/>")
+            elif kind != TEXT and isinstance(value, (int, float)):
+                cells.append(f'<c s="{_CELL_STYLES[(kind, bold)]}"><v>{value!r}</v></c>')
+            else:
+                cells.append(_text_cell(value, _CELL_STYLES[(TEXT, bold)]))
+        return f"<row>{''.join(cells)}</row>"
+
+    def write_rows(self, rows: Iterable) -> Iterator[bytes]:
+        """Écrit les lignes par lots et produit les octets compressés"""
+        batch = []
+        for values, bold in rows:
+            batch.append(self._row_xml(values, bold))
+            if len(batch) >= ROWS_PER_CHUNK:
+                self._sheet.write("".join(batch).encode("utf-8"))
+                batch.clear()
+                chunk = self._archive.drain()
+                if chunk:
+                    yield chunk
+        if batch:
+            self._sheet.write("".join(batch).encode("utf-8"))
+        chunk = self._archive.drain()
+        if chunk:
+            yield chunk
+
+    def finish(self) -> bytes:
+        self._sheet.write(b"</sheetData></worksheet>")
+        self._sheet.close()
+        self._sheet = None
+        return self._archive.drain() + self._archive.close()
@@ -0,0 +1,91 @@
+"""
+Écriture d'archives ZIP en flux.
+
+ZipStream écrit dans un tampon non positionnable : zipfile utilise alors des
+descripteurs de données, ce qui permet d'envoyer chaque entrée au client dès
+qu'elle est écrite, sans jamais garder l'archive complète en mémoire.
+"""
+import io
+import time
+import zipfile
+
+
+class _ChunkSink(io.RawIOBase):
+    """Flux en écriture seule dont on récupère le contenu par morceaux"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ZipStream:
+    """
+    Usage :
+        archive = ZipStream()
+        yield archive.add("a.pdf", data)
+        ...
+        yield archive.close()
+
+    Pour une entrée produite au fil de l'eau (trop grosse pour être
+    construite en mémoire) :
+        with archive.open_entry("gros.xml") as entry:
+            for part in parts:
+                entry.write(part)
+                yield archive.drain()
+        yield archive.drain()
+    """
+
+    def __init__(self, compression=zipfile.ZIP_STORED):
+        self._sink = _ChunkSink()
+        self._zip = zipfile.ZipFile(self._sink, mode="w", compression=compression)
+        self._names = set()
+
+    def unique_name(self, name: str) -> str:
+        """Évite les doublons de noms dans l'archive (Devis_X.pdf, Devis_X (2).pdf...)"""
+        if name not in self._names:
+            self._names.add(name)
+            return name
+        stem, dot, ext = name.rpartition(".")
+        if not dot:
+            stem, ext = name, ""
+        i = 2
+        while True:
+            candidate = f"{stem} ({i}){dot}{ext}"
+            if candidate not in self._names:
+                self._names.add(candidate)
+                return candidate
+            i += 1
+
+    def add(self, name: str, data: bytes) -> bytes:
+        """Ajoute une entrée et retourne les octets à envoyer"""
+        info = zipfile.ZipInfo(self.unique_name(name), date_time=time.localtime()[:6])
+        info.compress_type = self._zip.compression
+        self._zip.writestr(info, data)
+        return self._sink.drain()
+
+    def open_entry(self, name: str):
+        """Ouvre une entrée en écriture (taille inconnue à l'avance)"""
+        info = zipfile.ZipInfo(self.unique_name(name), date_time=time.localtime()[:6])
+        info.compress_type = self._zip.compression
+        return self._zip.open(info, mode="w")
+
+    def drain(self) -> bytes:
+        """Octets écrits depuis le dernier appel"""
+        return self._sink.drain()
+
+    def close(self) -> bytes:
+        """Écrit le répertoire central et retourne les derniers octets"""
+        self._zip.close()
+        return self._sink.drain()
@@ -0,0 +1,13 @@
+"""
+Configuration commune des tests : les modules de l'API (backend/) sont
+importés comme au lancement du serveur, et server.py trouve les variables
+d'environnement qu'il exige (aucune connexion n'est ouverte à l'import).
+"""
+import os
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend")
+sys.path.insert(0, BACKEND_DIR)
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
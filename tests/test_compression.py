@@ -0,0 +1,81 @@
+import gzip
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from compression import COMPRESSION_MIN_SIZE, CompressionMiddleware, choose_encoding
+
+LARGE = {"postes": ["x" * 50] * 100}
+
+
+def make_client(minimum_size: int = COMPRESSION_MIN_SIZE) -> TestClient:
+    async def small(request):
+        return JSONResponse({"ok": True})
+
+    async def large(request):
+        return JSONResponse(LARGE, headers={"Vary": "Origin"})
+
+    async def pdf(request):
+        return Response(b"%PDF" * 1000, media_type="application/pdf")
+
+    async def stream(request):
+        async def chunks():
+            for _ in range(10):
+                yield b"ligne;" * 100 + b"\n"
+        return StreamingResponse(chunks(), media_type="text/csv")
+
+    app = Starlette(routes=[
+        Route("/small", small), Route("/large", large), Route("/pdf", pdf), Route("/stream", stream),
+    ])
+    app.add_middleware(CompressionMiddleware, minimum_size=minimum_size)
+    return TestClient(app)
+
+
+def test_below_threshold_is_not_compressed():
+    response = make_client().get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert response.json() == {"ok": True}
+
+
+def test_above_threshold_is_compressed_with_vary():
+    response = make_client().get("/large", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Origin, Accept-Encoding"
+    assert int(response.headers["content-length"]) < COMPRESSION_MIN_SIZE
+    assert response.json() == LARGE
+
+
+def test_threshold_is_configurable():
+    response = make_client(minimum_size=10).get("/small", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "accept-encoding" in response.headers["vary"].lower()
+
+
+def test_without_accept_encoding_is_not_compressed():
+    response = make_client().get("/large", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    assert response.json() == LARGE
+
+
+def test_already_compressed_types_pass_through():
+    response = make_client().get("/pdf", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert response.content == b"%PDF" * 1000
+
+
+def test_streaming_body_is_compressed_without_length():
+    client = make_client()
+    with client.stream("GET", "/stream", headers={"Accept-Encoding": "gzip"}) as response:
+        raw = b"".join(response.iter_raw())
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    assert gzip.decompress(raw) == (b"ligne;" * 100 + b"\n") * 10
+
+
+def test_choose_encoding_honours_q_values():
+    assert choose_encoding(None) is None
+    assert choose_encoding("gzip;q=0") is None
+    assert choose_encoding("identity") is None
+    assert choose_encoding("gzip, deflate") == "gzip"
@@ -0,0 +1,57 @@
+from devis_cache import DevisCache, document_size
+
+
+def devis(devis_id: str, version: int = 1, notes: str = "") -> dict:
+    return {"id": devis_id, "version": version, "notes": notes, "postes": []}
+
+
+def test_evicts_least_recently_used_by_bytes():
+    size = document_size(devis("a"))
+    cache = DevisCache(max_bytes=size * 3)
+    for devis_id in ("a", "b", "c"):
+        cache.put("u1", devis(devis_id))
+    assert cache.get("u1", "a", 1) is not None  # « a » redevient le plus récent
+
+    cache.put("u1", devis("d"))
+
+    assert cache.peek("u1", "b") is None
+    assert all(cache.peek("u1", devis_id) for devis_id in ("a", "c", "d"))
+    assert cache.size == size * 3
+    assert cache.metrics()["evictions"] == 1
+
+
+def test_one_large_document_evicts_several_small_ones():
+    small = document_size(devis("a"))
+    cache = DevisCache(max_bytes=small * 4)
+    for devis_id in ("a", "b", "c", "d"):
+        cache.put("u1", devis(devis_id))
+
+    large = devis("e", notes="x" * (small * 2))
+    cache.put("u1", large)
+
+    assert [cache.peek("u1", devis_id) is not None for devis_id in "abcde"] == [False, False, False, True, True]
+    assert cache.size <= cache.max_bytes
+    assert cache.size == small + document_size(large)
+
+
+def test_document_larger_than_max_entry_is_not_cached():
+    cache = DevisCache(max_bytes=10_000, max_entry=100)
+    cache.put("u1", devis("a", notes="x" * 200))
+    assert cache.peek("u1", "a") is None
+    assert cache.size == 0
+
+
+def test_replacing_an_entry_updates_the_size():
+    cache = DevisCache()
+    cache.put("u1", devis("a", version=1, notes="court"))
+    cache.put("u1", devis("a", version=2, notes="beaucoup plus long"))
+    assert cache.size == document_size(devis("a", version=2, notes="beaucoup plus long"))
+    assert cache.get("u1", "a", 1) is None
+    assert cache.get("u1", "a", 2)["notes"] == "beaucoup plus long"
+
+
+def test_older_version_does_not_replace_newer():
+    cache = DevisCache()
+    cache.put("u1", devis("a", version=3))
+    cache.put("u1", devis("a", version=2))
+    assert cache.peek("u1", "a")["version"] == 3
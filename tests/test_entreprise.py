@@ -0,0 +1,45 @@
+import asyncio
+
+import httpx
+import pytest
+
+import server
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = mongomock_motor.AsyncMongoMockClient()["test"]
+    monkeypatch.setattr(server, "db", database)
+    return database
+
+
+async def register(client: httpx.AsyncClient) -> dict:
+    response = await client.post("/api/auth/register", json={
+        "email": "artisan@example.fr", "password": "secret123", "nom": "Artisan",
+    })
+    assert response.status_code == 200
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def test_entreprise_of_new_user_is_empty_profile(db):
+    async def scenario():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            headers = await register(client)
+            return await client.get("/api/entreprise", headers=headers)
+
+    response = asyncio.run(scenario())
+    assert response.status_code == 200
+    assert response.json()["nom"] == server.EntrepriseInfo().nom
+
+
+def test_entreprise_of_unknown_user_is_404(db):
+    async def scenario():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            token = server.create_access_token({"sub": "inconnu"})
+            return await client.get("/api/entreprise", headers={"Authorization": f"Bearer {token}"})
+
+    assert asyncio.run(scenario()).status_code == 404
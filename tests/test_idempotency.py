@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from pydantic import BaseModel
+from starlette.responses import JSONResponse
+
+from idempotency import IdempotencyStore
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+
+class Payload(BaseModel):
+    nom: str
+
+
+def make_store() -> IdempotencyStore:
+    return IdempotencyStore(mongomock_motor.AsyncMongoMockClient()["test"])
+
+
+class Handler:
+    def __init__(self, delay: float = 0):
+        self.calls = 0
+        self.delay = delay
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return JSONResponse({"id": f"devis-{self.calls}"}, status_code=201, headers={"ETag": '"1"'})
+
+
+def test_same_key_replays_recorded_response():
+    async def scenario():
+        store, handler = make_store(), Handler()
+        first = await store.run("u1", "devis", "cle-1", Payload(nom="A"), handler)
+        second = await store.run("u1", "devis", "cle-1", Payload(nom="A"), handler)
+        return handler, first, second
+
+    handler, first, second = asyncio.run(scenario())
+    assert handler.calls == 1
+    assert second.status_code == 201
+    assert second.body == first.body
+    assert second.headers["etag"] == '"1"'
+    assert second.headers["idempotent-replayed"] == "true"
+    assert "idempotent-replayed" not in first.headers
+
+
+def test_concurrent_duplicates_run_once():
+    async def scenario():
+        store, handler = make_store(), Handler(delay=0.05)
+        responses = await asyncio.gather(*(
+            store.run("u1", "devis", "cle-1", Payload(nom="A"), handler) for _ in range(3)
+        ))
+        return handler, responses
+
+    handler, responses = asyncio.run(scenario())
+    assert handler.calls == 1
+    assert len({response.body for response in responses}) == 1
+
+
+def test_key_reused_with_other_body_is_rejected():
+    async def scenario():
+        store, handler = make_store(), Handler()
+        await store.run("u1", "devis", "cle-1", Payload(nom="A"), handler)
+        await store.run("u1", "devis", "cle-1", Payload(nom="B"), handler)
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(scenario())
+    assert error.value.status_code == 422
+
+
+def test_keys_are_scoped_by_user_and_endpoint():
+    async def scenario():
+        store, handler = make_store(), Handler()
+        await store.run("u1", "devis", "cle-1", Payload(nom="A"), handler)
+        await store.run("u2", "devis", "cle-1", Payload(nom="A"), handler)
+        await store.run("u1", "factures", "cle-1", Payload(nom="A"), handler)
+        return handler
+
+    assert asyncio.run(scenario()).calls == 3
+
+
+def test_invalid_key_is_rejected():
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(make_store().run("u1", "devis", "x" * 256, Payload(nom="A"), Handler()))
+    assert error.value.status_code == 400
+
+
+def test_failed_request_releases_key():
+    async def failing():
+        raise RuntimeError("panne")
+
+    async def scenario():
+        store, handler = make_store(), Handler()
+        with pytest.raises(RuntimeError):
+            await store.run("u1", "devis", "cle-1", Payload(nom="A"), failing)
+        response = await store.run("u1", "devis", "cle-1", Payload(nom="A"), handler)
+        return handler, response
+
+    handler, response = asyncio.run(scenario())
+    assert handler.calls == 1
+    assert "idempotent-replayed" not in response.headers
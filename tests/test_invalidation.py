@@ -0,0 +1,127 @@
+import asyncio
+import os
+import time
+import uuid
+
+import pytest
+
+from devis_cache import DevisCache
+from events import EventBroker
+from invalidation import GAP, BusFanout, InvalidationBus, MongoCappedBackend
+
+# Test de propagation réel (curseur tailable) : MongoDB requis, ex.
+# INVALIDATION_TEST_MONGO_URL=mongodb://localhost:27017
+MONGO_URL = os.environ.get("INVALIDATION_TEST_MONGO_URL")
+
+
+class SharedBackend:
+    """Transport en mémoire commun à plusieurs bus (un par « worker »)"""
+
+    def __init__(self, hub: list):
+        self.hub = hub
+
+    async def start(self, deliver):
+        self.hub.append(deliver)
+
+    async def publish(self, message: dict):
+        for deliver in list(self.hub):
+            deliver(dict(message))
+
+    async def stop(self):
+        pass
+
+
+class Worker:
+    """Bus, broker d'événements et cache de devis d'un processus"""
+
+    def __init__(self, backend):
+        self.bus = InvalidationBus(backend)
+        self.broker = EventBroker(BusFanout(self.bus))
+        self.devis_cache = DevisCache()
+        self.broker.add_listener(self.devis_cache.on_change)
+        self.profiles = []
+        self.bus.subscribe("profile", lambda key, payload: self.profiles.append(key))
+
+    async def start(self):
+        await self.bus.start()
+        await self.broker.start()
+
+    async def stop(self):
+        await self.broker.stop()
+        await self.bus.stop()
+
+
+def devis(version: int) -> dict:
+    return {"id": "d1", "version": version, "postes": []}
+
+
+def test_change_on_one_worker_evicts_cache_of_the_other():
+    async def scenario():
+        hub = []
+        writer, reader = Worker(SharedBackend(hub)), Worker(SharedBackend(hub))
+        await writer.start()
+        await reader.start()
+        reader.devis_cache.put("u1", devis(1))
+
+        await writer.broker.publish("u1", "devis.updated", id="d1", version=2)
+        await writer.bus.publish("profile", "u1")
+        return writer, reader
+
+    writer, reader = asyncio.run(scenario())
+    assert reader.devis_cache.peek("u1", "d1") is None
+    assert reader.profiles == ["u1"]
+    assert writer.profiles == ["u1"]  # appliqué localement, pas une seconde fois à la réception
+    assert reader.bus.received == 2
+    assert writer.bus.received == 0
+
+
+def test_gap_invalidates_every_namespace():
+    calls = []
+    bus = InvalidationBus()
+    bus.subscribe("catalog", lambda key, payload: calls.append(("catalog", key)))
+    bus.subscribe("profile", lambda key, payload: calls.append(("profile", key)))
+    bus._receive(GAP)
+    assert sorted(calls) == [("catalog", None), ("profile", None)]
+
+
+@pytest.mark.skipif(not MONGO_URL, reason="MongoDB requis (INVALIDATION_TEST_MONGO_URL)")
+def test_capped_collection_delivers_between_workers_under_100ms():
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    messages = 50
+
+    async def scenario():
+        db_name = f"test_invalidation_{uuid.uuid4().hex[:8]}"
+        clients = [AsyncIOMotorClient(MONGO_URL), AsyncIOMotorClient(MONGO_URL)]
+        writer = Worker(MongoCappedBackend(clients[0][db_name]))
+        reader = Worker(MongoCappedBackend(clients[1][db_name]))
+        sent, latencies, done = {}, [], asyncio.Event()
+
+        def on_bench(key, payload):
+            latencies.append(time.perf_counter() - sent[key])
+            if len(latencies) == messages:
+                done.set()
+
+        reader.bus.subscribe("bench", on_bench)
+        try:
+            await writer.start()
+            await reader.start()
+            await asyncio.sleep(0.5)  # curseur du lecteur ouvert
+            reader.devis_cache.put("u1", devis(1))
+            await writer.broker.publish("u1", "devis.updated", id="d1", version=2)
+            for i in range(messages):
+                sent[str(i)] = time.perf_counter()
+                await writer.bus.publish("bench", str(i))
+                await asyncio.sleep(0.01)
+            await asyncio.wait_for(done.wait(), 10)
+            return reader, sorted(latencies)
+        finally:
+            await writer.stop()
+            await reader.stop()
+            await clients[0].drop_database(db_name)
+            for client in clients:
+                client.close()
+
+    reader, latencies = asyncio.run(scenario())
+    assert reader.devis_cache.peek("u1", "d1") is None
+    assert latencies[int(len(latencies) * 0.95) - 1] < 0.1
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    calls = 0
+
+    async def load():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return {"valeur": calls}
+
+    async def scenario():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do("cle", load) for _ in range(5)))
+        return flight, results
+
+    flight, results = asyncio.run(scenario())
+    assert calls == 1
+    assert all(result is results[0] for result in results)
+    assert flight.metrics() == {"executions": 1, "coalesced": 4, "errors": 0, "in_flight": 0}
+
+
+def test_error_reaches_every_caller_and_is_not_cached():
+    calls = 0
+
+    async def failing():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        raise ValueError("lecture impossible")
+
+    async def scenario():
+        flight = SingleFlight()
+        outcomes = await asyncio.gather(*(flight.do("cle", failing) for _ in range(3)), return_exceptions=True)
+        retry = await flight.do("cle", lambda: asyncio.sleep(0, result="ok"))
+        return flight, outcomes, retry
+
+    flight, outcomes, retry = asyncio.run(scenario())
+    assert calls == 1
+    assert all(isinstance(outcome, ValueError) for outcome in outcomes)
+    assert retry == "ok"
+    assert flight.metrics()["errors"] == 1
+    assert flight.metrics()["executions"] == 2
+
+
+def test_cancelled_caller_does_not_cancel_shared_operation():
+    async def slow():
+        await asyncio.sleep(0.05)
+        return "pdf"
+
+    async def scenario():
+        flight = SingleFlight()
+        first = asyncio.create_task(flight.do("cle", slow))
+        second = asyncio.create_task(flight.do("cle", slow))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(scenario()) == "pdf"
+
+
+def test_forget_detaches_later_calls():
+    async def scenario():
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def stale():
+            await release.wait()
+            return "ancien"
+
+        first = asyncio.create_task(flight.do("cle", stale))
+        await asyncio.sleep(0)
+        flight.forget("cle")
+        fresh = await flight.do("cle", lambda: asyncio.sleep(0, result="nouveau"))
+        release.set()
+        return await first, fresh
+
+    assert asyncio.run(scenario()) == ("ancien", "nouveau")